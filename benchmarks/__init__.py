@@ -0,0 +1,3 @@
+"""
+Benchmarks of the toy robot simulator, run them from the repository root, e.g. python -m benchmarks.memory
+"""
@@ -0,0 +1,253 @@
+"""
+Benchmark suite of the simulator hot paths: Table.get_coordinate, Robot.turn and get_f, ToyRobotSimulator.perform
+for each action, place, command script replay on tables from 5x5 up to 100k x 100k and fleet steps from 1 robot up
+to 1M robots. Results are written as JSON, and compared with a stored baseline to flag regressions.
+
+Usage:
+    python -m benchmarks.hot_paths [--full] [--filter TEXT] [--output results.json]
+    python -m benchmarks.hot_paths --compare baseline.json [--threshold 0.1]
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from engine import CommandEngine
+from models import Robot, Table
+from simulator import ToyRobotSimulator
+from sinks import NullSink
+
+TABLE_SIZES = [5, 100, 1000]
+FULL_TABLE_SIZES = TABLE_SIZES + [100000]
+FLEET_SIZES = [1, 1000, 100000]
+FULL_FLEET_SIZES = FLEET_SIZES + [1000000]
+
+# number of operations done by one call of a benchmark function
+BATCH = 1000
+SCRIPT_LENGTH = 10000
+
+FACING = ['SOUTH', 'WEST', 'NORTH', 'EAST']
+
+
+def random_script(size, length, seed=0):
+    rnd = random.Random(seed)
+    script = ['PLACE %s,%s,NORTH' % (size // 2, size // 2)]
+    commands = ['MOVE', 'MOVE', 'MOVE', 'LEFT', 'RIGHT', 'REPORT']
+    script.extend(commands[rnd.randint(0, len(commands) - 1)] for i in range(length - 1))
+    return script
+
+
+def deployed(size):
+    trs = ToyRobotSimulator('bench', NullSink())
+    trs.deploy([{'name': 'table', 'dx': size, 'dy': size, 'rule': None}], ['robot'])
+    robot, table = trs.robots['robot'], trs.tables['table']
+    trs.place(robot, table, size // 2, size // 2, 'NORTH')
+    return trs, robot, table
+
+
+def bench_get_coordinate(size):
+    table = Table('table', size, size)
+    rnd = random.Random(0)
+    points = [(rnd.randint(-1, size), rnd.randint(-1, size)) for i in range(BATCH)]
+
+    def run():
+        get_coordinate = table.get_coordinate
+        for x, y in points:
+            get_coordinate(x, y)
+    return run, BATCH
+
+
+def bench_turn():
+    trs, robot, table = deployed(5)
+
+    def run():
+        for i in range(BATCH // 2):
+            robot.turn_left()
+            robot.turn_right()
+    return run, BATCH
+
+
+def bench_get_f():
+    robot = Robot('robot')
+    degrees = [(i * 90) % 360 for i in range(BATCH)]
+
+    def run():
+        get_f = robot.get_f
+        for degree in degrees:
+            get_f(degree)
+    return run, BATCH
+
+
+def bench_perform(action):
+    trs, robot, table = deployed(100)
+
+    def run():
+        perform = trs.perform
+        for i in range(BATCH):
+            perform(robot, action)
+        if action == 'MOVE':
+            robot.turn_right()
+            robot.turn_right()
+    return run, BATCH
+
+
+def bench_place():
+    trs, robot, table = deployed(100)
+    rnd = random.Random(0)
+    places = [(rnd.randint(0, 99), rnd.randint(0, 99), FACING[rnd.randint(0, 3)]) for i in range(BATCH)]
+
+    def run():
+        place = trs.place
+        for x, y, f in places:
+            place(robot, table, x, y, f)
+    return run, BATCH
+
+
+def bench_replay(size):
+    trs, robot, table = deployed(size)
+    engine = CommandEngine(trs)
+    script = random_script(size, SCRIPT_LENGTH)
+
+    def run():
+        for report in engine.run(script, robot, table):
+            pass
+    return run, SCRIPT_LENGTH
+
+
+def bench_replay_compiled(size):
+    trs, robot, table = deployed(size)
+    engine = CommandEngine(trs)
+    program = engine.compile(random_script(size, SCRIPT_LENGTH))
+
+    def run():
+        for report in engine.run_compiled(program, robot, table):
+            pass
+    return run, SCRIPT_LENGTH
+
+
+def bench_fleet_step(robots):
+    from bytecode import OP_MOVE
+    from fleet import Fleet
+    fleet = Fleet([Table('table', 1000, 1000)])
+    ids = fleet.add_robots(['robot%s' % i for i in range(robots)])
+    fleet.place(ids, 0, ids % 1000, (ids // 1000) % 1000, 'NORTH')
+
+    def run():
+        fleet.step(OP_MOVE)
+        fleet.turn('LEFT')
+    return run, 2 * robots
+
+
+def benchmarks(full=False):
+    """
+    Yield (name, factory) of all benchmarks, factory returns the function to time and its number of operations
+    """
+    for size in FULL_TABLE_SIZES if full else TABLE_SIZES:
+        yield 'get_coordinate[%sx%s]' % (size, size), lambda size=size: bench_get_coordinate(size)
+    yield 'robot.turn', bench_turn
+    yield 'robot.get_f', bench_get_f
+    for action in ['MOVE', 'LEFT', 'RIGHT', 'REPORT']:
+        yield 'perform[%s]' % action, lambda action=action: bench_perform(action)
+    yield 'place', bench_place
+    for size in FULL_TABLE_SIZES if full else TABLE_SIZES:
+        yield 'replay[%sx%s]' % (size, size), lambda size=size: bench_replay(size)
+        yield 'replay_compiled[%sx%s]' % (size, size), lambda size=size: bench_replay_compiled(size)
+    try:
+        import numpy
+    except ImportError:
+        return
+    for robots in FULL_FLEET_SIZES if full else FLEET_SIZES:
+        yield 'fleet_step[%s]' % robots, lambda robots=robots: bench_fleet_step(robots)
+
+
+def measure(factory, min_time=0.2, repeat=5):
+    """
+    Time the benchmark, return the best nanoseconds per operation over repeat rounds of at least min_time / repeat
+    seconds each
+    """
+    run, ops = factory()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        loops *= 2
+    best = elapsed
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(loops):
+            run()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e9 / (loops * ops)
+
+
+def run_all(full=False, name_filter=None, min_time=0.2):
+    results = {}
+    for name, factory in benchmarks(full):
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(factory, min_time)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'unit': 'ns/op',
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with baseline, return the list of (name, baseline ns/op, ns/op, change) of regressions slower
+    than baseline by more than threshold
+    """
+    regressions = []
+    for name, value in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base:
+            change = (value - base) / base
+            if change > threshold:
+                regressions.append((name, base, value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulator hot paths')
+    parser.add_argument('--full', action='store_true', help='include 100k x 100k tables and 1M robot fleets')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent timing each benchmark')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='baseline JSON results to flag regressions against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown ratio counted as regression')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.full, args.filter, args.min_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline = json.load(stream)
+
+    for name, value in results['results'].items():
+        line = "%-32s %12.1f ns/op" % (name, value)
+        if baseline and name in baseline['results']:
+            line += "  %+6.1f%%" % (100.0 * (value - baseline['results'][name]) / baseline['results'][name])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name, base, value, change in regressions:
+            print("REGRESSION %s: %.1f -> %.1f ns/op (%+.1f%%)" % (name, base, value, 100.0 * change))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
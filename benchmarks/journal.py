@@ -0,0 +1,107 @@
+"""
+Benchmark of the cost of journaling: commands per second of a seeded workload replayed without a journal, with a
+journal written without fsync and with one fsync per block, and the time to recover the simulator from the whole
+journal compared to a checkpoint and the journal tail written after it.
+
+Usage: python -m benchmarks.journal [--commands N] [--robots N] [--batch N] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import journal
+from engine import CommandEngine
+from simulator import ToyRobotSimulator
+from sinks import NullSink
+from workload import Workload
+
+
+def simulator(workload):
+    trs = ToyRobotSimulator('trs', NullSink())
+    workload.deploy(trs)
+    return trs
+
+
+def replay(workload, path=None, batch_size=4096, fsync=True):
+    # seconds to replay workload, recording a journal at path unless None
+    trs = simulator(workload)
+    if path is not None:
+        trs.journal = journal.Journal(path, batch_size, fsync)
+    start = time.perf_counter()
+    workload.run(trs, deploy=False)
+    if trs.journal is not None:
+        trs.journal.close()
+    return time.perf_counter() - start
+
+
+def recovery(workload, directory, batch_size=4096, tail=0.1):
+    # seconds to recover from the whole journal, and from a checkpoint taken before the last tail of the workload
+    full_path = os.path.join(directory, 'full.journal')
+    replay(workload, full_path, batch_size, fsync=False)
+    start = time.perf_counter()
+    journal.recover(simulator(workload), None, full_path)
+    full = time.perf_counter() - start
+
+    tail_path = os.path.join(directory, 'tail.journal')
+    snapshot_path = os.path.join(directory, 'checkpoint')
+    trs = simulator(workload)
+    trs.journal = journal.Journal(tail_path, batch_size, fsync=False)
+    lines = list(workload.lines())
+    cut = int(len(lines) * (1 - tail))
+    # cut at a selection line so the tail selects its robot first
+    while cut < len(lines) and ',' not in lines[cut]:
+        cut += 1
+    engine = CommandEngine(trs)
+    for report in engine.run(lines[:cut]):
+        pass
+    journal.checkpoint(trs, trs.journal, snapshot_path)
+    for report in engine.run(lines[cut:]):
+        pass
+    trs.journal.close()
+    start = time.perf_counter()
+    journal.recover(simulator(workload), snapshot_path, tail_path)
+    return full, time.perf_counter() - start
+
+
+def run(commands, robots, batch_size):
+    workload = Workload(robots=robots, tables=max(robots // 100, 1), commands=commands)
+    directory = tempfile.mkdtemp()
+    try:
+        seconds = {
+            'no journal': replay(workload),
+            'journal': replay(workload, os.path.join(directory, 'nosync.journal'), batch_size, fsync=False),
+            'journal+fsync': replay(workload, os.path.join(directory, 'fsync.journal'), batch_size),
+        }
+        results = dict((name, commands / elapsed) for name, elapsed in seconds.items())
+        results['recover full'], results['recover checkpoint'] = recovery(workload, directory, batch_size)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare command throughput with and without a journal')
+    parser.add_argument('--commands', type=int, default=200000, help='number of workload commands')
+    parser.add_argument('--robots', type=int, default=1000, help='number of robots')
+    parser.add_argument('--batch', type=int, default=4096, help='journal records per block')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.commands, args.robots, args.batch)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        base = results['no journal']
+        for name in ('no journal', 'journal', 'journal+fsync'):
+            print("%-20s %12.0f commands/s  %5.1f%%" % (name, results[name], 100.0 * results[name] / base))
+        for name in ('recover full', 'recover checkpoint'):
+            print("%-20s %12.3f ms" % (name, results[name] * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Load generator for the simulator server. It opens many concurrent sessions, each driving its own robot with one
+command at a time, and reports throughput and p50/p99 command latency. Without --port or --unix an in-process
+server is started.
+
+Usage: python -m benchmarks.loadgen [--sessions N] [--commands N] [--host HOST --port PORT | --unix PATH] [--json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from server import SimulatorServer
+from simulator import ToyRobotSimulator
+from sinks import NullSink
+
+
+COMMANDS = ['MOVE', 'MOVE', 'LEFT', 'RIGHT', 'REPORT']
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+async def session(robot, table, commands, connect, latencies, seed):
+    rnd = random.Random(seed)
+    reader, writer = await connect()
+    try:
+        lines = ['%s,%s' % (robot, table), 'PLACE %s,%s,NORTH' % (rnd.randint(0, 99), rnd.randint(0, 99))]
+        lines += [COMMANDS[rnd.randint(0, len(COMMANDS) - 1)] for i in range(commands)]
+        lines.append('END')
+        for line in lines:
+            start = time.perf_counter()
+            writer.write(line.encode('utf-8') + b'\n')
+            await reader.readline()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    server = None
+    if args.port or args.unix:
+        host, port, path = args.host, args.port, args.unix
+    else:
+        trs = ToyRobotSimulator('loadgen', NullSink())
+        trs.deploy([{'name': 'table1', 'dx': 100, 'dy': 100, 'rule': None}],
+                   ['robot%s' % (i + 1) for i in range(args.sessions)])
+        server = SimulatorServer(trs)
+        await server.start('127.0.0.1', 0)
+        host, port, path = '127.0.0.1', server.server.sockets[0].getsockname()[1], None
+
+    def connect():
+        if path:
+            return asyncio.open_unix_connection(path)
+        return asyncio.open_connection(host, port)
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[session('robot%s' % (i + 1), args.table, args.commands, connect, latencies, args.seed + i)
+                           for i in range(args.sessions)])
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.close()
+
+    return {
+        'sessions': args.sessions,
+        'commands': len(latencies),
+        'seconds': elapsed,
+        'commands_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure command latency of the simulator server')
+    parser.add_argument('--sessions', type=int, default=100, help='number of concurrent sessions')
+    parser.add_argument('--commands', type=int, default=100, help='number of commands per session')
+    parser.add_argument('--table', default='table1', help='table the robots are placed on')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='port of a running server')
+    parser.add_argument('--unix', help='Unix socket path of a running server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("%(sessions)s sessions, %(commands)s commands in %(seconds).2fs: %(commands_per_second).0f commands/s, "
+              "p50 %(p50_ms).3fms, p99 %(p99_ms).3fms" % results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Memory benchmark comparing the bytes per robot of robot representations: __dict__ based robots and coordinates as
+before, slotted Robot and Coordinate, slotted Robot with interned coordinates, and the packed RobotStore.
+
+Usage: python -m benchmarks.memory [--robots N] [--size N] [--json]
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+
+from compact import InternedCoordinate, RobotStore
+from models import Coordinate, Robot, Table
+
+
+class DictCoordinate(object):
+    """
+    Coordinate with a __dict__, as it was before Coordinate got __slots__. It does not subclass Coordinate, whose
+    slots would be laid out in every instance on top of the __dict__
+    """
+
+    def __init__(self, x, y):
+        if isinstance(x, int) and isinstance(y, int):
+            self.x = x
+            self.y = y
+        else:
+            raise TypeError('Coordinate x,y must be int')
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+
+class DictRobot(object):
+    """
+    Robot with a __dict__, as it was before Robot got __slots__, keeping the methods the benchmark uses
+    """
+
+    facing_directions = Robot.facing_directions
+
+    def __init__(self, name):
+        if name:
+            self.name = str(name)
+        else:
+            raise AttributeError('Name cannot be None or empty string')
+        self.last_position = None
+        self.coordinate = None
+        self.f = None
+        self.degree = None
+
+    def set_coordinate_and_f(self, coordinate, f):
+        self.coordinate = coordinate
+        self.last_position = coordinate
+        self.f = str(f)
+        self.degree = self.facing_directions[f] if f in self.facing_directions.keys() else 0
+        return True
+
+    def is_placed(self):
+        if self.coordinate and self.f:
+            return True
+        return False
+
+    def move_to(self, coordinate):
+        if self.is_placed() and coordinate:
+            self.last_position = self.coordinate
+            self.coordinate = coordinate
+            if self.last_position != self.coordinate:
+                return True
+        return False
+
+
+FACING = ['SOUTH', 'WEST', 'NORTH', 'EAST']
+
+
+def build_robots(robot_cls, coordinate_cls, count, size):
+    robots = []
+    for i in range(count):
+        robot = robot_cls('robot%s' % i)
+        x, y = i % size, (i // size) % size
+        robot.set_coordinate_and_f(coordinate_cls(x, y), FACING[i % 4])
+        # a moved robot holds different coordinate and last position
+        robot.move_to(coordinate_cls(x, (y + 1) % size))
+        robots.append(robot)
+    return robots
+
+
+def build_store(count, size):
+    table = Table('table', size, size)
+    store = RobotStore([table])
+    robot = Robot('robot')
+    for i in range(count):
+        x, y = i % size, (i // size) % size
+        robot.name = 'robot%s' % i
+        robot.set_coordinate_and_f(Coordinate(x, y), FACING[i % 4])
+        robot.move_to(Coordinate(x, (y + 1) % size))
+        store.pack(robot, table)
+    return store
+
+
+def measure(build, count, size):
+    """
+    Return the bytes allocated per robot by build(count, size), names of robots excluded.
+    """
+    names = ['robot%s' % i for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(count, size)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    name_bytes = sum(sys.getsizeof(name) for name in names)
+    del result
+    return float(after - before - name_bytes) / count
+
+
+def run(count, size):
+    InternedCoordinate.clear()
+    variants = [
+        ('dict', lambda c, s: build_robots(DictRobot, DictCoordinate, c, s)),
+        ('slots', lambda c, s: build_robots(Robot, Coordinate, c, s)),
+        ('slots+interned', lambda c, s: build_robots(Robot, InternedCoordinate, c, s)),
+        ('packed', build_store),
+    ]
+    return dict((name, measure(build, count, size)) for name, build in variants)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare bytes per robot of robot representations')
+    parser.add_argument('--robots', type=int, default=100000, help='number of robots to create')
+    parser.add_argument('--size', type=int, default=100, help='table dimension, coordinates are shared within it')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.robots, args.size)
+    if args.json:
+        print(json.dumps({'robots': args.robots, 'size': args.size, 'bytes_per_robot': results}, indent=2))
+    else:
+        base = results['dict']
+        for name, value in results.items():
+            print("%-16s %8.1f bytes/robot  %5.1f%%" % (name, value, 100.0 * value / base))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the startup latency of short-lived workers: the time to import the embedding API and the simulator in
+a new interpreter, the time from there to the first command result, and the latency of one script on a warm
+WorkerPool. Each cold measurement runs in a fresh process and the best of several runs is kept.
+
+Usage: python -m benchmarks.startup [--runs N] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from embed import WorkerPool
+
+SCRIPT = ['robot1,table1', 'PLACE 0,0,NORTH', 'MOVE', 'REPORT']
+
+# code timed in a fresh interpreter, printing the seconds of each phase as JSON
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import embed
+embedded = time.perf_counter()
+import simulator, engine
+imported = time.perf_counter()
+reports = embed.run(%r)
+done = time.perf_counter()
+assert reports == ['0,1,NORTH'], reports
+print(json.dumps({'import_embed': embedded - start, 'import_simulator': imported - embedded,
+                  'first_command': done - imported}))
+''' % (SCRIPT,)
+
+
+def cold(runs):
+    # best seconds of each phase, and of the whole interpreter run, over runs fresh processes
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = {}
+    for i in range(runs):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=root)
+        total = time.perf_counter() - start
+        phases = json.loads(output.decode('utf-8'))
+        phases['process'] = total
+        for name, seconds in phases.items():
+            best[name] = min(best.get(name, seconds), seconds)
+    return best
+
+
+def warm(runs, size=2):
+    # best seconds of one script on a warm worker pool
+    with WorkerPool(size) as pool:
+        pool.map([SCRIPT] * size)
+        best = None
+        for i in range(runs):
+            start = time.perf_counter()
+            pool.run(SCRIPT)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the import time and first command latency')
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh processes measured')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = cold(args.runs)
+    results['warm_pool_script'] = warm(args.runs * 10)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for name, seconds in sorted(results.items()):
+            print("%-24s %10.3f ms" % (name, seconds * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
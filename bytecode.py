@@ -0,0 +1,308 @@
+"""
+Command bytecode compiles command sequences into compact integer opcodes, and precomputes per table transition
+tables of (heading, op) -> (dx, dy, new heading), so replaying a compiled program only does integer lookups.
+Results match the Robot, Table and ToyRobotSimulator object API exactly.
+"""
+from array import array
+from compass import get_compass, is_current, step_vector
+from models import FrozenCoordinate, Robot
+from obstacles import run_length
+
+
+OP_PLACE = 0    # followed by x, y, heading
+OP_MOVE = 1
+OP_LEFT = 2
+OP_RIGHT = 3
+OP_REPORT = 4
+OP_END = 5
+OP_SELECT = 6   # followed by robot name index, table name index
+OP_RUN = 7      # followed by number of moves, -1 for moving until blocked
+
+OPCODES = {'MOVE': OP_MOVE, 'LEFT': OP_LEFT, 'RIGHT': OP_RIGHT, 'REPORT': OP_REPORT, 'END': OP_END}
+
+# number of operations which have an entry in the transition table: MOVE, LEFT and RIGHT
+STEP_OPS = 3
+
+
+class Headings(object):
+    """
+    Headings enumerates the (degree, f) states a robot can be in, and the heading reached by turning left or right
+    from each of them, following Robot.turn.
+    """
+
+    def __init__(self, facing_directions, turn_degree):
+        self.source = facing_directions
+        self.version = getattr(facing_directions, 'version', None)
+        self.facing_directions = dict(facing_directions)
+        self.turn_degree = turn_degree
+        self.states = []        # heading index -> (degree, f)
+        self.index = {}         # (degree, f) -> heading index
+        self.left = []
+        self.right = []
+        for f, degree in sorted(self.facing_directions.items(), key=lambda item: item[1]):
+            self.state(degree, f)
+
+    def __repr__(self):
+        return "Headings(%s)" % len(self.states)
+
+    # get the heading index of a degree and facing direction, adding it and every heading turnable from it
+    def state(self, degree, f):
+        key = (degree, f)
+        if key in self.index:
+            return self.index[key]
+        pending = [key]
+        while pending:
+            degree, f = pending.pop()
+            if (degree, f) in self.index:
+                continue
+            self.index[(degree, f)] = len(self.states)
+            self.states.append((degree, f))
+            self.left.append(None)
+            self.right.append(None)
+            for direction in ('LEFT', 'RIGHT'):
+                pending.append(self._turned(degree, f, direction))
+        for i, (degree, f) in enumerate(self.states):
+            if self.left[i] is None:
+                self.left[i] = self.index[self._turned(degree, f, 'LEFT')]
+                self.right[i] = self.index[self._turned(degree, f, 'RIGHT')]
+        return self.index[key]
+
+    # get the heading after turning, the same heading when the turn reaches a degree without facing direction
+    def _turned(self, degree, f, direction):
+        turned = (degree + Robot.turn_directions[direction] * self.turn_degree) % 360
+        name = get_compass(self.source).names.get(turned)
+        return (degree, f) if name is None else (turned, name)
+
+
+_headings = None
+
+
+# get the headings of current Robot facing directions and turn degree, rebuilt whenever they are changed
+def get_headings():
+    global _headings
+    if (_headings is None or not is_current(_headings, Robot.facing_directions)
+            or _headings.turn_degree != Robot.turn_degree):
+        _headings = Headings(Robot.facing_directions, Robot.turn_degree)
+    return _headings
+
+
+class TransitionTable(object):
+    """
+    Transition table of a Table holds for each heading and MOVE, LEFT, RIGHT operation the (dx, dy, new heading)
+    tuple, or None when the heading has no movement rule on the table.
+    """
+
+    def __init__(self, table, headings):
+        self.dx = table.dx
+        self.dy = table.dy
+        self.rule = dict(table.STEP_CAL_RULE)
+        self.x_axis, self.y_axis = list(table.x_axis), list(table.y_axis)
+        self.headings = headings
+        self.steps = []
+        self.extend(table)
+
+    def __repr__(self):
+        return "TransitionTable(%s,%s)" % (self.dx, self.dy)
+
+    # check the transition table was built from current table dimensions and rules
+    def is_valid(self, table, headings):
+        return (self.headings is headings and self.dx == table.dx and self.dy == table.dy
+                and self.rule == table.STEP_CAL_RULE and self.x_axis == table.x_axis and self.y_axis == table.y_axis)
+
+    # add the transitions of headings which were created after this table was built
+    def extend(self, table):
+        headings = self.headings
+        for h in range(len(self.steps) // STEP_OPS, len(headings.states)):
+            step = step_vector(self.rule, self.x_axis, self.y_axis, headings.states[h][1])
+            move = (step[0], step[1], h) if step is not None else None
+            self.steps.extend((move, (0, 0, headings.left[h]), (0, 0, headings.right[h])))
+
+
+# get the transition table of table, which is cached on the table until its dimensions or rule change
+def get_transitions(table):
+    headings = get_headings()
+    transitions = getattr(table, '_transitions', None)
+    if transitions is None or not transitions.is_valid(table, headings):
+        transitions = TransitionTable(table, headings)
+        table._transitions = transitions
+    elif len(transitions.steps) < len(headings.states) * STEP_OPS:
+        transitions.extend(table)
+    return transitions
+
+
+class Program(object):
+    """
+    Program is a compiled command sequence, holding the opcodes and the robot and table names used by SELECT.
+    """
+
+    def __init__(self):
+        self.code = array('l')
+        self.names = []
+        self._name_index = {}
+
+    def __len__(self):
+        return len(self.code)
+
+    def __repr__(self):
+        return "Program(%s)" % len(self.code)
+
+    def name_index(self, name):
+        if name not in self._name_index:
+            self._name_index[name] = len(self.names)
+            self.names.append(name)
+        return self._name_index[name]
+
+
+def compile_commands(commands):
+    """
+    Compile parsed (action, args) commands, as produced by engine.parse_commands, into a Program.
+    PLACE commands facing an unknown direction are dropped as they would fail anyway.
+    """
+    headings = get_headings()
+    program = Program()
+    code = program.code
+    for action, args in commands:
+        if action == 'PLACE':
+            x, y, f = args
+            if f in Robot.facing_directions:
+                code.extend((OP_PLACE, x, y, headings.state(Robot.facing_directions[f], f)))
+        elif action == 'SELECT':
+            code.extend((OP_SELECT, program.name_index(args[0]), program.name_index(args[1])))
+        elif action == 'MOVE' and args:
+            code.extend((OP_RUN, -1 if args[0] is None else args[0]))
+        else:
+            code.append(OPCODES[action])
+    return program
+
+
+# check compiled programs can run on table, which has no occupancy tracking and no obstacles
+def supports(table):
+    return table.occupancy is None and table.obstacles is None
+
+
+def execute(program, simulator, robot=None, table=None, observe=None):
+    """
+    Run a compiled program on the robots and tables of simulator, yielding the report of each REPORT opcode.
+    Robot state is kept in local integers and written back to the Robot whenever another robot is selected, the
+    program ends or the generator is closed. Tables tracking occupancy or having obstacles and simulators recording
+    a journal or trajectories are not supported, as robots are moved without checking or updating them, replay
+    scripts on them with CommandEngine.run instead.
+
+    observe, if given, is called as observe(action, robot, done) for every PLACE, MOVE, LEFT, RIGHT and REPORT
+    taken by a selected robot, robot being None while it is not placed, the same actions CommandEngine.apply takes.
+    """
+    if simulator.journal is not None or simulator.trajectories is not None:
+        raise ValueError('Simulator %s records a journal or trajectories, which compiled programs do not support'
+                         % simulator)
+    headings = get_headings()
+    states = headings.states
+    code = program.code
+    names = program.names
+    n = len(code)
+    pc = 0
+    x = y = lx = ly = h = width = height = steps = None
+    dirty = False
+
+    def transitions_of(table):
+        if not supports(table):
+            raise ValueError('Table %s tracks occupancy or has obstacles, which compiled programs do not support'
+                             % table.name)
+        return get_transitions(table)
+
+    def load(robot):
+        if robot.is_placed():
+            h = headings.state(robot.degree, robot.f)
+            transitions = transitions_of(simulator.robot_on_table[robot])
+            return (robot.coordinate.x, robot.coordinate.y, robot.last_position.x, robot.last_position.y,
+                    h, transitions.dx, transitions.dy, transitions.steps)
+        return None, None, None, None, None, None, None, None
+
+    def store(robot):
+        robot.coordinate = FrozenCoordinate(x, y)
+        robot.last_position = FrozenCoordinate(lx, ly)
+        robot.degree, robot.f = states[h]
+
+    if robot is None or table is None:
+        robot = table = None
+    else:
+        x, y, lx, ly, h, width, height, steps = load(robot)
+    try:
+        while pc < n:
+            op = code[pc]
+            if op == OP_MOVE:
+                pc += 1
+                done = False
+                if steps is not None:
+                    step = steps[h * STEP_OPS]
+                    if step is not None:
+                        nx = x + step[0]
+                        ny = y + step[1]
+                        if 0 <= nx < width and 0 <= ny < height:
+                            lx, ly, x, y = x, y, nx, ny
+                            dirty = done = True
+                if observe is not None and robot is not None:
+                    observe('MOVE', robot if steps is not None else None, done)
+            elif op == OP_RUN:
+                moved = 0
+                if steps is not None:
+                    step = steps[h * STEP_OPS]
+                    if step is not None:
+                        moved = run_length(x, y, step[0], step[1], width, height, code[pc + 1])
+                        if moved:
+                            lx, ly = x + (moved - 1) * step[0], y + (moved - 1) * step[1]
+                            x, y = lx + step[0], ly + step[1]
+                            dirty = True
+                if observe is not None and robot is not None:
+                    observe('MOVE', robot if steps is not None else None, moved > 0)
+                pc += 2
+            elif op == OP_LEFT or op == OP_RIGHT:
+                pc += 1
+                if steps is not None:
+                    turned = steps[h * STEP_OPS + op - OP_MOVE][2]
+                    if observe is not None:
+                        observe('LEFT' if op == OP_LEFT else 'RIGHT', robot, turned != h)
+                    h = turned
+                    dirty = True
+                elif observe is not None and robot is not None:
+                    observe('LEFT' if op == OP_LEFT else 'RIGHT', None, False)
+            elif op == OP_REPORT:
+                pc += 1
+                if observe is not None and robot is not None:
+                    observe('REPORT', robot if steps is not None else None, steps is not None)
+                if steps is not None:
+                    yield "%s,%s,%s" % (x, y, states[h][1])
+            elif op == OP_PLACE:
+                done = robot is not None and table is not None and 0 <= code[pc + 1] < table.dx \
+                    and 0 <= code[pc + 2] < table.dy
+                if done:
+                    x = lx = code[pc + 1]
+                    y = ly = code[pc + 2]
+                    h = code[pc + 3]
+                    transitions = transitions_of(table)
+                    width, height, steps = transitions.dx, transitions.dy, transitions.steps
+                    simulator.robot_on_table[robot] = table
+                    dirty = True
+                if observe is not None and robot is not None:
+                    observe('PLACE', robot if steps is not None else None, done)
+                pc += 4
+            elif op == OP_SELECT or op == OP_END:
+                if dirty:
+                    store(robot)
+                    dirty = False
+                if op == OP_SELECT:
+                    robot = simulator.robots.get(names[code[pc + 1]])
+                    table = simulator.tables.get(names[code[pc + 2]])
+                    pc += 3
+                else:
+                    robot = table = None
+                    pc += 1
+                if robot is None or table is None:
+                    robot = table = None
+                    steps = None
+                else:
+                    x, y, lx, ly, h, width, height, steps = load(robot)
+            else:
+                raise ValueError('Unknown opcode %s at %s' % (op, pc))
+    finally:
+        if dirty:
+            store(robot)
@@ -0,0 +1,167 @@
+"""
+Compact representations for keeping large fleets resident in memory: immutable interned coordinates which are
+shared by every robot standing on the same cell, and a robot store packing each robot into a few machine ints.
+"""
+from array import array
+
+from models import Coordinate, FrozenCoordinate, Robot
+
+
+class InternedCoordinate(FrozenCoordinate):
+    """
+    Immutable, hashable coordinate of which only one instance exists per (x, y), so moving robots reuse
+    coordinates instead of allocating new ones.
+    """
+
+    __slots__ = ()
+
+    _interned = {}
+
+    def __new__(cls, x, y):
+        coordinate = cls._interned.get((x, y))
+        if coordinate is None:
+            coordinate = Coordinate.__new__(cls)
+            FrozenCoordinate.__init__(coordinate, x, y)
+            cls._interned[(x, y)] = coordinate
+        return coordinate
+
+    def __init__(self, x, y):
+        pass
+
+    # release all interned coordinates
+    @classmethod
+    def clear(cls):
+        cls._interned.clear()
+
+
+# number of ints stored per robot: x, y, last x, last y, degree, facing direction index, table id
+FIELDS = 7
+X, Y, LAST_X, LAST_Y, DEGREE, F, TABLE = range(FIELDS)
+
+# field value of facing direction index and table id for a robot not placed
+NONE = -1
+
+
+class RobotStore(object):
+    """
+    Robot store packs the state of each robot into FIELDS machine ints of one array, robot i at
+    data[i * FIELDS:(i + 1) * FIELDS]. Tables are referenced by their index in tables, facing directions by their
+    index in directions.
+    """
+
+    def __init__(self, tables=(), typecode='i'):
+        self.data = array(typecode)
+        self.names = []
+        self.name_index = {}
+        self.tables = list(tables)
+        self.directions = list(Robot.facing_directions.keys())
+        self.direction_index = dict((f, i) for i, f in enumerate(self.directions))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "RobotStore(%s)" % len(self.names)
+
+    # add a robot not placed yet, return its robot id
+    def add(self, name):
+        if not name:
+            raise AttributeError('Name cannot be None or empty string')
+        self.name_index[str(name)] = len(self.names)
+        self.names.append(str(name))
+        self.data.extend((0, 0, 0, 0, 0, NONE, NONE))
+        return len(self.names) - 1
+
+    # add a robot with the state of robot placed on table, return its robot id
+    def pack(self, robot, table=None):
+        robot_id = self.add(robot.name)
+        if robot.is_placed():
+            if table not in self.tables:
+                self.tables.append(table)
+            i = robot_id * FIELDS
+            self.data[i:i + FIELDS] = array(self.data.typecode, (
+                robot.coordinate.x, robot.coordinate.y, robot.last_position.x, robot.last_position.y,
+                robot.degree, self.direction_index[robot.f], self.tables.index(table)))
+        return robot_id
+
+    # get the Robot view of robot id or name
+    def robot(self, robot_id):
+        if isinstance(robot_id, str):
+            robot_id = self.name_index[robot_id]
+        return PackedRobot(self, robot_id)
+
+    # get the table robot id is placed on, None if not placed
+    def table_of(self, robot_id):
+        t = self.data[robot_id * FIELDS + TABLE]
+        return self.tables[t] if t != NONE else None
+
+
+class PackedRobot(Robot):
+    """
+    PackedRobot is a Robot whose state is read from and written to a RobotStore, coordinates are returned as
+    interned coordinates.
+    """
+
+    __slots__ = ('store', 'offset')
+
+    def __init__(self, store, robot_id):
+        self.store = store
+        self.offset = robot_id * FIELDS
+        self.name = store.names[robot_id]
+
+    def __eq__(self, other):
+        return isinstance(other, PackedRobot) and self.store is other.store and self.offset == other.offset
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.store), self.offset))
+
+    @property
+    def coordinate(self):
+        data = self.store.data
+        if data[self.offset + F] == NONE:
+            return None
+        return InternedCoordinate(data[self.offset + X], data[self.offset + Y])
+
+    @coordinate.setter
+    def coordinate(self, coordinate):
+        if coordinate is not None:
+            self.store.data[self.offset + X] = coordinate.x
+            self.store.data[self.offset + Y] = coordinate.y
+
+    @property
+    def last_position(self):
+        data = self.store.data
+        if data[self.offset + F] == NONE:
+            return None
+        return InternedCoordinate(data[self.offset + LAST_X], data[self.offset + LAST_Y])
+
+    @last_position.setter
+    def last_position(self, coordinate):
+        if coordinate is not None:
+            self.store.data[self.offset + LAST_X] = coordinate.x
+            self.store.data[self.offset + LAST_Y] = coordinate.y
+
+    @property
+    def f(self):
+        f = self.store.data[self.offset + F]
+        return self.store.directions[f] if f != NONE else None
+
+    @f.setter
+    def f(self, f):
+        self.store.data[self.offset + F] = self.store.direction_index[f] if f is not None else NONE
+
+    @property
+    def degree(self):
+        data = self.store.data
+        return data[self.offset + DEGREE] if data[self.offset + F] != NONE else None
+
+    @degree.setter
+    def degree(self, degree):
+        self.store.data[self.offset + DEGREE] = degree if degree is not None else 0
+
+    @property
+    def table(self):
+        return self.store.table_of(self.offset // FIELDS)
@@ -0,0 +1,167 @@
+"""
+Compass of the facing directions robots can have. Robot.facing_directions maps each direction name to a degree and
+can be extended to 8-way, 16-way or any custom compass together with Robot.turn_degree. Compass precomputes the
+degree -> name lookup used on every turn, and step_vector() gives the (dx, dy) of a MOVE facing any direction on a
+table, including diagonals like SOUTH-WEST which add up the steps of their parts following STEP_CAL_RULE.
+Robots can only turn to degrees which have a facing direction.
+"""
+
+# names of the compass points counting from SOUTH, as degrees grow from SOUTH to WEST, NORTH and EAST
+POINTS = ['SOUTH', 'SOUTH-SOUTH-WEST', 'SOUTH-WEST', 'WEST-SOUTH-WEST', 'WEST', 'WEST-NORTH-WEST', 'NORTH-WEST',
+          'NORTH-NORTH-WEST', 'NORTH', 'NORTH-NORTH-EAST', 'NORTH-EAST', 'EAST-NORTH-EAST', 'EAST', 'EAST-SOUTH-EAST',
+          'SOUTH-EAST', 'SOUTH-SOUTH-EAST']
+
+# separators between the parts of a direction name
+SEPARATORS = ('-', '_', ' ')
+
+
+class Versioned(dict):
+    """
+    Mapping counting its changes in version, so what is built from it knows when it is out of date without comparing
+    the whole mapping
+    """
+
+    version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, f, degree):
+        dict.__setitem__(self, f, degree)
+        self._changed()
+
+    def __delitem__(self, f):
+        dict.__delitem__(self, f)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+
+    def setdefault(self, f, degree=None):
+        if f not in self:
+            self[f] = degree
+        return self[f]
+
+    def pop(self, f, *default):
+        self._changed()
+        return dict.pop(self, f, *default)
+
+    def popitem(self):
+        self._changed()
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self._changed()
+
+
+class Directions(Versioned):
+    """
+    Facing directions mapping each name to a degree, compasses built from it are checked against its version
+    """
+
+
+def points(n):
+    """
+    Get the facing directions of an n-way compass, n being 4, 8 or 16, e.g. Robot.facing_directions = points(8)
+    with Robot.turn_degree = 45. Degrees of a 16-way compass are float.
+    """
+    if n not in (4, 8, 16):
+        raise ValueError('Compass must have 4, 8 or 16 points, not %s' % n)
+    every = len(POINTS) // n
+    return Directions((POINTS[i], i * 360.0 / len(POINTS) if n == 16 else i * 360 // len(POINTS))
+                      for i in range(0, len(POINTS), every))
+
+
+class Compass(object):
+    """
+    Compass of facing directions, names maps each degree of a facing direction to its name, the first one given
+    when several directions share a degree
+    """
+
+    def __init__(self, facing_directions):
+        # the mapping the compass was built from and its version, to tell when it is out of date
+        self.source = facing_directions
+        self.version = getattr(facing_directions, 'version', None)
+        self.facing_directions = dict(facing_directions)
+        self.names = {}
+        for f, degree in reversed(list(self.facing_directions.items())):
+            self.names[degree] = f
+
+    def __repr__(self):
+        return "Compass(%s)" % len(self.facing_directions)
+
+    # get the name of the facing direction at degree, default for degrees without one
+    def name(self, degree, default=None):
+        return self.names.get(degree, default)
+
+
+_compass = None
+
+
+# check compass was built from facing_directions as they are now: Directions are checked by identity and version,
+# plain dicts changed in place can only be told by comparing them
+def is_current(compass, facing_directions):
+    if compass.source is not facing_directions:
+        return False
+    if isinstance(facing_directions, Versioned):
+        return compass.version == facing_directions.version
+    return compass.facing_directions == facing_directions
+
+
+# get the compass of facing_directions, rebuilt whenever they are changed
+def get_compass(facing_directions):
+    global _compass
+    if _compass is None or not is_current(_compass, facing_directions):
+        _compass = Compass(facing_directions)
+    return _compass
+
+
+def split(f, axes):
+    """
+    Split a compound direction name like SOUTH-WEST or SOUTHWEST into the axis directions it is made of, None if it
+    is not made of axis directions only
+    """
+    for separator in SEPARATORS:
+        if separator in f:
+            parts = [part for part in f.split(separator) if part]
+            return parts if all(part in axes for part in parts) else None
+    parts = []
+    rest = f
+    while rest:
+        for axis in axes:
+            if rest.startswith(axis):
+                parts.append(axis)
+                rest = rest[len(axis):]
+                break
+        else:
+            return None
+    return parts
+
+
+def step_vector(rule, x_axis, y_axis, f):
+    """
+    Get the (dx, dy) of one MOVE facing f following the STEP_CAL_RULE rule and the x_axis, y_axis directions of a
+    table, None if f cannot move. A rule "TO_<f>" of an axis direction steps along its axis, one given as a (dx, dy)
+    pair is used as is, and compound directions without a rule of their own add up the steps of their parts.
+    """
+    move_step = rule.get("TO_%s" % f)
+    if isinstance(move_step, (tuple, list)):
+        return move_step[0], move_step[1]
+    if move_step is not None:
+        if f in x_axis:
+            return move_step, 0
+        elif f in y_axis:
+            return 0, move_step
+        return None
+    parts = split(f, list(x_axis) + list(y_axis))
+    if not parts or len(parts) < 2:
+        return None
+    sx = sy = 0
+    for part in parts:
+        step = step_vector(rule, x_axis, y_axis, part)
+        if step is None:
+            return None
+        sx, sy = sx + step[0], sy + step[1]
+    return sx, sy
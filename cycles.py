@@ -0,0 +1,183 @@
+"""
+Cycle detection and fast-forward of command blocks repeated many times, like a patrol of MOVE MOVE LEFT.
+
+A robot on a table has finitely many (x, y, heading) states, so repeating a block of MOVE, LEFT and RIGHT commands
+always ends in a cycle. fast_forward() detects it and jumps ahead by whole cycles arithmetically, BlockTransform
+precomputes the net transformation of a block over every state of a small table, composes blocks and applies N
+repetitions in O(log N) by repeated squaring.
+"""
+from array import array
+
+from bytecode import OP_LEFT, OP_MOVE, OP_RIGHT, STEP_OPS, get_headings, get_transitions, supports
+from models import FrozenCoordinate
+
+OPCODES = {'MOVE': OP_MOVE, 'LEFT': OP_LEFT, 'RIGHT': OP_RIGHT}
+
+# tables with at most this number of (x, y, heading) states can use BlockTransform
+TRANSFORM_LIMIT = 1 << 20
+
+
+def compile_block(block):
+    """
+    Compile a block of MOVE, LEFT and RIGHT actions into opcodes
+    """
+    try:
+        return [OPCODES[action] for action in block]
+    except KeyError as e:
+        raise ValueError('Only MOVE, LEFT and RIGHT can be repeated, not %s' % e.args[0])
+
+
+def run_block(transitions, ops, x, y, h, lx, ly):
+    """
+    Apply block opcodes once to state x, y, heading h with last position lx, ly, return the new state
+    """
+    steps = transitions.steps
+    width, height = transitions.dx, transitions.dy
+    for op in ops:
+        step = steps[h * STEP_OPS + op - OP_MOVE]
+        if op == OP_MOVE:
+            if step is not None:
+                nx, ny = x + step[0], y + step[1]
+                if 0 <= nx < width and 0 <= ny < height:
+                    lx, ly, x, y = x, y, nx, ny
+        else:
+            h = step[2]
+    return x, y, h, lx, ly
+
+
+def fast_forward(table, block, n, x, y, h, lx, ly):
+    """
+    Repeat block n times from state x, y, heading h with last position lx, ly, return the final state. States after
+    each repetition are remembered until one repeats, then the remaining repetitions are skipped by whole cycles,
+    so the cost is bounded by the cycle length instead of n.
+    """
+    transitions = get_transitions(table)
+    ops = compile_block(block)
+    seen = {}
+    history = []
+    state = (x, y, h, lx, ly)
+    i = 0
+    while i < n:
+        key = state[:3]
+        if key in seen:
+            length = i - seen[key]
+            # walk one more cycle, after which last positions repeat with the cycle as well
+            for k in range(length):
+                if i == n:
+                    return state
+                history.append(state)
+                state = run_block(transitions, ops, *state)
+                i += 1
+            return history[i - length + (n - i) % length]
+        seen[key] = i
+        history.append(state)
+        state = run_block(transitions, ops, *state)
+        i += 1
+    return state
+
+
+class BlockTransform(object):
+    """
+    Net transformation of a command block over every state of a table. State s = (y * dx + x) * H + h, where H is
+    the number of headings. next[s] is the state after the block, last[s] the index y * dx + x of the last position
+    after it, or -1 when the block does not move the robot.
+    """
+
+    def __init__(self, table, block=(), states=None):
+        self.table = table
+        self.headings = get_headings()
+        self.transitions = get_transitions(table)
+        self.count = len(self.headings.states)
+        size = table.dx * table.dy * self.count
+        if size > TRANSFORM_LIMIT:
+            raise ValueError('Table %s has too many states for a block transform' % table.name)
+        if states is not None:
+            self.next, self.last = states
+        else:
+            self.next, self.last = self._build(compile_block(block), size)
+        self._powers = [(self.next, self.last)]
+
+    def __repr__(self):
+        return "BlockTransform(%s)" % self.table.name
+
+    def _build(self, ops, size):
+        dx, count = self.table.dx, self.count
+        nexts = array('l', bytes(array('l').itemsize * size))
+        lasts = array('l', bytes(array('l').itemsize * size))
+        for s in range(size):
+            cell, h = divmod(s, count)
+            y, x = divmod(cell, dx)
+            nx, ny, nh, lx, ly = run_block(self.transitions, ops, x, y, h, -1, -1)
+            nexts[s] = (ny * dx + nx) * count + nh
+            lasts[s] = ly * dx + lx if lx >= 0 else -1
+        return nexts, lasts
+
+    @staticmethod
+    def _compose(first, second):
+        next1, last1 = first
+        next2, last2 = second
+        nexts = array('l', [next2[s] for s in next1])
+        lasts = array('l', [last2[t] if last2[t] >= 0 else last1[s] for s, t in enumerate(next1)])
+        return nexts, lasts
+
+    def then(self, other):
+        """
+        Return the transform of this block followed by other, on the same table
+        """
+        return BlockTransform(self.table, states=self._compose((self.next, self.last), (other.next, other.last)))
+
+    def _power(self, k):
+        # transform of 2 ** k repetitions
+        while len(self._powers) <= k:
+            self._powers.append(self._compose(self._powers[-1], self._powers[-1]))
+        return self._powers[k]
+
+    def state(self, x, y, h):
+        return (y * self.table.dx + x) * self.count + h
+
+    def repeat(self, n, x, y, h, lx, ly):
+        """
+        Apply the block n times to state x, y, heading h with last position lx, ly in O(log n), return the final
+        state
+        """
+        s = self.state(x, y, h)
+        last = -1
+        k = 0
+        while n:
+            if n & 1:
+                nexts, lasts = self._power(k)
+                if lasts[s] >= 0:
+                    last = lasts[s]
+                s = nexts[s]
+            n >>= 1
+            k += 1
+        cell, h = divmod(s, self.count)
+        y, x = divmod(cell, self.table.dx)
+        if last >= 0:
+            ly, lx = divmod(last, self.table.dx)
+        return x, y, h, lx, ly
+
+
+def repeat(simulator, robot, block, n, transform=None):
+    """
+    Repeat block of actions n times on robot, same as performing them one by one but in O(cycle length), or
+    O(log n) with a BlockTransform of the block on the robot table. Return False if robot is not placed.
+    Tables tracking occupancy or having obstacles and simulators recording a journal or trajectories are not
+    supported.
+    """
+    if not robot.is_placed():
+        return False
+    table = simulator.robot_on_table[robot]
+    if not supports(table) or simulator.journal is not None or simulator.trajectories is not None:
+        raise ValueError('Cannot fast-forward robots on tables tracking occupancy or having obstacles, or with a '
+                         'journal or trajectories')
+    h = get_headings().state(robot.degree, robot.f)
+    state = (robot.coordinate.x, robot.coordinate.y, h, robot.last_position.x, robot.last_position.y)
+    if transform is not None:
+        x, y, h, lx, ly = transform.repeat(n, *state)
+    else:
+        x, y, h, lx, ly = fast_forward(table, block, n, *state)
+    robot.coordinate = FrozenCoordinate(x, y)
+    robot.last_position = FrozenCoordinate(lx, ly)
+    robot.degree, robot.f = get_headings().states[h]
+    return True
@@ -0,0 +1,143 @@
+"""
+Lightweight embedding API for running the simulator inside short-lived workers. Importing this module has no side
+effects and loads nothing but the standard library, the simulator modules are imported on the first call, and
+optional subsystems (bytecode, occupancy, tiles, planner...) only when a script or table needs them.
+
+WorkerPool goes further for processes running many small scripts: it imports and deploys the simulator once, then
+forks warm workers which each keep a deployed simulator ready and receive scripts over a pipe.
+"""
+import os
+
+# tables and robots deployed when none are given
+TABLES = [{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}]
+ROBOTS = ['robot1']
+
+
+def create(table_params=None, robot_names=None, sink=None, name='embedded'):
+    """
+    Create a simulator with table_params and robot_names deployed, discarding outputs unless a sink is given
+    """
+    from simulator import ToyRobotSimulator
+    from sinks import NullSink
+    simulator = ToyRobotSimulator(name, sink if sink is not None else NullSink())
+    simulator.deploy(table_params if table_params is not None else TABLES,
+                     robot_names if robot_names is not None else ROBOTS)
+    return simulator
+
+
+def run(script, simulator=None, robot=None, table=None):
+    """
+    Replay a script, a file path, file object or iterable of command lines, on simulator, a default one created
+    when None. Return the list of REPORT results.
+    """
+    from engine import CommandEngine
+    if simulator is None:
+        simulator = create()
+    return list(CommandEngine(simulator).run(script, robot, table))
+
+
+def _serve(connection, table_params, robot_names, fresh):
+    # worker loop: run each script received on a simulator, deployed again for every script when fresh, and send
+    # back ('ok', reports) or ('error', message), until None or the pipe is closed
+    simulator = create(table_params, robot_names)
+    while True:
+        try:
+            script = connection.recv()
+        except EOFError:
+            break
+        if script is None:
+            break
+        try:
+            if fresh:
+                simulator = create(table_params, robot_names)
+            connection.send(('ok', run(script, simulator)))
+        except Exception as e:
+            connection.send(('error', '%s: %s' % (type(e).__name__, e)))
+    connection.close()
+
+
+class WorkerPool(object):
+    """
+    Pool of size worker processes, each with a deployed simulator of table_params and robot_names. With fresh True
+    every script starts from a newly deployed simulator, otherwise scripts sent to a worker share its robots.
+    Workers are forked where the platform allows it, so they inherit the modules imported by the pool.
+    """
+
+    def __init__(self, size=None, table_params=None, robot_names=None, fresh=True):
+        import multiprocessing
+        # import the simulator modules before forking, so workers start warm
+        create(table_params, robot_names)
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        self.size = size or os.cpu_count() or 1
+        self.workers = []
+        for i in range(self.size):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child, table_params, robot_names, fresh),
+                                      name='trs-worker-%s' % i)
+            process.daemon = True
+            process.start()
+            child.close()
+            self.workers.append((process, parent))
+        self._next = 0
+
+    def __repr__(self):
+        return "WorkerPool(%s)" % self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _lines(script):
+        # scripts cross the pipe as lists of lines, text is split and files are read here
+        if isinstance(script, str) and '\n' in script:
+            return script.split('\n')
+        from engine import read_lines
+        return list(read_lines(script))
+
+    @staticmethod
+    def _result(reply):
+        status, value = reply
+        if status != 'ok':
+            raise RuntimeError('Worker failed to run script: %s' % value)
+        return value
+
+    def run(self, script):
+        """
+        Run one script on the next worker, return the list of REPORT results. Script is an iterable of command
+        lines, a file object, or a string which is script text when it has several lines and a file path otherwise
+        """
+        process, connection = self.workers[self._next]
+        self._next = (self._next + 1) % self.size
+        connection.send(self._lines(script))
+        return self._result(connection.recv())
+
+    def map(self, scripts):
+        """
+        Run scripts spread over all workers at once, return the lists of REPORT results in the order of scripts
+        """
+        scripts = [self._lines(script) for script in scripts]
+        results = []
+        for start in range(0, len(scripts), self.size):
+            batch = scripts[start:start + self.size]
+            for (process, connection), script in zip(self.workers, batch):
+                connection.send(script)
+            for process, connection in self.workers[:len(batch)]:
+                results.append(self._result(connection.recv()))
+        return results
+
+    def close(self):
+        """
+        Stop the workers
+        """
+        for process, connection in self.workers:
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                pass
+            connection.close()
+        for process, connection in self.workers:
+            process.join()
+        self.workers = []
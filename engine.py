@@ -0,0 +1,208 @@
+"""
+Command stream engine replays scripted command lines through a simulator without prompts or terminal output.
+Input is read in bulk chunks, parsed lazily and REPORT results are yielded one by one, so memory stays flat no
+matter how long the script is.
+"""
+from models import Robot
+
+
+# default number of characters read from a file in one go
+CHUNK_SIZE = 1 << 20
+
+
+def read_lines(source, chunk_size=CHUNK_SIZE):
+    """
+    Yield lines from a file path, a file object or any iterable of lines. Files are read in bulk chunks instead of
+    line by line.
+    """
+    if isinstance(source, str):
+        with open(source) as stream:
+            for line in read_lines(stream, chunk_size):
+                yield line
+        return
+
+    if not hasattr(source, 'read'):
+        for line in source:
+            yield line
+        return
+
+    rest = ''
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+def parse_line(line):
+    """
+    Parse one command line into an (action, args) tuple, return None for blank or invalid lines.
+    A "robot,table" line selects the robot and table the following commands are applied to, "MOVE k" moves k
+    steps and "MOVE UNTIL BLOCKED" moves until the next obstacle or edge.
+    """
+    values = line.split()
+    if not values:
+        return None
+    action = values[0]
+    if action == 'PLACE':
+        if len(values) < 2:
+            return None
+        args = values[1].split(',')
+        if len(args) < 3:
+            return None
+        try:
+            return action, (int(args[0]), int(args[1]), args[2])
+        except ValueError:
+            return None
+    if action == 'MOVE' and len(values) > 1:
+        if values[1] == 'UNTIL':
+            return action, (None,)
+        try:
+            count = int(values[1])
+        except ValueError:
+            return None
+        return (action, (count,)) if count >= 0 else None
+    if action in ('MOVE', 'LEFT', 'RIGHT', 'REPORT', 'END'):
+        return action, ()
+    names = action.split(',')
+    if len(names) >= 2:
+        return 'SELECT', (names[0], names[1])
+    return None
+
+
+def parse_commands(lines):
+    """
+    Lazily parse lines into (action, args) tuples, skipping invalid lines.
+    """
+    for line in lines:
+        command = parse_line(line)
+        if command is not None:
+            yield command
+
+
+class CommandEngine(object):
+    """
+    Command engine drives the robots and tables of a deployed simulator with a stream of commands, using the same
+    line protocol as ToyRobotSimulator.start(). Failed commands are ignored silently.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def __str__(self):
+        return "%s" % self.simulator
+
+    def __repr__(self):
+        return "CommandEngine(%s)" % self.simulator
+
+    # place robot to table without any output
+    def place(self, robot, table, x, y, f):
+        if f not in Robot.facing_directions:
+            return False
+        coord = table.get_coordinate(x, y)
+        if coord is None or not self.simulator.occupy(robot, table, coord):
+            return False
+        robot.set_coordinate_and_f(coord, f)
+        self.simulator.robot_on_table[robot] = table
+        return True
+
+    def apply(self, robot, table, action, args):
+        """
+        Apply one parsed command other than SELECT and END to robot on table. Return the report for REPORT,
+        otherwise whether the command succeeded; None for a REPORT which failed. Successful commands are recorded
+        to the journal and trajectories of the simulator, if any.
+        """
+        if action == 'PLACE':
+            done = self.place(robot, table, args[0], args[1], args[2])
+        elif not robot.is_placed():
+            return None if action == 'REPORT' else False
+        elif action == 'REPORT':
+            return robot.get_report()
+        elif action == 'MOVE' and args:
+            return self.move_many(robot, args[0])
+        elif action == 'MOVE':
+            done = self.simulator.move(robot)
+        elif action == 'LEFT':
+            done = robot.turn_left()
+        elif action == 'RIGHT':
+            done = robot.turn_right()
+        else:
+            return False
+        journal = self.simulator.journal
+        if done and journal is not None:
+            if action == 'PLACE':
+                journal.append(robot, table, action, args[0], args[1], args[2])
+            else:
+                journal.record(robot, action)
+        trajectories = self.simulator.trajectories
+        if done and trajectories is not None:
+            if action == 'PLACE':
+                trajectories.place(robot, table)
+            else:
+                trajectories.record(robot, action)
+        return done
+
+    # move robot count steps, or until blocked when count is None, return whether it moved at all
+    def move_many(self, robot, count):
+        moved = self.simulator.move_many(robot, count)
+        journal = self.simulator.journal
+        if journal is not None and moved:
+            journal.record(robot, 'MOVE', moved)
+        trajectories = self.simulator.trajectories
+        if trajectories is not None:
+            trajectories.record(robot, 'MOVE', moved)
+        return moved > 0
+
+    def execute(self, commands, robot=None, table=None):
+        """
+        Execute parsed (action, args) commands and yield the report of each REPORT command.
+        """
+        simulator = self.simulator
+        for action, args in commands:
+            if action == 'SELECT':
+                robot = simulator.robots.get(args[0])
+                table = simulator.tables.get(args[1])
+            elif robot is None or table is None:
+                continue
+            elif action == 'END':
+                robot = table = None
+            elif action == 'REPORT':
+                report = self.apply(robot, table, action, args)
+                if report is not None:
+                    yield report
+            else:
+                self.apply(robot, table, action, args)
+
+    def run(self, source, robot=None, table=None):
+        """
+        Replay a file path, file object or iterable of command lines and yield the REPORT results.
+        Robot and table can be given by name or instance, or selected inside the script with "robot,table" lines.
+        """
+        if isinstance(robot, str):
+            robot = self.simulator.robots.get(robot)
+        if isinstance(table, str):
+            table = self.simulator.tables.get(table)
+        return self.execute(parse_commands(read_lines(source)), robot, table)
+
+    # compile a script into a bytecode Program which can be replayed many times with run_compiled(), bytecode is
+    # imported on first use so engines which only replay scripts do not load it
+    def compile(self, source):
+        import bytecode
+        return bytecode.compile_commands(parse_commands(read_lines(source)))
+
+    def run_compiled(self, program, robot=None, table=None, observe=None):
+        """
+        Replay a compiled Program and yield the REPORT results, same as run() does for the script. observe is
+        called for each action taken, see bytecode.execute.
+        """
+        import bytecode
+        if isinstance(robot, str):
+            robot = self.simulator.robots.get(robot)
+        if isinstance(table, str):
+            table = self.simulator.tables.get(table)
+        return bytecode.execute(program, self.simulator, robot, table, observe)
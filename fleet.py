@@ -0,0 +1,324 @@
+"""
+Fleet simulates thousands to millions of robots per table by keeping their positions, degrees, facing directions
+and table ids in NumPy arrays, and applying a command to the whole fleet, or a command column with one command per
+robot, in a single vectorized step. FleetRobot keeps the Robot API working as a view over the arrays.
+"""
+import numpy as np
+
+from bytecode import OP_LEFT, OP_MOVE, OP_REPORT, OP_RIGHT
+from compass import get_compass, step_vector
+from models import FrozenCoordinate, Robot, Table
+
+
+class Fleet(object):
+    """
+    Fleet of robots stored column-wise. Robot i has position (x[i], y[i]), last position (lx[i], ly[i]), degree[i]
+    and facing direction directions[f[i]] on tables[table[i]]. Unplaced robots have f[i] == -1, robots without
+    coordinate have located[i] == False, same as a Robot with coordinate or f None. Obstacles of tables block
+    placing and moving like on Table, read at every step so set_blocked() applies at once. Fleets do not update the
+    occupancy index of tables.
+    """
+
+    def __init__(self, tables=()):
+        self.tables = []
+        self.table_index = {}
+        self.names = []
+        self.name_index = {}
+        self.x = np.zeros(0, dtype=np.int64)
+        self.y = np.zeros(0, dtype=np.int64)
+        self.lx = np.zeros(0, dtype=np.int64)
+        self.ly = np.zeros(0, dtype=np.int64)
+        self.degree = np.zeros(0, dtype=np.float64)
+        self.f = np.zeros(0, dtype=np.int32)
+        self.table = np.zeros(0, dtype=np.int32)
+        self.located = np.zeros(0, dtype=bool)
+        for table in tables:
+            self.add_table(table)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "Fleet(%s,%s)" % (len(self.names), len(self.tables))
+
+    # add a table to fleet, return the table id
+    def add_table(self, table):
+        if not isinstance(table, Table):
+            raise TypeError("The table must be Table instance")
+        if table.name not in self.table_index:
+            self.table_index[table.name] = len(self.tables)
+            self.tables.append(table)
+            self.refresh()
+        return self.table_index[table.name]
+
+    def refresh(self):
+        """
+        Rebuild the lookup arrays from Robot facing directions and turn degree, and from the table dimensions and
+        rules. Call it after changing any of them.
+        """
+        self.directions = list(Robot.facing_directions.keys())
+        self.direction_index = dict((f, i) for i, f in enumerate(self.directions))
+        # sorted degrees of the facing directions and their direction indexes, degrees may be fractional like the
+        # 22.5 of a 16 point compass
+        names = get_compass(Robot.facing_directions).names
+        self.degree_keys = np.array(sorted(names), dtype=np.float64)
+        self.degree_fs = np.array([self.direction_index[names[degree]] for degree in sorted(names)], dtype=np.int32)
+
+        shape = (max(len(self.tables), 1), max(len(self.directions), 1))
+        self.step_x = np.zeros(shape, dtype=np.int64)
+        self.step_y = np.zeros(shape, dtype=np.int64)
+        self.movable = np.zeros(shape, dtype=bool)
+        self.width = np.zeros(shape[0], dtype=np.int64)
+        self.height = np.zeros(shape[0], dtype=np.int64)
+        for t, table in enumerate(self.tables):
+            self.width[t] = table.dx
+            self.height[t] = table.dy
+            for i, f in enumerate(self.directions):
+                step = step_vector(table.STEP_CAL_RULE, table.x_axis, table.y_axis, f)
+                if step is not None:
+                    self.step_x[t, i], self.step_y[t, i] = step
+                    self.movable[t, i] = True
+
+    # get the mask of the cells xs, ys of tables table_ids holding an obstacle, cells being within their tables
+    def blocked(self, table_ids, xs, ys):
+        mask = np.zeros(xs.shape, dtype=bool)
+        for t, table in enumerate(self.tables):
+            if not table.obstacles:
+                continue
+            on = table_ids == t
+            if not on.any():
+                continue
+            cells = np.array(list(table.obstacles), dtype=np.int64).reshape(-1, 2)
+            keys = cells[:, 0] * table.dy + cells[:, 1]
+            mask[on] = np.isin(xs[on] * table.dy + ys[on], keys)
+        return mask
+
+    # add robots by names, return the array of their robot ids
+    def add_robots(self, names):
+        start = len(self.names)
+        names = list(names)
+        if not all(names):
+            raise AttributeError('Name cannot be None or empty string')
+        names = [str(name) for name in names]
+        self.names.extend(names)
+        self.name_index.update(zip(names, range(start, len(self.names))))
+        grow = len(self.names) - start
+        self.x = np.concatenate((self.x, np.zeros(grow, dtype=np.int64)))
+        self.y = np.concatenate((self.y, np.zeros(grow, dtype=np.int64)))
+        self.lx = np.concatenate((self.lx, np.zeros(grow, dtype=np.int64)))
+        self.ly = np.concatenate((self.ly, np.zeros(grow, dtype=np.int64)))
+        self.degree = np.concatenate((self.degree, np.zeros(grow, dtype=np.float64)))
+        self.f = np.concatenate((self.f, np.full(grow, -1, dtype=np.int32)))
+        self.table = np.concatenate((self.table, np.full(grow, -1, dtype=np.int32)))
+        self.located = np.concatenate((self.located, np.zeros(grow, dtype=bool)))
+        return np.arange(start, len(self.names))
+
+    def _ids(self, ids):
+        if ids is None:
+            return np.arange(len(self.names))
+        return np.asarray(ids, dtype=np.int64).reshape(-1)
+
+    def place(self, ids, table_ids, xs, ys, fs):
+        """
+        Place robots ids on tables table_ids at xs, ys facing fs, given as direction names or indices. Arguments
+        broadcast against ids. Return the boolean array of robots placed, placing outside the table or onto an
+        obstacle fails like Table.get_coordinate returning None.
+        """
+        ids = self._ids(ids)
+        table_ids = np.broadcast_to(np.asarray(table_ids, dtype=np.int64), ids.shape)
+        xs = np.broadcast_to(np.asarray(xs, dtype=np.int64), ids.shape)
+        ys = np.broadcast_to(np.asarray(ys, dtype=np.int64), ids.shape)
+        fs = np.asarray(fs)
+        if fs.dtype.kind in 'US':
+            fs = np.array([self.direction_index.get(str(f), -1) for f in fs.reshape(-1)], dtype=np.int64) \
+                .reshape(fs.shape)
+        fs = np.broadcast_to(fs.astype(np.int64), ids.shape)
+
+        ok = (fs >= 0) & (fs < len(self.directions)) & (xs >= 0) & (ys >= 0) \
+            & (xs < self.width[table_ids]) & (ys < self.height[table_ids])
+        ok[ok] = ~self.blocked(table_ids[ok], xs[ok], ys[ok])
+        sel = ids[ok]
+        self.x[sel] = self.lx[sel] = xs[ok]
+        self.y[sel] = self.ly[sel] = ys[ok]
+        self.f[sel] = fs[ok]
+        self.degree[sel] = np.array([Robot.facing_directions[f] for f in self.directions], dtype=np.float64)[fs[ok]] \
+            if len(self.directions) else 0
+        self.table[sel] = table_ids[ok]
+        self.located[sel] = True
+        return ok
+
+    # placed mask of robots ids, same as Robot.is_placed()
+    def is_placed(self, ids=None):
+        ids = self._ids(ids)
+        return self.located[ids] & (self.f[ids] >= 0)
+
+    def move(self, ids=None):
+        """
+        Move robots ids one step forward, return the boolean array of robots moved. Moves falling from the table
+        or onto an obstacle are blocked.
+        """
+        ids = self._ids(ids)
+        placed = self.is_placed(ids)
+        t = np.where(placed, self.table[ids], 0)
+        f = np.where(placed, self.f[ids], 0)
+        nx = self.x[ids] + self.step_x[t, f]
+        ny = self.y[ids] + self.step_y[t, f]
+        ok = placed & self.movable[t, f] & (nx >= 0) & (ny >= 0) & (nx < self.width[t]) & (ny < self.height[t])
+        ok[ok] = ~self.blocked(t[ok], nx[ok], ny[ok])
+        sel = ids[ok]
+        self.lx[sel] = self.x[sel]
+        self.ly[sel] = self.y[sel]
+        self.x[sel] = nx[ok]
+        self.y[sel] = ny[ok]
+        return ok
+
+    # facing direction indexes of degrees, -1 for degrees without a facing direction
+    def facing(self, degrees):
+        if not len(self.degree_keys):
+            return np.full(degrees.shape, -1, dtype=np.int32)
+        i = np.minimum(np.searchsorted(self.degree_keys, degrees), len(self.degree_keys) - 1)
+        return np.where(self.degree_keys[i] == degrees, self.degree_fs[i], -1)
+
+    def turn(self, direction, ids=None, degree=None):
+        """
+        Turn robots ids LEFT or RIGHT by degree, default Robot.turn_degree, return the boolean array of robots
+        turned. Like Robot.turn, a turn to a degree without facing direction fails and leaves the robot as it was.
+        """
+        ids = self._ids(ids)
+        placed = self.is_placed(ids)
+        _degree = degree if degree is not None else Robot.turn_degree
+        degrees = np.where(placed, self.degree[ids] + Robot.turn_directions[direction] * _degree, 0) % 360
+        fs = self.facing(degrees)
+        ok = placed & (fs >= 0)
+        sel = ids[ok]
+        self.degree[sel] = degrees[ok]
+        self.f[sel] = fs[ok]
+        return ok
+
+    # reports of robots ids, None for robots not placed
+    def reports(self, ids=None):
+        ids = self._ids(ids)
+        placed = self.is_placed(ids)
+        return ["%s,%s,%s" % (x, y, self.directions[f]) if p else None
+                for x, y, f, p in zip(self.x[ids].tolist(), self.y[ids].tolist(), self.f[ids].tolist(),
+                                      placed.tolist())]
+
+    def step(self, ops, ids=None):
+        """
+        Apply one opcode, MOVE, LEFT, RIGHT or REPORT from bytecode, to robots ids, or an array of opcodes with
+        one per robot. Return the reports of the robots performing REPORT, in the order of ids.
+        """
+        ids = self._ids(ids)
+        ops = np.asarray(ops)
+        if ops.ndim == 0:
+            ops = np.full(ids.shape, int(ops))
+        reports = []
+        for op in (OP_MOVE, OP_LEFT, OP_RIGHT, OP_REPORT):
+            sel = ids[ops == op]
+            if not len(sel):
+                continue
+            if op == OP_MOVE:
+                self.move(sel)
+            elif op == OP_LEFT:
+                self.turn('LEFT', sel)
+            elif op == OP_RIGHT:
+                self.turn('RIGHT', sel)
+            else:
+                reports = [r for r in self.reports(sel) if r is not None]
+        return reports
+
+    # get the Robot view of robot id or name
+    def robot(self, robot_id):
+        if isinstance(robot_id, str):
+            robot_id = self.name_index[robot_id]
+        return FleetRobot(self, robot_id)
+
+    # register the Robot views of all robots to simulator, with placed robots put on their tables
+    def register(self, simulator):
+        for i, name in enumerate(self.names):
+            robot = FleetRobot(self, i)
+            simulator.robots[name] = robot
+            if self.table[i] >= 0:
+                simulator.robot_on_table[robot] = self.tables[self.table[i]]
+        for table in self.tables:
+            simulator.tables[table.name] = table
+
+    # get the table robot id is placed on, None if not placed
+    def table_of(self, robot_id):
+        t = self.table[robot_id]
+        return self.tables[t] if t >= 0 else None
+
+
+class FleetRobot(Robot):
+    """
+    FleetRobot is a Robot whose coordinate, last position, facing direction and degree are read from and written
+    to the arrays of a Fleet, so Robot methods and the simulator work on fleet robots unchanged.
+    """
+
+    __slots__ = ('fleet', 'index')
+
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index
+        self.name = fleet.names[index]
+
+    def __eq__(self, other):
+        return isinstance(other, FleetRobot) and self.fleet is other.fleet and self.index == other.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.fleet), self.index))
+
+    @property
+    def coordinate(self):
+        fleet = self.fleet
+        return FrozenCoordinate(int(fleet.x[self.index]), int(fleet.y[self.index])) if fleet.located[self.index] \
+            else None
+
+    @coordinate.setter
+    def coordinate(self, coordinate):
+        if coordinate is None:
+            self.fleet.located[self.index] = False
+        else:
+            self.fleet.x[self.index] = coordinate.x
+            self.fleet.y[self.index] = coordinate.y
+            self.fleet.located[self.index] = True
+
+    @property
+    def last_position(self):
+        fleet = self.fleet
+        return FrozenCoordinate(int(fleet.lx[self.index]), int(fleet.ly[self.index])) if fleet.located[self.index] \
+            else None
+
+    @last_position.setter
+    def last_position(self, coordinate):
+        if coordinate is not None:
+            self.fleet.lx[self.index] = coordinate.x
+            self.fleet.ly[self.index] = coordinate.y
+
+    @property
+    def f(self):
+        f = self.fleet.f[self.index]
+        return self.fleet.directions[f] if f >= 0 else None
+
+    @f.setter
+    def f(self, f):
+        self.fleet.f[self.index] = self.fleet.direction_index[f] if f is not None else -1
+
+    @property
+    def degree(self):
+        if self.fleet.f[self.index] < 0:
+            return None
+        degree = float(self.fleet.degree[self.index])
+        return int(degree) if degree.is_integer() else degree
+
+    @degree.setter
+    def degree(self, degree):
+        self.fleet.degree[self.index] = degree if degree is not None else 0
+
+    @property
+    def table(self):
+        return self.fleet.table_of(self.index)
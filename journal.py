@@ -0,0 +1,297 @@
+"""
+Journal is an append-only write-ahead log of the commands which changed simulator state. Records are compact
+fixed-size groups of int32 buffered in memory and written in blocks with one fsync per block (group commit).
+Together with snapshot checkpoints, recovery loads the latest checkpoint and replays only the journal tail, which
+is all the journal holds once checkpoint() has truncated it, and blocks of records older than the checkpoint are
+skipped unread.
+"""
+import os
+import struct
+import sys
+from array import array
+
+import snapshot
+
+# the journal is a sequence of blocks, each block has a header of tag, sequence number of its first record, number
+# of entries and payload length, followed by the payload
+BLOCK = struct.Struct('<4sQII')
+NAMES = b'NAME'     # payload of (id, length) NAME_ENTRY structs each followed by the name bytes
+# payload of RECORD_FIELDS int32 per record: opcode, robot id, table id, argument, x, y. Table id is -1 for actions
+# on the table the robot is placed on, the argument of PLACE is the facing direction name id and the one of MOVE the
+# number of steps in a row, 0 in journals written before runs were recorded standing for 1
+RECORDS = b'RECS'
+NAME_ENTRY = struct.Struct('<II')
+RECORD_FIELDS = 6
+RECORD = struct.Struct('<%si' % RECORD_FIELDS)
+_pack_record = RECORD.pack_into
+# the MOVE count of a record is its argument, at RUN_OFFSET bytes
+_pack_run = struct.Struct('<i').pack_into
+RUN_OFFSET = 12
+
+# longest MOVE run kept in one record, so counts stay within int32
+MAX_RUN = 1 << 30
+
+PLACE, MOVE, LEFT, RIGHT = 0, 1, 2, 3
+OPCODES = {'PLACE': PLACE, 'MOVE': MOVE, 'LEFT': LEFT, 'RIGHT': RIGHT}
+ACTIONS = dict((op, action) for action, op in OPCODES.items())
+
+
+class Journal(object):
+    """
+    Journal appending records to path. Records are committed to disk as one block every batch_size records, on
+    commit() and on close(). The sequence number of the last record is kept in seq, and continues from the
+    existing journal.
+    """
+
+    def __init__(self, path, batch_size=4096, fsync=True):
+        self.path = path
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.ids = {}
+        # ids of robot and table objects, so recording does not look their names up
+        self.robot_ids = {}
+        self.table_ids = {}
+        self.seq = 0
+        if os.path.exists(path):
+            end = 0
+            with open(path, 'rb') as stream:
+                for tag, first_seq, count, length, end in _blocks(stream, {}, self.ids):
+                    if tag == RECORDS:
+                        self.seq = first_seq + count - 1
+            # drop a block cut short by a crash so new blocks are not appended after it
+            if os.path.getsize(path) > end:
+                with open(path, 'r+b') as stream:
+                    stream.truncate(end)
+        self.stream = open(path, 'ab')
+        # little endian records of the block being written, preallocated for batch_size records and filled up to
+        # offset bytes
+        self.records = array('i', bytes(RECORD.size * max(batch_size, 1)))
+        self.offset = 0
+        self.limit = RECORD.size * batch_size
+        self.new_names = []
+        self.first_seq = self.seq + 1
+        # robot id and count of the MOVE run of the last record of the block, robot -1 when it is not a MOVE
+        self.run_robot = -1
+        self.run_count = 0
+
+    def __repr__(self):
+        return "Journal(%s,%s)" % (self.path, self.seq)
+
+    def _id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.ids)
+            self.new_names.append((i, name))
+        return i
+
+    def _robot_id(self, robot):
+        robot_id = self.robot_ids[robot] = self._id(robot.name)
+        return robot_id
+
+    def record(self, robot, action, count=1):
+        """
+        Append a successful MOVE, LEFT or RIGHT of robot, count MOVE steps in a row, on the table robot is placed
+        on. MOVEs following a MOVE of the same robot in the block extend its record, as trajectory.Recorder does
+        """
+        robot_id = self.robot_ids.get(robot)
+        if robot_id is None:
+            robot_id = self._robot_id(robot)
+        offset = self.offset
+        if action == 'MOVE':
+            if robot_id == self.run_robot and self.run_count + count <= MAX_RUN:
+                self.run_count += count
+                _pack_run(self.records, offset - RECORD.size + RUN_OFFSET, self.run_count)
+                return
+            _pack_record(self.records, offset, MOVE, robot_id, -1, count, 0, 0)
+            self.run_robot = robot_id
+            self.run_count = count
+        else:
+            _pack_record(self.records, offset, OPCODES[action], robot_id, -1, 0, 0, 0)
+            self.run_robot = -1
+        self.seq += 1
+        self.offset = offset = offset + RECORD.size
+        if offset >= self.limit:
+            self.commit()
+
+    def append(self, robot, table, action, x=0, y=0, f=None):
+        """
+        Append a successful action of robot on table, x, y and f are the arguments of PLACE
+        """
+        robot_id = self.robot_ids.get(robot)
+        if robot_id is None:
+            robot_id = self._robot_id(robot)
+        table_id = self.table_ids.get(table)
+        if table_id is None:
+            table_id = self.table_ids[table] = self._id(table.name)
+        _pack_record(self.records, self.offset, OPCODES[action], robot_id, table_id,
+                     self._id(f) if f is not None else 0, x, y)
+        self.run_robot = -1
+        self.seq += 1
+        self.offset += RECORD.size
+        if self.offset >= self.limit:
+            self.commit()
+
+    @staticmethod
+    def _names(names):
+        payload = bytearray()
+        for i, name in names:
+            encoded = name.encode('utf-8')
+            payload += NAME_ENTRY.pack(i, len(encoded))
+            payload += encoded
+        return BLOCK.pack(NAMES, 0, len(names), len(payload)) + payload
+
+    # write buffered records as one block and fsync it
+    def commit(self):
+        count = self.seq - self.first_seq + 1
+        if not count and not self.new_names:
+            return
+        data = bytearray()
+        if self.new_names:
+            data += self._names(self.new_names)
+        if count:
+            payload = memoryview(self.records).cast('B')[:self.offset].tobytes()
+            data += BLOCK.pack(RECORDS, self.first_seq, count, len(payload))
+            data += payload
+        self.stream.write(data)
+        self.stream.flush()
+        if self.fsync:
+            os.fsync(self.stream.fileno())
+        self.new_names = []
+        self.first_seq = self.seq + 1
+        self.offset = 0
+        self.run_robot = -1
+
+    def truncate(self):
+        """
+        Drop the records committed so far, e.g. once a checkpoint holds them. The journal is replaced at once by
+        one holding the names and an empty block of records keeping the sequence number, so a crash leaves either
+        the old or the new journal.
+        """
+        self.commit()
+        self.stream.close()
+        data = self._names(sorted((i, name) for name, i in self.ids.items()))
+        data += BLOCK.pack(RECORDS, self.seq + 1, 0, 0)
+        _replace(self.path, data, self.fsync)
+        self.stream = open(self.path, 'ab')
+
+    def close(self):
+        self.commit()
+        self.stream.close()
+
+
+# write data to path through a temporary file, so path holds either its old content or data
+def _replace(path, data, fsync=True):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as stream:
+        stream.write(data)
+        stream.flush()
+        if fsync:
+            os.fsync(stream.fileno())
+    os.replace(temporary, path)
+
+
+def _blocks(stream, names, ids=None):
+    """
+    Yield (tag, sequence number of the first record, number of entries, payload length, end offset) of the blocks
+    of a journal stream, reading NAMES blocks into names and ids on the way. The stream is left at the payload of
+    RECORDS blocks, which can be read or skipped, and a partly written block at the end of the stream ends it.
+    """
+    size = os.fstat(stream.fileno()).st_size
+    offset = 0
+    while offset + BLOCK.size <= size:
+        stream.seek(offset)
+        tag, first_seq, count, length = BLOCK.unpack(stream.read(BLOCK.size))
+        start = offset + BLOCK.size
+        if start + length > size or tag not in (NAMES, RECORDS):
+            break
+        offset = start + length
+        if tag == NAMES:
+            payload = stream.read(length)
+            position = 0
+            for n in range(count):
+                i, name_size = NAME_ENTRY.unpack_from(payload, position)
+                position += NAME_ENTRY.size
+                names[i] = payload[position:position + name_size].decode('utf-8')
+                if ids is not None:
+                    ids[names[i]] = i
+                position += name_size
+        yield tag, first_seq, count, length, offset
+
+
+def _read(path, after=0):
+    """
+    Yield (seq, op, robot name, table name, argument name) of the records in journal after sequence number after,
+    reading one block at a time and skipping blocks of older records unread, a partly written block at the end of
+    the file is ignored
+    """
+    names = {}
+    with open(path, 'rb') as stream:
+        for tag, first_seq, count, length, offset in _blocks(stream, names):
+            if tag == NAMES or first_seq + count - 1 <= after:
+                continue
+            records = array('i')
+            records.frombytes(stream.read(length))
+            if sys.byteorder != 'little':
+                records.byteswap()
+            for n in range(max(after - first_seq + 1, 0), count):
+                op, robot, table, arg, x, y = records[n * RECORD_FIELDS:(n + 1) * RECORD_FIELDS]
+                if op == PLACE:
+                    yield first_seq + n, op, names[robot], names[table], (x, y, names[arg])
+                elif op == MOVE and arg > 1:
+                    yield first_seq + n, op, names[robot], names.get(table), (arg,)
+                else:
+                    yield first_seq + n, op, names[robot], names.get(table), ()
+
+
+def records(path, after=0):
+    """
+    Yield (seq, action, robot name, table name, args) of the records in journal at path after sequence number,
+    table name is None for actions on the table the robot is placed on. args of a run of count MOVEs are (count,)
+    """
+    for seq, op, robot, table, args in _read(path, after):
+        yield seq, ACTIONS[op], robot, table, args
+
+
+def checkpoint(simulator, journal, path, truncate=True):
+    """
+    Save a snapshot of simulator to path, marked with the sequence number of the last journal record, then truncate
+    the journal unless truncate is False, as recovery only needs the records after the snapshot. The snapshot is
+    written to a temporary file first and replaces path once on disk, so a crash leaves the old one.
+    """
+    journal.commit()
+    temporary = path + '.tmp'
+    snapshot.save(simulator, temporary, journal.seq)
+    if journal.fsync:
+        with open(temporary, 'rb') as stream:
+            os.fsync(stream.fileno())
+    os.replace(temporary, path)
+    if truncate:
+        journal.truncate()
+    return journal.seq
+
+
+def recover(simulator, snapshot_path, journal_path):
+    """
+    Restore simulator from the snapshot at snapshot_path, if any, then replay the journal records written after
+    it. Return the sequence number of the last record replayed.
+    """
+    from engine import CommandEngine
+    seq = 0
+    if snapshot_path and os.path.exists(snapshot_path):
+        loaded = snapshot.load(snapshot_path)
+        loaded.restore(simulator)
+        seq = loaded.sequence
+    if not os.path.exists(journal_path):
+        return seq
+
+    engine = CommandEngine(simulator)
+    journal, simulator.journal = simulator.journal, None
+    try:
+        for seq, action, robot_name, table_name, args in records(journal_path, seq):
+            robot = simulator.robots.get(robot_name)
+            table = simulator.tables.get(table_name) if table_name is not None else simulator.robot_on_table.get(robot)
+            if robot is not None and table is not None:
+                engine.apply(robot, table, action, args)
+    finally:
+        simulator.journal = journal
+    return seq
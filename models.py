@@ -2,6 +2,9 @@
 There are three models in this toy robot simulator, which are Coordinate model,
 Robot model and Table model.
 """
+from compass import Directions, Versioned, get_compass, step_vector
+from movecache import BLOCKED, MoveCache, move_target
+from obstacles import ObstacleIndex, run_length
 
 
 class Coordinate(object):
@@ -9,6 +12,8 @@ class Coordinate(object):
     Coordinate model contains the x, y coordinates for positioning robot on table
     """
 
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         if isinstance(x, int) and isinstance(y, int):
             self.x = x
@@ -22,10 +27,43 @@ class Coordinate(object):
     def __eq__(self, other):
         return self.x == other.x and self.y == other.y
 
+    def __ne__(self, other):
+        return not self == other
+
     def __repr__(self):
         return "Coordinate(%s,%s)" % (self.x, self.y)
 
 
+class FrozenCoordinate(Coordinate):
+    """
+    Immutable, hashable coordinate which can be shared by robots and caches without being copied. Tables give
+    frozen coordinates, so robots hold them whether PLACE or MOVE set their position; a Coordinate can change and is
+    not hashable
+    """
+
+    __slots__ = ()
+
+    def __init__(self, x, y):
+        if not isinstance(x, int) or not isinstance(y, int):
+            raise TypeError('Coordinate x,y must be int')
+        _set_x(self, x)
+        _set_y(self, y)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    def __reduce__(self):
+        return type(self), (self.x, self.y)
+
+
+# slot setters of x and y, which FrozenCoordinate uses past its own __setattr__
+_set_x = Coordinate.x.__set__
+_set_y = Coordinate.y.__set__
+
+
 class Robot(object):
     """
     Robot model represents the robot which will perform the behavior of move, turn left and turn right.
@@ -37,7 +75,7 @@ class Robot(object):
     # facing derections degree gives each direction a degree value, default 0 degree is SOUTH here,
     # these values can be custom and expanded. e.g. add SOUTH-WEST degree value 45 if you want the robot
     # can face SOUTH-WEST
-    facing_directions = {"SOUTH": 0, "WEST": 90, "NORTH": 180, "EAST": 270}
+    facing_directions = Directions({"SOUTH": 0, "WEST": 90, "NORTH": 180, "EAST": 270})
 
     # LEFT = -1 here means anticlockwise turning, while RIGHT = 1 means clockwise turning
     turn_directions = {"LEFT": -1, "RIGHT": 1}
@@ -45,6 +83,8 @@ class Robot(object):
     # the default turning degree of robot
     turn_degree = 90
 
+    __slots__ = ('name', 'last_position', 'coordinate', 'f', 'degree', '__weakref__')
+
     def __init__(self, name):
         if name:
             self.name = str(name)
@@ -92,13 +132,18 @@ class Robot(object):
                     return True
         return False
 
-    # turn robot in different dicrections
+    # turn robot in different dicrections, a turn to a degree without facing direction fails and leaves the robot
+    # as it was
     def turn(self, direction, degree):
         if self.is_placed() and direction in self.turn_directions.keys():
             # make the degree value always between 0 to 360(not include 360)
             _degree = degree if degree is not None else self.turn_degree
-            self.degree = (self.degree + self.turn_directions[direction] * _degree) % 360
-            self.f = self.get_f(self.degree)
+            _degree = (self.degree + self.turn_directions[direction] * _degree) % 360
+            f = get_compass(self.facing_directions).names.get(_degree)
+            if f is None:
+                return False
+            self.degree = _degree
+            self.f = f
             return True
         return False
 
@@ -110,12 +155,10 @@ class Robot(object):
     def turn_right(self, degree=None):
         return self.turn('RIGHT', degree)
 
-    # get_f cast degree to facing direction
+    # get_f cast degree to facing direction with one compass lookup, keeping the current one for degrees without
+    # facing direction
     def get_f(self, degree):
-        for k, v in self.facing_directions.items():
-            if degree == v:
-                return k
-        return self.f
+        return get_compass(self.facing_directions).names.get(degree, self.f)
 
     # get current situation report
     def get_report(self):
@@ -129,22 +172,50 @@ class Table(object):
 
     # movement step calculation rules based on origin point, default origin point is at SOUTH WEST most corner with
     # Coordinate(0,0), then move to south will be x - 1, while to north is x + 1, and move to west will be y - 1, while
-    # move to east will be y + 1. This can be custom when creating table instance.
-    STEP_CAL_RULE = {'TO_SOUTH': -1, 'TO_NORTH': 1, 'TO_WEST': -1, 'TO_EAST': 1}
+    # move to east will be y + 1. This can be custom when creating table instance. Rules are Versioned so the move cache
+    # checks them cheaply, plain dicts assigned later are compared in full
+    STEP_CAL_RULE = Versioned({'TO_SOUTH': -1, 'TO_NORTH': 1, 'TO_WEST': -1, 'TO_EAST': 1})
     y_axis = ['SOUTH','NORTH']
     x_axis = ['WEST', 'EAST']
 
     attributes = ['name', 'dx', 'dy', 'rule']
 
-    def __init__(self, name, dx, dy, new_step_cal_rule=None):
+    # obstacle index of blocked cells robots cannot be placed or moved into, None for a table without obstacles
+    obstacles = None
+
+    # occupancy index of robots on table, None unless enable_occupancy() is called
+    occupancy = None
+
+    # per cell visit counts in a tiles.TileMap, None unless enable_sparse() is called
+    visits = None
+
+    # planner.Planner answering shortest command sequence queries, created on the first plan()
+    _planner = None
+
+    # (STEP_CAL_RULE, x_axis, y_axis, steps) filled in by step(), steps maps a facing direction to the (x, y) change
+    # of one MOVE or None following copies of the rules, so changing a rule in place or on the class is noticed
+    _steps = None
+
+    # maximum number of MOVE results memoized per table, 0 disables the move cache
+    move_cache_size = 4096
+    move_cache = None
+
+    # attributes which change MOVE results, setting any of them invalidates the move cache
+    movement_attributes = frozenset(['dx', 'dy', 'STEP_CAL_RULE', 'x_axis', 'y_axis', 'obstacles'])
+
+    def __init__(self, name, dx, dy, new_step_cal_rule=None, obstacles=None):
         self.name = str(name)
+        if self.move_cache_size:
+            self.move_cache = MoveCache(self.move_cache_size)
         if isinstance(dx, int) and isinstance(dy, int):
             self.dx = dx  # dimension x
             self.dy = dy  # dimension y
         else:
             raise TypeError('Dimension dx,dy must be int')
         if new_step_cal_rule is not None:
-            self.STEP_CAL_RULE = new_step_cal_rule
+            self.STEP_CAL_RULE = Versioned(new_step_cal_rule)
+        if obstacles:
+            self.obstacles = ObstacleIndex(obstacles)
 
     def __str__(self):
         return "%s" % self.name
@@ -152,12 +223,126 @@ class Table(object):
     def __repr__(self):
         return 'Table("%s",%s,%s)' % (self.name,self.dx, self.dy)
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.movement_attributes:
+            self.invalidate_cache()
+
+    # drop memoized MOVE results and planner caches. Changes of the dimensions and movement rules are also noticed on
+    # lookup, this is needed after changing obstacles without set_blocked
+    def invalidate_cache(self):
+        if self.move_cache is not None:
+            self.move_cache.clear()
+        self._planner = None
+        self._steps = None
+
     def get_coordinate(self, x, y):
         if not isinstance(x, int) or not isinstance(y, int):
             raise TypeError('x,y must be int')
         # limit coordinate x,y within dx,dy
         if 0 <= x < self.dx and 0 <= y < self.dy:
-            return Coordinate(x, y)
+            if self.obstacles is not None and (x, y) in self.obstacles:
+                return None
+            return FrozenCoordinate(x, y)
         else:
             # raise ValueError('x,y must be less than dx, dy in table')
             return None
+
+    # get the coordinate reached by moving from x,y facing f, None if the move would leave the table or hit an
+    # obstacle
+    def next_coordinate(self, x, y, f):
+        if self.move_cache is None:
+            target = move_target(self, x, y, f)
+            return FrozenCoordinate(*target) if target is not None else None
+        result = self.move_cache.get(self, x, y, f)
+        return None if result is BLOCKED else result
+
+    # get the (x, y) change of one MOVE facing f, None if f cannot move on this table. Diagonal directions add up
+    # the steps of their parts, see compass.step_vector
+    def step(self, f):
+        cached = self._steps
+        if (cached is None or cached[0] != self.STEP_CAL_RULE or cached[1] != self.x_axis
+                or cached[2] != self.y_axis):
+            cached = self._steps = (dict(self.STEP_CAL_RULE), list(self.x_axis), list(self.y_axis), {})
+        steps = cached[3]
+        if f in steps:
+            return steps[f]
+        step = steps[f] = step_vector(self.STEP_CAL_RULE, self.x_axis, self.y_axis, f)
+        return step
+
+    # get the number of MOVEs from x,y facing f before the next obstacle or edge, at most count unless count is None.
+    # Unit steps are resolved with one lookup in the obstacle index
+    def free_run(self, x, y, f, count=None):
+        step = self.step(f)
+        if step is None:
+            return 0
+        sx, sy = step
+        run = run_length(x, y, sx, sy, self.dx, self.dy, count)
+        if self.obstacles is None or not run:
+            return run
+        if abs(sx) + abs(sy) == 1:
+            distance = self.obstacles.free_run(x, y, sx, sy)
+            return run if distance is None else min(run, distance)
+        for n in range(1, run + 1):
+            if (x + n * sx, y + n * sy) in self.obstacles:
+                return n - 1
+        return run
+
+    # keep track of the robots on table so that two robots cannot share a cell, mode is 'grid', 'sparse', 'tiled' or
+    # None to choose by table size
+    def enable_occupancy(self, mode=None):
+        # imported on first use, like the other optional subsystems, to keep importing models fast
+        from occupancy import create_occupancy
+        self.occupancy = create_occupancy(self.dx, self.dy, mode)
+        return self.occupancy
+
+    # get the robot at x,y, None if the cell is free or occupancy is not enabled
+    def who_is_at(self, x, y):
+        if self.occupancy is None or not (0 <= x < self.dx and 0 <= y < self.dy):
+            return None
+        return self.occupancy.get(x, y)
+
+    # get the list of (x, y, robot) within the rectangle x0..x1, y0..y1 inclusive, ordered by y then x
+    def robots_within(self, x0, y0, x1, y1):
+        if self.occupancy is None:
+            return []
+        return list(self.occupancy.within(max(x0, 0), max(y0, 0), min(x1, self.dx - 1), min(y1, self.dy - 1)))
+
+    # keep per cell data of huge tables sparse, so memory is proportional to the cells used rather than to dx * dy:
+    # visit counts in tiles allocated when first touched, tiles.TILE_SIZE by default, and occupancy in a hash map of
+    # the occupied cells. Obstacles are kept per obstacle on any table
+    def enable_sparse(self, tile_size=None):
+        from occupancy import SparseOccupancy
+        from tiles import TILE_SIZE, TileMap
+        if tile_size is None:
+            tile_size = TILE_SIZE
+        self.visits = TileMap(tile_size, 0)
+        self.occupancy = SparseOccupancy()
+
+    # count a robot arriving at x,y when visits are tracked
+    def visit(self, x, y):
+        if self.visits is not None:
+            self.visits.add(x, y)
+
+    # get the number of times robots arrived at x,y
+    def visit_count(self, x, y):
+        return self.visits.get(x, y) if self.visits is not None else 0
+
+    # put or remove an obstacle at x,y, robots cannot be placed or moved onto obstacles
+    def set_blocked(self, x, y, blocked=True):
+        if self.obstacles is None:
+            self.obstacles = ObstacleIndex()
+        if blocked:
+            self.obstacles.add(x, y)
+        else:
+            self.obstacles.remove(x, y)
+        self.invalidate_cache()
+
+    def is_blocked(self, x, y):
+        return self.obstacles is not None and (x, y) in self.obstacles
+
+    # get the shortest list of MOVE, LEFT and RIGHT commands taking a robot at x,y facing f to to_x,to_y facing to_f,
+    # None if it cannot get there or no plan was found searching limit states, planner.SEARCH_LIMIT by default
+    def plan(self, x, y, f, to_x, to_y, to_f, limit=None):
+        from planner import SEARCH_LIMIT, get_planner
+        return get_planner(self).plan((x, y, f), (to_x, to_y, to_f), SEARCH_LIMIT if limit is None else limit)
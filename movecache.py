@@ -0,0 +1,100 @@
+"""
+Move cache of a table memoizes the result of a MOVE from (x, y) facing f, which is the immutable coordinate
+reached or BLOCKED at the table edges and obstacles, so repeated moves skip validating and allocating coordinates.
+The cache is bounded, evicting the least recently used results first, and holds the only reference the cache keeps
+to each coordinate, so memory stays bounded too. It keeps a copy of the table dimensions and movement rules its
+results were computed with and starts over when they change, even when a rule is changed in place or on the class.
+"""
+from collections import OrderedDict
+
+from compass import Versioned
+
+# result of a move which would leave the table
+BLOCKED = object()
+
+
+# get the x,y reached by moving from x,y facing f following table STEP_CAL_RULE, x_axis and y_axis, None if the
+# move would leave the table or hit an obstacle
+def move_target(table, x, y, f):
+    step = table.step(f)
+    if step is None:
+        return None
+    x, y = x + step[0], y + step[1]
+    if 0 <= x < table.dx and 0 <= y < table.dy and not table.is_blocked(x, y):
+        return x, y
+    return None
+
+
+class MoveCache(object):
+    """
+    LRU cache of at most size move results, counting hits and misses
+    """
+
+    def __init__(self, size):
+        if size <= 0:
+            raise ValueError('Move cache size must be positive')
+        # imported here as models depends on this module. Results are frozen but not interned coordinates, so
+        # evicting them from the cache frees them
+        from models import FrozenCoordinate
+        self.coordinate = FrozenCoordinate
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # (STEP_CAL_RULE, x_axis, y_axis, dx, dy) copied from the table the results were computed for
+        self.rule = self.x_axis = self.y_axis = self.dx = self.dy = None
+        # the Versioned rule of the table and its version when last checked, None to check the rule in full
+        self.source = self.version = None
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return "MoveCache(%s/%s)" % (len(self.results), self.size)
+
+    # check the results were computed with the current table dimensions and movement rules
+    def is_valid(self, table):
+        return (self.rule == table.STEP_CAL_RULE and self.dx == table.dx and self.dy == table.dy
+                and self.x_axis == table.x_axis and self.y_axis == table.y_axis)
+
+    # drop the results unless they are valid for table, keeping a copy of its dimensions and movement rules to check
+    # later lookups against
+    def check(self, table):
+        rule = table.STEP_CAL_RULE
+        if not self.is_valid(table):
+            self.results.clear()
+            self.rule = dict(rule)
+            self.x_axis, self.y_axis = list(table.x_axis), list(table.y_axis)
+            self.dx, self.dy = table.dx, table.dy
+        self.source = rule if isinstance(rule, Versioned) else None
+        self.version = rule.version if self.source is not None else None
+
+    # get the result of moving from x,y facing f on table, the frozen coordinate reached or BLOCKED
+    def get(self, table, x, y, f):
+        # an unchanged Versioned rule skips comparing the whole rule on every MOVE, setting the table dimensions or axes
+        # clears the cache so the next lookup checks them
+        rule = table.STEP_CAL_RULE
+        if rule is not self.source or rule.version != self.version:
+            self.check(table)
+        key = (x, y, f)
+        results = self.results
+        result = results.get(key)
+        if result is not None:
+            self.hits += 1
+            results.move_to_end(key)
+            return result
+        self.misses += 1
+        target = move_target(table, x, y, f)
+        result = self.coordinate(*target) if target is not None else BLOCKED
+        results[key] = result
+        if len(results) > self.size:
+            results.popitem(last=False)
+        return result
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def clear(self):
+        self.results.clear()
+        self.source = None
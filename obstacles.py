@@ -0,0 +1,85 @@
+"""
+Obstacle index of a table keeps the blocked cells in a set, and the blocked x of every row and blocked y of every
+column in sorted lists, so the free run from a cell to the next obstacle in any direction is one bisect. Memory is
+proportional to the number of obstacles, whatever the table size.
+"""
+from bisect import bisect_left, bisect_right, insort
+
+
+# get the number of moves of sx,sy from x,y which stay within a width x height table, at most count unless count
+# is None or negative
+def run_length(x, y, sx, sy, width, height, count=None):
+    if sx > 0:
+        n = (width - 1 - x) // sx
+    elif sx < 0:
+        n = x // -sx
+    else:
+        n = None
+    if sy > 0:
+        m = (height - 1 - y) // sy
+        n = m if n is None else min(n, m)
+    elif sy < 0:
+        m = y // -sy
+        n = m if n is None else min(n, m)
+    if n is None:
+        n = 0
+    if count is None or count < 0:
+        return n
+    return min(n, count)
+
+
+class ObstacleIndex(object):
+    """
+    Obstacle index of blocked cells, rows maps y to the sorted x of its obstacles and columns maps x to the sorted y
+    """
+
+    def __init__(self, cells=()):
+        self.cells = set()
+        self.rows = {}
+        self.columns = {}
+        for x, y in cells:
+            self.add(x, y)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return cell in self.cells
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __repr__(self):
+        return "ObstacleIndex(%s)" % len(self.cells)
+
+    def add(self, x, y):
+        if (x, y) not in self.cells:
+            self.cells.add((x, y))
+            insort(self.rows.setdefault(y, []), x)
+            insort(self.columns.setdefault(x, []), y)
+
+    def remove(self, x, y):
+        if (x, y) in self.cells:
+            self.cells.remove((x, y))
+            for key, values, value in ((y, self.rows, x), (x, self.columns, y)):
+                line = values[key]
+                del line[bisect_left(line, value)]
+                if not line:
+                    del values[key]
+
+    # get the number of unit steps sx,sy (one of them 0, the other 1 or -1) from x,y before the next obstacle,
+    # None if there is no obstacle that way
+    def free_run(self, x, y, sx, sy):
+        if sx:
+            line, position = self.rows.get(y), x
+            step = sx
+        else:
+            line, position = self.columns.get(x), y
+            step = sy
+        if not line:
+            return None
+        if step > 0:
+            i = bisect_right(line, position)
+            return line[i] - position - 1 if i < len(line) else None
+        i = bisect_left(line, position)
+        return position - line[i - 1] - 1 if i else None
@@ -0,0 +1,135 @@
+"""
+Occupancy index of a table keeps which robot stands on which cell, so checking a cell is free, moving a robot and
+asking who is at a coordinate are O(1), and rectangle queries never scan the whole fleet. GridOccupancy is a dense
+grid for small tables, SparseOccupancy a hash map for sparse or huge tables, tiles.TiledOccupancy a lazily
+allocated tile map for huge tables with clustered robots.
+"""
+from tiles import TiledOccupancy
+
+# tables with at most this number of cells use the dense grid by default
+GRID_LIMIT = 1 << 20
+
+
+class GridOccupancy(object):
+    """
+    Dense occupancy grid, cell (x, y) is stored at cells[y * dx + x]
+    """
+
+    # name of the occupancy mode, as given to create_occupancy
+    mode = 'grid'
+
+    def __init__(self, dx, dy):
+        self.dx = dx
+        self.dy = dy
+        self.cells = [None] * (dx * dy)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "GridOccupancy(%s,%s)" % (self.dx, self.dy)
+
+    # get the robot at x,y, None if the cell is free
+    def get(self, x, y):
+        return self.cells[y * self.dx + x]
+
+    # put robot at x,y, return False if another robot is there
+    def add(self, robot, x, y):
+        i = y * self.dx + x
+        occupant = self.cells[i]
+        if occupant is None:
+            self.cells[i] = robot
+            self.count += 1
+            return True
+        return occupant is robot
+
+    # remove robot from x,y if it is there
+    def remove(self, robot, x, y):
+        i = y * self.dx + x
+        if self.cells[i] is robot:
+            self.cells[i] = None
+            self.count -= 1
+
+    # move robot from x0,y0 to x1,y1, return False if another robot is at x1,y1
+    def move(self, robot, x0, y0, x1, y1):
+        if self.add(robot, x1, y1):
+            if (x0, y0) != (x1, y1):
+                self.remove(robot, x0, y0)
+            return True
+        return False
+
+    # yield (x, y, robot) of occupied cells within x0..x1, y0..y1 inclusive
+    def within(self, x0, y0, x1, y1):
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.dx - 1), min(y1, self.dy - 1)
+        cells = self.cells
+        for y in range(y0, y1 + 1):
+            row = y * self.dx
+            for x in range(x0, x1 + 1):
+                robot = cells[row + x]
+                if robot is not None:
+                    yield x, y, robot
+
+
+class SparseOccupancy(object):
+    """
+    Sparse occupancy keeping only occupied cells in a dictionary {(x, y): robot}
+    """
+
+    mode = 'sparse'
+
+    def __init__(self):
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __repr__(self):
+        return "SparseOccupancy(%s)" % len(self.cells)
+
+    def get(self, x, y):
+        return self.cells.get((x, y))
+
+    def add(self, robot, x, y):
+        occupant = self.cells.setdefault((x, y), robot)
+        return occupant is robot
+
+    def remove(self, robot, x, y):
+        if self.cells.get((x, y)) is robot:
+            del self.cells[(x, y)]
+
+    def move(self, robot, x0, y0, x1, y1):
+        if self.add(robot, x1, y1):
+            if (x0, y0) != (x1, y1):
+                self.remove(robot, x0, y0)
+            return True
+        return False
+
+    def within(self, x0, y0, x1, y1):
+        # look up every cell of small rectangles, otherwise filter the occupied cells
+        if x1 < x0 or y1 < y0:
+            return
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self.cells):
+            for y in range(y0, y1 + 1):
+                for x in range(x0, x1 + 1):
+                    robot = self.cells.get((x, y))
+                    if robot is not None:
+                        yield x, y, robot
+        else:
+            for (x, y), robot in sorted(self.cells.items(), key=lambda item: (item[0][1], item[0][0])):
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    yield x, y, robot
+
+
+# create the occupancy index for a dx * dy table, mode is 'grid', 'sparse', 'tiled' or None to choose by table size
+def create_occupancy(dx, dy, mode=None):
+    if mode is None:
+        mode = 'grid' if dx * dy <= GRID_LIMIT else 'sparse'
+    if mode == 'grid':
+        return GridOccupancy(dx, dy)
+    elif mode == 'sparse':
+        return SparseOccupancy()
+    elif mode == 'tiled':
+        return TiledOccupancy()
+    raise ValueError('Occupancy mode must be grid, sparse or tiled')
@@ -0,0 +1,743 @@
+"""
+Planner answers "what is the shortest command sequence taking a robot from (x, y, F) to (x', y', F')" on a table.
+States are (x, y, heading) as defined by Robot.facing_directions, Robot.turn_degree and the table STEP_CAL_RULE,
+every MOVE, LEFT and RIGHT costs one command.
+
+On tables without obstacles where every move is one cell, the optimal plan is worked out directly: turn, move
+along one axis, turn, move along the other, turn to the final heading. Otherwise small tables get a
+breadth-first distance field per goal, cached so later queries to the same goal just walk down it, and large
+tables are searched with A* guided by precomputed move and turn lower bounds.
+
+Goals which cannot be reached are answered before searching: the goal heading must be reachable by turning, the
+goal offset must be a sum of the steps of those headings, and on tables moving one cell per MOVE the goal must lie
+in the same connected component of free cells, worked out once per table from the free spans between obstacles.
+
+On tables moving one cell per MOVE each way, A* moves in runs rather than one cell at a time. A shortest plan can
+always have its straight segments slid sideways until they touch an obstacle, an edge or the goal line, so a run
+only stops where turning could start such a segment. The search ends as soon as a state it takes has an obstacle
+free plan of at most three legs as cheap as its lower bound, the lower bound rises to the next possible cost for
+states without one, and when that does not end the search quickly it also counts the free spans which must be
+crossed to get around obstacles. Searches give up after SEARCH_LIMIT states.
+"""
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from math import gcd
+
+from bytecode import STEP_OPS, get_headings, get_transitions
+from models import Robot
+from obstacles import run_length
+
+ACTIONS = ['MOVE', 'LEFT', 'RIGHT']
+
+# tables with at most this number of (x, y, heading) states use cached distance fields
+FIELD_LIMIT = 1 << 16
+
+# number of goal distance fields kept per table
+FIELD_CACHE_SIZE = 64
+
+# maximum number of states a search takes before giving up on a plan
+SEARCH_LIMIT = 1 << 18
+
+# states searched with the plain lower bound before working out the obstacle spans bound
+QUICK_LIMIT = 1 << 10
+
+# lanes tried for the middle leg of a three leg plan before giving up on it
+SHORTCUT_LANES = 64
+
+UNREACHABLE = -1
+
+
+class Planner(object):
+    """
+    Planner of one table, rebuilt when the table transitions change
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.headings = get_headings()
+        self.transitions = get_transitions(table)
+        self.count = len(self.headings.states)
+        self.size = table.dx * table.dy * self.count
+        self.fields = OrderedDict()
+        self.predecessors = None
+        self.spans = {}
+        self.stops = None
+        self._turns()
+        self._moves()
+
+    def __repr__(self):
+        return "Planner(%s)" % self.table.name
+
+    def is_valid(self):
+        return get_transitions(self.table) is self.transitions and len(self.headings.states) == self.count
+
+    # turns[a][b] is the shortest list of LEFT/RIGHT turning heading a into heading b, None if it cannot
+    def _turns(self):
+        steps = self.transitions.steps
+        self.turns = []
+        for a in range(self.count):
+            paths = {a: []}
+            queue = [a]
+            for h in queue:
+                for action, op in (('LEFT', 1), ('RIGHT', 2)):
+                    turned = steps[h * STEP_OPS + op][2]
+                    if turned not in paths:
+                        paths[turned] = paths[h] + [action]
+                        queue.append(turned)
+            self.turns.append([paths.get(b) for b in range(self.count)])
+
+    # find the largest step along each axis, for the A* lower bound, and the headings moving one cell each way
+    def _moves(self):
+        self.max_x = self.max_y = 0
+        self.unit = {}
+        self.unit_steps = True
+        self.diagonal = False
+        for h in range(self.count):
+            step = self.transitions.steps[h * STEP_OPS]
+            if step is None or step[:2] == (0, 0):
+                continue
+            sx, sy = step[0], step[1]
+            self.max_x, self.max_y = max(self.max_x, abs(sx)), max(self.max_y, abs(sy))
+            if abs(sx) + abs(sy) == 1:
+                self.unit.setdefault((sx, sy), []).append(h)
+            else:
+                self.unit_steps = False
+                self.diagonal = self.diagonal or (sx != 0 and sy != 0)
+        self.simple = self.unit_steps and self.table.obstacles is None
+        # every heading turns into every other and one cell moves go each way, so runs can be jumped
+        self.grid = self.unit_steps and len(self.unit) == 4 and \
+            all(t is not None for turns in self.turns for t in turns)
+        self.routes = {}
+        # amount _parity_bound raises _bound by, 0 unless every unit direction has one heading
+        self.raise_by = 0
+        if self.grid and all(len(headings) == 1 for headings in self.unit.values()):
+            self.raise_by = 2 if self._alternating() else 1
+        # lattice of the offsets reachable from each heading, spanned by the steps of the headings it turns into
+        self.lattices = []
+        for h in range(self.count):
+            steps = [self.transitions.steps[b * STEP_OPS] for b in range(self.count) if self.turns[h][b] is not None]
+            self.lattices.append(_lattice(step[:2] for step in steps if step is not None))
+
+    def _alternating(self):
+        # check headings split in two classes with every LEFT and RIGHT turning into the other class
+        steps = self.transitions.steps
+        side = {0: 0}
+        queue = [0]
+        for h in queue:
+            for op in (1, 2):
+                turned = steps[h * STEP_OPS + op][2]
+                if turned not in side:
+                    side[turned] = 1 - side[h]
+                    queue.append(turned)
+                elif side[turned] == side[h]:
+                    return False
+        return True
+
+    def _route(self, h, gh, sx, sy):
+        """
+        Get the cheapest way from heading h to heading gh through a heading moving sx along x when sx is not 0 and
+        one moving sy along y when sy is not 0, as (turns, [(heading, axis)], [turn lists]), None if there is
+        none.
+        """
+        routes = self._routes(h, gh, sx, sy)
+        return routes[0] if routes else None
+
+    def _routes(self, h, gh, sx, sy):
+        # every way of _route, cheapest first, precomputed lazily per (h, gh, sx, sy). Besides moving along each axis
+        # once, when both are needed it may move along one axis in two legs around a leg along the other
+        key = (h, gh, sx, sy)
+        if key in self.routes:
+            return self.routes[key]
+        legs = []
+        for axis, unit in ((0, (sx, 0)), (1, (0, sy))):
+            if unit != (0, 0):
+                headings = self.unit.get(unit)
+                if not headings:
+                    self.routes[key] = []
+                    return []
+                legs.append([(heading, axis) for heading in headings])
+        orders = [legs]
+        if len(legs) == 2:
+            orders += [legs[::-1], legs + legs[:1], legs[::-1] + legs[1:]]
+        routes = []
+        for order in orders:
+            for choice in _product(order):
+                route = [h] + [heading for heading, axis in choice] + [gh]
+                turns = [self.turns[a][b] for a, b in zip(route, route[1:])]
+                if any(t is None for t in turns):
+                    continue
+                routes.append((sum(len(t) for t in turns), choice, turns))
+        routes.sort(key=lambda route: route[0])
+        self.routes[key] = routes
+        return routes
+
+    def state(self, x, y, f):
+        """
+        Get the (x, y, heading) state of a robot at x, y facing f, None if it is not a valid position
+        """
+        table = self.table
+        if f not in Robot.facing_directions or not (0 <= x < table.dx and 0 <= y < table.dy) \
+                or table.is_blocked(x, y):
+            return None
+        return x, y, self.headings.state(Robot.facing_directions[f], f)
+
+    def plan(self, start, goal, limit=SEARCH_LIMIT):
+        """
+        Get the shortest list of commands from start to goal, both (x, y, f), None if goal cannot be reached or no
+        plan was found searching limit states
+        """
+        start, goal = self.state(*start), self.state(*goal)
+        if start is None or goal is None or not self.reachable(start, goal):
+            return None
+        if self.simple:
+            commands = self._direct(start, goal)
+            if commands is not None:
+                return commands
+        if self.size <= FIELD_LIMIT:
+            return self._follow(start, goal)
+        return self._search(start, goal, limit)
+
+    def reachable(self, start, goal):
+        """
+        Check goal state can be reached from start state: False when the goal heading cannot be turned to, the goal
+        offset is not a sum of the steps of the headings turned to, or, on tables moving one cell each way, the goal
+        is cut off by obstacles. True does not guarantee a plan on other tables.
+        """
+        x, y, h = start
+        gx, gy, gh = goal
+        if self.turns[h][gh] is None or not _on_lattice(self.lattices[h], gx - x, gy - y):
+            return False
+        if self.grid and self.table.obstacles is not None:
+            rows = self._spans(False)
+            return rows.components[rows.span(y, x)] == rows.components[rows.span(gy, gx)]
+        return True
+
+    def _spans(self, transposed):
+        spans = self.spans.get(transposed)
+        if spans is None:
+            spans = self.spans[transposed] = Spans(self.table, transposed)
+        return spans
+
+    def _direct(self, start, goal):
+        # plan of an obstacle free table moving one cell per MOVE, None when an axis direction needed has no heading
+        x, y, h = start
+        gx, gy, gh = goal
+        route = self._route(h, gh, _sign(gx - x), _sign(gy - y))
+        if route is None:
+            return None
+        remaining = [abs(gx - x), abs(gy - y)]
+        distances = []
+        for heading, axis in route[1]:
+            distances.append(remaining[axis])
+            remaining[axis] = 0
+        return _commands(route, distances)
+
+    def _shortcut(self, state, goal):
+        """
+        Get a plan from state to goal in at most three legs, as cheap as _bound and clear of obstacles, as
+        (commands or None, whether None is certain). Lanes for the middle of three legs are tried up to
+        SHORTCUT_LANES, beyond them None is not certain.
+        """
+        x, y, h = state
+        gx, gy, gh = goal
+        routes = self._routes(h, gh, _sign(gx - x), _sign(gy - y))
+        certain = True
+        for route in routes:
+            if route[0] > routes[0][0]:
+                break
+            choice = route[1]
+            if len(choice) < 3:
+                distances = self._clear(x, y, [(heading, abs(gy - y) if axis else abs(gx - x))
+                                               for heading, axis in choice])
+            else:
+                distances, lanes = self._lane(x, y, gx, gy, choice)
+                certain = certain and lanes <= SHORTCUT_LANES
+            if distances is not None:
+                return _commands(route, distances), True
+        return None, certain
+
+    def _clear(self, x, y, legs):
+        # get the distances of legs [(heading, distance)] from x, y when every leg is clear of obstacles, else None
+        steps = self.transitions.steps
+        for heading, distance in legs:
+            sx, sy = steps[heading * STEP_OPS][:2]
+            if self._run(x, y, sx, sy) < distance:
+                return None
+            x, y = x + sx * distance, y + sy * distance
+        return [distance for heading, distance in legs]
+
+    def _lane(self, x, y, gx, gy, choice):
+        """
+        Get the distances of three legs from x, y to gx, gy moving along one axis, across along the other and along
+        the first again, with the middle leg on the nearest clear lane, as (distances or None, lanes tried)
+        """
+        (first, axis), (middle, other), (last, axis) = choice
+        steps = self.transitions.steps
+        if axis:
+            x, y, gx, gy = y, x, gy, gx
+            lines = self.table.obstacles.rows
+        else:
+            lines = self.table.obstacles.columns
+        step = _sign(gx - x)
+        out = self._run(*self._cell(axis, x, y, step))
+        back = self._run(*self._cell(axis, gx, gy, -step))
+        # lanes reachable leaving the start and the goal along the axis
+        near, far = max(0, abs(gx - x) - back), min(out, abs(gx - x))
+        low, high = min(y, gy), max(y, gy)
+        lanes = 0
+        for n in range(near, far + 1):
+            lanes += 1
+            if lanes > SHORTCUT_LANES:
+                return None, lanes
+            blocked = lines.get(x + step * n)
+            if blocked:
+                i = bisect_left(blocked, low)
+                if i < len(blocked) and blocked[i] <= high:
+                    continue
+            return [n, high - low, abs(gx - x) - n], lanes
+        return None, lanes
+
+    @staticmethod
+    def _cell(axis, x, y, step):
+        # (x, y, sx, sy) of a run step along axis from a cell given with axis first
+        return (y, x, 0, step) if axis else (x, y, step, 0)
+
+    def _parity_bound(self, state, goal, shortcuts):
+        """
+        Get _bound, raised when no plan in at most three legs reaches it: only such plans cost exactly _bound on
+        tables with one heading each way, and plan costs to a goal all have the same parity when turns alternate
+        between two classes of headings, so the next possible cost is two more. The plan found, or None, is kept in
+        shortcuts[state]
+        """
+        bound = self._bound(state, goal)
+        if bound is not None and self.raise_by:
+            commands, certain = shortcuts[state] = self._shortcut(state, goal)
+            if commands is None and certain:
+                bound += self.raise_by
+        return bound
+
+    def _run(self, x, y, sx, sy):
+        # number of one cell moves sx, sy from x, y before the next obstacle or edge
+        table = self.table
+        run = run_length(x, y, sx, sy, table.dx, table.dy)
+        if table.obstacles is None or not run:
+            return run
+        distance = table.obstacles.free_run(x, y, sx, sy)
+        return run if distance is None else min(run, distance)
+
+    def _jump(self, x, y, sx, sy, goal):
+        """
+        Get the cell where a run of one cell moves sx, sy from x, y stops: at the goal line, before an obstacle or
+        edge, or first where a segment across the run could not be slid any further, None if it cannot move
+        """
+        run = self._run(x, y, sx, sy)
+        if not run:
+            return None
+        obstacles = self.table.obstacles
+        if self.stops is None:
+            self.stops = [sorted(set(n + d for n in lines for d in (-1, 1)))
+                          for lines in (obstacles.columns, obstacles.rows)]
+        if sx:
+            lines, stops, at, step, position, size, target = obstacles.columns, self.stops[0], x, sx, y, \
+                self.table.dy, goal[0]
+        else:
+            lines, stops, at, step, position, size, target = obstacles.rows, self.stops[1], y, sy, x, \
+                self.table.dx, goal[1]
+        end = at + step * run
+        if 0 < (target - at) * step and 0 <= (end - target) * step:
+            end = target
+        if step > 0:
+            i = bisect_right(stops, at)
+            while i < len(stops) and stops[i] < end:
+                if _pinned(lines, stops[i], position, size):
+                    end = stops[i]
+                    break
+                i += 1
+        else:
+            i = bisect_left(stops, at) - 1
+            while i >= 0 and stops[i] > end:
+                if _pinned(lines, stops[i], position, size):
+                    end = stops[i]
+                    break
+                i -= 1
+        return (end, y) if sx else (x, end)
+
+    def _successors(self, x, y, h):
+        # yield (action, state) of the commands which change state x, y, h
+        steps = self.transitions.steps
+        table = self.table
+        step = steps[h * STEP_OPS]
+        if step is not None:
+            nx, ny = x + step[0], y + step[1]
+            if (nx, ny) != (x, y) and 0 <= nx < table.dx and 0 <= ny < table.dy and not table.is_blocked(nx, ny):
+                yield 'MOVE', (nx, ny, h)
+        left, right = steps[h * STEP_OPS + 1][2], steps[h * STEP_OPS + 2][2]
+        if left != h:
+            yield 'LEFT', (x, y, left)
+        if right != h:
+            yield 'RIGHT', (x, y, right)
+
+    def _index(self, x, y, h):
+        return (y * self.table.dx + x) * self.count + h
+
+    def _field(self, goal):
+        # distances to goal of every state, by breadth-first search over the reversed transitions
+        field = self.fields.get(goal)
+        if field is not None:
+            self.fields.move_to_end(goal)
+            return field
+        if self.predecessors is None:
+            self.predecessors = [[] for i in range(self.size)]
+            dx, count = self.table.dx, self.count
+            for s in range(self.size):
+                cell, h = divmod(s, count)
+                y, x = divmod(cell, dx)
+                if self.table.is_blocked(x, y):
+                    continue
+                for action, state in self._successors(x, y, h):
+                    self.predecessors[self._index(*state)].append(s)
+        field = array('i', [UNREACHABLE]) * self.size
+        g = self._index(*goal)
+        field[g] = 0
+        queue = [g]
+        predecessors = self.predecessors
+        for s in queue:
+            d = field[s] + 1
+            for p in predecessors[s]:
+                if field[p] == UNREACHABLE:
+                    field[p] = d
+                    queue.append(p)
+        self.fields[goal] = field
+        if len(self.fields) > FIELD_CACHE_SIZE:
+            self.fields.popitem(last=False)
+        return field
+
+    def _follow(self, start, goal):
+        field = self._field(goal)
+        d = field[self._index(*start)]
+        if d == UNREACHABLE:
+            return None
+        commands = []
+        state = start
+        while d:
+            for action, successor in self._successors(*state):
+                if field[self._index(*successor)] == d - 1:
+                    commands.append(action)
+                    state = successor
+                    d -= 1
+                    break
+        return commands
+
+    def _bound(self, state, goal, shortcuts=None):
+        """
+        Get a lower bound of the commands from state to goal, None if goal cannot be reached. With one cell moves it
+        is the cost of the plan ignoring obstacles, otherwise the moves needed at the largest steps, plus one turn
+        when both axes must be travelled without diagonal moves, or the turns to the goal heading when more.
+        shortcuts is unused, see _parity_bound.
+        """
+        x, y, h = state
+        gx, gy, gh = goal
+        if self.unit_steps:
+            route = self._route(h, gh, _sign(gx - x), _sign(gy - y))
+            return route[0] + abs(gx - x) + abs(gy - y) if route is not None else None
+        ddx, ddy = abs(gx - x), abs(gy - y)
+        if (ddx and not self.max_x) or (ddy and not self.max_y):
+            return None
+        moves_x, moves_y = -(-ddx // self.max_x) if ddx else 0, -(-ddy // self.max_y) if ddy else 0
+        if self.diagonal:
+            moves = max(moves_x, moves_y)
+        else:
+            moves = moves_x + moves_y + (1 if ddx and ddy else 0)
+        turns = self.turns[h][gh]
+        return max(moves, len(turns)) if turns is not None else moves
+
+    def _jumps(self, x, y, h, goal):
+        # yield (action, count, state) of the turns and the MOVE run which change state x, y, h
+        steps = self.transitions.steps
+        step = steps[h * STEP_OPS]
+        if step is not None:
+            cell = self._jump(x, y, step[0], step[1], goal)
+            if cell is not None:
+                yield 'MOVE', abs(cell[0] - x) + abs(cell[1] - y), (cell[0], cell[1], h)
+        left, right = steps[h * STEP_OPS + 1][2], steps[h * STEP_OPS + 2][2]
+        if left != h:
+            yield 'LEFT', 1, (x, y, left)
+        if right != h:
+            yield 'RIGHT', 1, (x, y, right)
+
+    def _spans_bound(self, goal):
+        """
+        Get a lower bound function tighter than _bound around obstacles: every span of free row cells between the
+        row of a state and the goal row needs a MOVE across, besides the MOVEs along x, and likewise for columns
+        """
+        gx, gy = goal[0], goal[1]
+        rows, columns = self._spans(False), self._spans(True)
+        row_hops, column_hops = rows.hops(rows.span(gy, gx)), columns.hops(columns.span(gx, gy))
+
+        def bound(state, goal, shortcuts):
+            x, y = state[0], state[1]
+            return max(self._parity_bound(state, goal, shortcuts), row_hops[rows.span(y, x)] + abs(gx - x),
+                       column_hops[columns.span(x, y)] + abs(gy - y))
+        return bound
+
+    def _search(self, start, goal, limit=SEARCH_LIMIT):
+        # A* searching at most limit states, in runs with the plain bound first and the spans bound after, if needed
+        if not self.grid or self.table.obstacles is None:
+            return self._astar(start, goal, self._bound, limit)[0]
+        commands, searched = self._astar(start, goal, self._parity_bound, min(limit, QUICK_LIMIT), True)
+        if commands is not None or searched < QUICK_LIMIT or limit <= QUICK_LIMIT:
+            return commands
+        return self._astar(start, goal, self._spans_bound(goal), limit - searched, True)[0]
+
+    def _astar(self, start, goal, bound, limit, runs=False):
+        """
+        A* from start to goal taking at most limit states, preferring deeper states among equal estimates so straight
+        runs are followed first. With runs, MOVEs go in runs and the search ends at the first state taken with a
+        clear plan as cheap as its bound, bound(state, goal, shortcuts) keeping the (plan, certain) it found.
+        Returns (commands or None, number of states taken)
+        """
+        shortcuts = {}
+        estimate = bound(start, goal, shortcuts)
+        if estimate is None:
+            return None, 0
+        parents = {start: None}
+        costs = {start: 0}
+        heap = [(estimate, 0, start)]
+        searched = 0
+        while heap and searched < limit:
+            estimate, negative, state = heapq.heappop(heap)
+            cost = -negative
+            if cost > costs[state]:
+                continue
+            searched += 1
+            if state == goal:
+                rest = []
+            elif runs:
+                rest = (shortcuts.get(state) or self._shortcut(state, goal))[0]
+            else:
+                rest = None
+            if rest is not None:
+                commands = []
+                while parents[state] is not None:
+                    state, action, count = parents[state]
+                    commands.extend([action] * count)
+                return commands[::-1] + rest, searched
+            if runs:
+                successors = self._jumps(state[0], state[1], state[2], goal)
+            else:
+                successors = ((action, 1, successor) for action, successor in self._successors(*state))
+            for action, count, successor in successors:
+                if cost + count < costs.get(successor, cost + count + 1):
+                    estimate = bound(successor, goal, shortcuts)
+                    if estimate is None:
+                        continue
+                    costs[successor] = cost + count
+                    parents[successor] = (state, action, count)
+                    heapq.heappush(heap, (cost + count + estimate, -(cost + count), successor))
+        return None, searched
+
+
+class Spans(object):
+    """
+    Free spans of the rows of a table, or of its columns when transposed: the stretches of free cells between the
+    obstacles of each line. Lines without obstacles next to each other share one span across them all, so there are
+    about as many spans as obstacles whatever the table size. Overlapping spans of neighbouring lines are linked and
+    components[span] names the connected component of free cells a span belongs to.
+    """
+
+    def __init__(self, table, transposed=False):
+        obstacles = table.obstacles
+        blocked = obstacles.columns if transposed else obstacles.rows
+        self.length, count = (table.dy, table.dx) if transposed else (table.dx, table.dy)
+        # a level is a line with obstacles or the lines without obstacles up to the next one, first holds its first
+        # line, base the id of its first span and starts, ends the positions of its spans
+        self.first, self.base, self.starts, self.ends = [], [], [], []
+        self.size = 0
+        line = 0
+        for n in sorted(n for n in blocked if 0 <= n < count):
+            if n > line:
+                self._level(line, ())
+            self._level(n, blocked[n])
+            line = n + 1
+        if line < count:
+            self._level(line, ())
+        self.cache = OrderedDict()
+        self._link()
+
+    def __repr__(self):
+        return "Spans(%s)" % self.size
+
+    def _level(self, line, positions):
+        starts, ends = [], []
+        start = 0
+        for position in positions:
+            if position >= self.length:
+                break
+            if position > start:
+                starts.append(start)
+                ends.append(position - 1)
+            start = max(start, position + 1)
+        if start < self.length:
+            starts.append(start)
+            ends.append(self.length - 1)
+        self.first.append(line)
+        self.base.append(self.size)
+        self.starts.append(starts)
+        self.ends.append(ends)
+        self.size += len(starts)
+
+    def _link(self):
+        self.links = [[] for i in range(self.size)]
+        parent = list(range(self.size))
+        for k in range(len(self.first) - 1):
+            starts, ends, base = self.starts[k], self.ends[k], self.base[k]
+            next_starts, next_ends, next_base = self.starts[k + 1], self.ends[k + 1], self.base[k + 1]
+            i = j = 0
+            while i < len(starts) and j < len(next_starts):
+                if starts[i] <= next_ends[j] and next_starts[j] <= ends[i]:
+                    a, b = base + i, next_base + j
+                    self.links[a].append(b)
+                    self.links[b].append(a)
+                    a, b = _root(parent, a), _root(parent, b)
+                    if a != b:
+                        parent[a] = b
+                if ends[i] < next_ends[j]:
+                    i += 1
+                else:
+                    j += 1
+        self.components = array('i', [_root(parent, i) for i in range(self.size)])
+
+    def span(self, line, position):
+        """
+        Get the id of the span holding the free cell at position on line, None if the cell is blocked
+        """
+        k = bisect_right(self.first, line) - 1
+        i = bisect_right(self.starts[k], position) - 1
+        if i < 0 or self.ends[k][i] < position:
+            return None
+        return self.base[k] + i
+
+    def hops(self, span):
+        """
+        Get the fewest lines crossed from every span to span, UNREACHABLE for the other components, cached for the
+        last FIELD_CACHE_SIZE spans
+        """
+        hops = self.cache.get(span)
+        if hops is not None:
+            self.cache.move_to_end(span)
+            return hops
+        hops = array('i', [UNREACHABLE]) * self.size
+        hops[span] = 0
+        queue = [span]
+        links = self.links
+        for a in queue:
+            d = hops[a] + 1
+            for b in links[a]:
+                if hops[b] == UNREACHABLE:
+                    hops[b] = d
+                    queue.append(b)
+        self.cache[span] = hops
+        if len(self.cache) > FIELD_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return hops
+
+
+def _root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _pinned(lines, line, position, size):
+    # check a segment along line through position cannot slide onto a neighbouring line: one of them has an obstacle
+    # within the free stretch of line around position. lines maps a line to the sorted positions of its obstacles
+    blocked = lines.get(line)
+    low, high = 0, size - 1
+    if blocked:
+        i = bisect_right(blocked, position)
+        if i < len(blocked):
+            high = blocked[i] - 1
+        if i:
+            low = blocked[i - 1] + 1
+    for neighbour in (line - 1, line + 1):
+        blocked = lines.get(neighbour)
+        if blocked:
+            i = bisect_left(blocked, low)
+            if i < len(blocked) and blocked[i] <= high:
+                return True
+    return False
+
+
+def _commands(route, distances):
+    # commands of a (turns, [(heading, axis)], [turn lists]) route moving distances[i] cells on leg i
+    cost, choice, turns = route
+    commands = list(turns[0])
+    for distance, t in zip(distances, turns[1:]):
+        commands.extend(['MOVE'] * distance)
+        commands.extend(t)
+    return commands
+
+
+def _extended_gcd(a, b):
+    # (g, s, t) with g = gcd(a, b) not negative and s * a + t * b == g
+    s0, s1, t0, t1 = 1, 0, 0, 1
+    while b:
+        q = a // b
+        a, b = b, a - q * b
+        s0, s1 = s1, s0 - q * s1
+        t0, t1 = t1, t0 - q * t1
+    return (-a, -s0, -t0) if a < 0 else (a, s0, t0)
+
+
+def _lattice(vectors):
+    # (p, q, r) such that the integer sums of vectors are the integer sums of (p, q) and (0, r), p and r not negative
+    p = q = r = 0
+    for a, b in vectors:
+        g, s, t = _extended_gcd(p, a)
+        if g:
+            r = gcd(r, (a // g) * q - (p // g) * b)
+            p, q = g, s * q + t * b
+        else:
+            r = gcd(r, b)
+        if r:
+            q %= r
+    return p, q, r
+
+
+def _on_lattice(lattice, dx, dy):
+    p, q, r = lattice
+    if p:
+        if dx % p:
+            return False
+        dy -= dx // p * q
+    elif dx:
+        return False
+    return dy % r == 0 if r else dy == 0
+
+
+def _sign(n):
+    return (n > 0) - (n < 0)
+
+
+def _product(legs):
+    # every choice of one (heading, moves) per leg
+    if not legs:
+        yield []
+        return
+    for rest in _product(legs[1:]):
+        for leg in legs[0]:
+            yield [leg] + rest
+
+
+def get_planner(table):
+    """
+    Get the planner of table, cached on the table until its transitions change
+    """
+    planner = table._planner
+    if planner is None or not planner.is_valid():
+        planner = Planner(table)
+        table._planner = planner
+    return planner
@@ -0,0 +1,174 @@
+"""
+Bulk provisioning of tables and robots from CSV files, for fleets of millions of robots. Robot rows are read in
+chunks in a streaming fashion, each chunk is parsed and validated with vectorized NumPy operations, then packed
+straight into a compact.RobotStore, or into Robot objects of a simulator.
+
+Tables CSV has a header with columns name, dx, dy and optionally to_south, to_north, to_west, to_east for the
+STEP_CAL_RULE. Robots CSV has a header with columns name and optionally table, x, y, f; robots with an empty table
+are not placed.
+"""
+import csv
+from operator import itemgetter
+
+import numpy as np
+
+from compact import FIELDS, NONE, RobotStore
+from engine import read_lines
+from models import FrozenCoordinate, Robot, Table
+
+# number of robot rows validated and packed in one go
+CHUNK_ROWS = 1 << 16
+
+RULE_COLUMNS = ['to_south', 'to_north', 'to_west', 'to_east']
+
+
+def _rows(source):
+    # get the column index of a CSV file path, file object or iterable of lines, and an iterator of
+    # (line number, row) over its rows, short rows are padded with empty values
+    reader = csv.reader(read_lines(source), skipinitialspace=True)
+    header = [column.strip().lower() for column in next(reader, [])]
+    columns = dict((column, i) for i, column in enumerate(header))
+
+    def rows():
+        width = len(header)
+        for n, row in enumerate(reader, 2):
+            if row:
+                if len(row) < width:
+                    row += [''] * (width - len(row))
+                yield n, row
+    return columns, rows()
+
+
+def read_tables(source):
+    """
+    Read the tables of a CSV file path, file object or iterable of lines, return the list of Table
+    """
+    tables = []
+    names = set()
+    columns, rows = _rows(source)
+    for n, row in rows:
+        try:
+            name, dx, dy = row[columns['name']], int(row[columns['dx']]), int(row[columns['dy']])
+            rule = None
+            if any(row[columns[column]] for column in RULE_COLUMNS if column in columns):
+                rule = dict((column.upper(), int(row[columns[column]])) for column in RULE_COLUMNS)
+        except (KeyError, ValueError) as e:
+            raise ValueError('Table line %s is not valid: %s' % (n, e))
+        if not name or name in names:
+            raise ValueError('Table line %s: name "%s" is empty or used twice' % (n, name))
+        names.add(name)
+        tables.append(Table(name, dx, dy, rule))
+    return tables
+
+
+def read_robots(source, tables, chunk_rows=CHUNK_ROWS):
+    """
+    Read the robots of a CSV file path, file object or iterable of lines placed on tables, yield one
+    (names, x, y, f, table) tuple per chunk of chunk_rows robots, where x, y, f and table are NumPy arrays, f the
+    index in Robot.facing_directions keys and table the index in tables, both -1 for robots not placed.
+    Raise ValueError for the first row not valid.
+    """
+    table_index = dict((table.name, i) for i, table in enumerate(tables))
+    directions = list(Robot.facing_directions.keys())
+    direction_index = dict((f, i) for i, f in enumerate(directions))
+    width = np.array([table.dx for table in tables] + [0], dtype=np.int64)
+    height = np.array([table.dy for table in tables] + [0], dtype=np.int64)
+    obstructed = np.array([table.obstacles is not None for table in tables] + [False], dtype=bool)
+    seen = set()
+    columns, rows = _rows(source)
+    if 'name' not in columns:
+        raise ValueError('Robots CSV must have a name column')
+    # columns missing from the file read as empty values from an extra column
+    pick = itemgetter(*[columns.get(column, len(columns)) for column in ('name', 'table', 'f', 'x', 'y')])
+
+    lines, chunk = [], []
+    for n, row in rows:
+        lines.append(n)
+        row.append('')
+        chunk.append(pick(row))
+        if len(chunk) >= chunk_rows:
+            yield _validate(lines, chunk, tables, table_index, direction_index, width, height, obstructed, seen)
+            lines, chunk = [], []
+    if chunk:
+        yield _validate(lines, chunk, tables, table_index, direction_index, width, height, obstructed, seen)
+
+
+def _validate(lines, rows, tables, table_index, direction_index, width, height, obstructed, seen):
+    # rows are [name, table, f, x, y]
+    names, table_names, directions, xs, ys = zip(*rows)
+    names = list(names)
+    table = np.array([table_index.get(name, -2) if name else -1 for name in table_names], dtype=np.int32)
+    placed = table >= 0
+    f = np.array([direction_index.get(d, -2) for d in directions], dtype=np.int32)
+    try:
+        x = np.array([value or '0' for value in xs]).astype(np.int64)
+        y = np.array([value or '0' for value in ys]).astype(np.int64)
+    except ValueError as e:
+        raise ValueError('Robot lines %s-%s: coordinates must be int, %s' % (lines[0], lines[-1], e))
+
+    def check(invalid, message):
+        bad = np.flatnonzero(invalid)
+        if len(bad):
+            i = bad[0]
+            raise ValueError('Robot line %s: %s' % (lines[i], message % names[i]))
+
+    check(np.array([not name for name in names], dtype=bool), 'robot "%s" has no name')
+    check(table == -2, 'robot "%s" is on an unknown table')
+    check(placed & (f < 0), 'robot "%s" faces an unknown direction')
+    t = np.where(placed, table, len(tables))
+    check(placed & ((x < 0) | (y < 0) | (x >= width[t]) | (y >= height[t])), 'robot "%s" is outside of its table')
+    # only robots on tables having obstacles are looked up one by one
+    for i in np.flatnonzero(placed & obstructed[t]):
+        if tables[table[i]].is_blocked(int(x[i]), int(y[i])):
+            raise ValueError('Robot line %s: robot "%s" is on an obstacle' % (lines[i], names[i]))
+    unique = set(names)
+    if len(unique) != len(names) or not seen.isdisjoint(unique):
+        chunk = set()
+        for i, name in enumerate(names):
+            if name in seen or name in chunk:
+                raise ValueError('Robot line %s: name "%s" is used twice' % (lines[i], name))
+            chunk.add(name)
+    seen.update(unique)
+    return names, x, y, np.where(placed, f, NONE), np.where(placed, table, NONE)
+
+
+def load_store(tables_source, robots_source, typecode='i', chunk_rows=CHUNK_ROWS):
+    """
+    Build a RobotStore of the tables and robots of CSV files in one pass, each chunk of robots is packed with
+    array copies
+    """
+    store = RobotStore(read_tables(tables_source), typecode)
+    degrees = np.array([Robot.facing_directions[f] for f in store.directions] + [0], dtype=np.int64)
+    dtype = np.dtype(store.data.typecode)
+    for names, x, y, f, table in read_robots(robots_source, store.tables, chunk_rows):
+        block = np.empty((len(names), FIELDS), dtype=dtype)
+        block[:, 0] = block[:, 2] = np.where(f != NONE, x, 0)
+        block[:, 1] = block[:, 3] = np.where(f != NONE, y, 0)
+        block[:, 4] = degrees[f]
+        block[:, 5] = f
+        block[:, 6] = table
+        first = len(store.names)
+        store.names.extend(names)
+        store.name_index.update(zip(names, range(first, first + len(names))))
+        store.data.frombytes(block.tobytes())
+    return store
+
+
+def load(simulator, tables_source, robots_source, chunk_rows=CHUNK_ROWS):
+    """
+    Create the tables and robots of CSV files in simulator, placing robots which have a table, return the
+    number of robots created
+    """
+    tables = read_tables(tables_source)
+    directions = list(Robot.facing_directions.keys())
+    simulator.tables.update((table.name, table) for table in tables)
+    count = 0
+    for names, x, y, f, table in read_robots(robots_source, tables, chunk_rows):
+        robots = [Robot(name) for name in names]
+        simulator.robots.update(zip(names, robots))
+        for i in np.flatnonzero(f != NONE):
+            robot = robots[i]
+            robot.set_coordinate_and_f(FrozenCoordinate(int(x[i]), int(y[i])), directions[f[i]])
+            simulator.robot_on_table[robot] = tables[table[i]]
+        count += len(names)
+    return count
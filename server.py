@@ -0,0 +1,154 @@
+"""
+Asyncio server front-end of the toy robot simulator, serving many concurrent sessions over TCP or a Unix socket
+with the same line protocol as ToyRobotSimulator.start(): a "robot,table" line selects the robot and table, then
+PLACE X,Y,F, MOVE, LEFT, RIGHT and REPORT commands drive the robot until END. A session owns the robot it selected
+until END, another selection or disconnecting, sessions selecting a robot owned by another one wait for it.
+
+Every line gets one reply line: "Output: X,Y,F" for a successful REPORT, "OK" for other successful commands and
+"FAILED" otherwise. Replies of all lines received in one read are written in one batch, and reading pauses while
+the client does not consume its replies.
+
+Usage: python server.py [--host HOST] [--port PORT] [--unix PATH]
+"""
+import argparse
+import asyncio
+
+from engine import CommandEngine, parse_line
+from simulator import ToyRobotSimulator
+from sinks import NullSink
+
+
+# maximum bytes read from a client in one go
+READ_SIZE = 1 << 16
+
+# maximum length of one command line
+LINE_LIMIT = 1 << 12
+
+
+class SimulatorServer(object):
+    """
+    Simulator server applies the commands of all sessions to one deployed simulator. Each session holds the lock
+    of its robot from its selection until END, so the commands of two sessions on one robot never interleave.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.engine = CommandEngine(simulator)
+        self.locks = {}
+        self.sessions = 0
+        self.server = None
+
+    def __repr__(self):
+        return "SimulatorServer(%s)" % self.simulator
+
+    def lock(self, robot):
+        lock = self.locks.get(robot.name)
+        if lock is None:
+            lock = self.locks[robot.name] = asyncio.Lock()
+        return lock
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        robot = table = lock = None
+        rest = b''
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                if len(rest) > LINE_LIMIT:
+                    break
+
+                replies = []
+                for line in lines:
+                    command = parse_line(line.decode('utf-8', 'replace'))
+                    if command is None:
+                        replies.append(b'FAILED\n')
+                        continue
+                    action, args = command
+                    if action == 'SELECT':
+                        selected = self.simulator.robots.get(args[0])
+                        table = self.simulator.tables.get(args[1])
+                        if selected is None or table is None:
+                            selected = table = None
+                        # release the robot held so far, then wait for the new one, sending the replies so far
+                        # first so the client is not left waiting for them meanwhile
+                        if lock is not None and selected is not robot:
+                            lock.release()
+                            lock = None
+                        robot = selected
+                        if robot is not None and lock is None:
+                            waiting = self.lock(robot)
+                            if waiting.locked():
+                                writer.write(b''.join(replies))
+                                replies = []
+                                await writer.drain()
+                            await waiting.acquire()
+                            lock = waiting
+                        replies.append(b'OK\n' if robot is not None else b'FAILED\n')
+                    elif robot is None:
+                        replies.append(b'FAILED\n')
+                    elif action == 'END':
+                        lock.release()
+                        robot = table = lock = None
+                        replies.append(b'OK\n')
+                    else:
+                        result = self.engine.apply(robot, table, action, args)
+                        if action == 'REPORT' and result is not None:
+                            replies.append(("Output: %s\n" % result).encode('utf-8'))
+                        else:
+                            replies.append(b'OK\n' if result else b'FAILED\n')
+
+                writer.write(b''.join(replies))
+                # wait until the client consumes replies when too much is buffered for it
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if lock is not None:
+                lock.release()
+            self.sessions -= 1
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765, path=None, backlog=4096):
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle, path, backlog=backlog)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port, backlog=backlog)
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the toy robot simulator over TCP or a Unix socket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='path of Unix socket to listen on instead of TCP')
+    parser.add_argument('--tables', type=int, default=4, help='number of 100x100 tables to deploy')
+    parser.add_argument('--robots', type=int, default=1000, help='number of robots to deploy')
+    args = parser.parse_args(argv)
+
+    trs = ToyRobotSimulator("trs", NullSink())
+    trs.deploy([{'name': 'table%s' % (i + 1), 'dx': 100, 'dy': 100, 'rule': None} for i in range(args.tables)],
+               ['robot%s' % (i + 1) for i in range(args.robots)])
+    server = SimulatorServer(trs)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start(args.host, args.port, args.unix))
+    print("Serving %s on %s" % (repr(trs), args.unix or "%s:%s" % (args.host, args.port)))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
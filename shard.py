@@ -0,0 +1,136 @@
+"""
+Sharded executor runs command scripts of robots on different tables in parallel worker processes. Tables which
+never share a robot do not interact, so they are partitioned into shards, each shard replays its scripts in its own
+process and the REPORT outputs are merged back in the order the scripts were given.
+"""
+import multiprocessing
+
+import bytecode
+from engine import CommandEngine, parse_commands, read_lines
+from simulator import ToyRobotSimulator
+from sinks import NullSink
+
+
+class Session(object):
+    """
+    Session is a command script for one robot on one table. Commands are an iterable of command lines or the path
+    of a script file, which is then read by the worker process.
+    """
+
+    def __init__(self, robot_name, table_name, commands):
+        self.robot_name = str(robot_name)
+        self.table_name = str(table_name)
+        self.commands = commands
+
+    def __repr__(self):
+        return "Session(%s,%s)" % (self.robot_name, self.table_name)
+
+    # estimated amount of work, used to balance shards
+    def cost(self):
+        return len(self.commands) if hasattr(self.commands, '__len__') and not isinstance(self.commands, str) else 1
+
+
+def partition(sessions, shards):
+    """
+    Partition sessions into at most shards lists of session indexes. Tables sharing a robot are kept in the same
+    shard, and the groups of tables are spread over the shards by their number of commands, largest first.
+    """
+    # union find of tables connected by robots
+    parent = {}
+
+    def find(name):
+        while parent.setdefault(name, name) != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    robot_table = {}
+    for session in sessions:
+        table = find(session.table_name)
+        if session.robot_name in robot_table:
+            parent[find(robot_table[session.robot_name])] = table
+        robot_table[session.robot_name] = table
+
+    groups = {}
+    for i, session in enumerate(sessions):
+        group = groups.setdefault(find(session.table_name), [0, []])
+        group[0] += session.cost()
+        group[1].append(i)
+
+    loads = [[0, []] for i in range(max(min(shards, len(groups)), 1))]
+    for cost, indexes in sorted(groups.values(), key=lambda group: (-group[0], group[1][0])):
+        load = min(loads, key=lambda load: load[0])
+        load[0] += cost
+        load[1].extend(indexes)
+    return [sorted(load[1]) for load in loads if load[1]]
+
+
+def run_shard(table_params, robot_names, sessions):
+    """
+    Replay sessions, a list of (session index, Session), on a simulator deployed with table_params and
+    robot_names, return the list of (session index, reports).
+    """
+    trs = ToyRobotSimulator('shard', NullSink())
+    trs.deploy(table_params, robot_names)
+    engine = CommandEngine(trs)
+    results = []
+    for index, session in sessions:
+        robot = trs.robots.get(session.robot_name)
+        table = trs.tables.get(session.table_name)
+        if table is not None and bytecode.supports(table):
+            program = engine.compile(session.commands)
+            reports = list(engine.run_compiled(program, robot, table))
+        else:
+            reports = list(engine.execute(parse_commands(read_lines(session.commands)), robot, table))
+        results.append((index, reports))
+    return results
+
+
+def _run_shard(args):
+    return run_shard(*args)
+
+
+class ShardedExecutor(object):
+    """
+    Sharded executor deploys the same tables and robots as ToyRobotSimulator.deploy() in every worker process and
+    replays sessions there. Each shard only creates the tables and robots its sessions use.
+    """
+
+    def __init__(self, table_params, robot_names, processes=None):
+        self.table_params = list(table_params)
+        self.robot_names = [str(name) for name in robot_names]
+        self.processes = processes or multiprocessing.cpu_count()
+
+    def __repr__(self):
+        return "ShardedExecutor(%s)" % self.processes
+
+    def run(self, sessions):
+        """
+        Replay sessions, a list of Session or (robot name, table name, commands) tuples, and return the list of
+        REPORT outputs of every session in the order of sessions.
+        """
+        sessions = [s if isinstance(s, Session) else Session(*s) for s in sessions]
+        shards = partition(sessions, self.processes)
+        jobs = []
+        for indexes in shards:
+            tables = set(sessions[i].table_name for i in indexes)
+            robots = set(sessions[i].robot_name for i in indexes)
+            jobs.append(([t for t in self.table_params if t.get('name') in tables],
+                         [name for name in self.robot_names if name in robots],
+                         [(i, sessions[i]) for i in indexes]))
+
+        if len(jobs) <= 1 or self.processes <= 1:
+            shard_results = [_run_shard(job) for job in jobs]
+        else:
+            pool = multiprocessing.Pool(min(self.processes, len(jobs)))
+            try:
+                shard_results = pool.map(_run_shard, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        results = [[] for session in sessions]
+        for shard_result in shard_results:
+            for index, reports in shard_result:
+                results[index] = reports
+        return results
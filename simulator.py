@@ -1,6 +1,7 @@
 import sys
-from random import randint
-from models import Coordinate, Robot, Table
+from array import array
+from models import FrozenCoordinate, Robot, Table
+import sinks
 
 
 class ToyRobotSimulator(object):
@@ -8,13 +9,20 @@ class ToyRobotSimulator(object):
     """
     This toy robot simulator will create robots and place to table and perform some actions like move, turn left and turn right.
     """
-    tables = {} # store tables in dictionary e.g. {'table1': table1}
-    robots = {} # store robots in dictionary e.g. {'robot1': robot1}
-    robot_on_table = {}   # store robots in tables e.g. {robot1: table1, robot2: table2}
     actions = ['PLACE', 'MOVE', 'LEFT', 'RIGHT', 'REPORT', 'END']
 
-    def __init__(self, name):
+    def __init__(self, name, sink=None):
         self.name = name
+        # registries of this simulator, not shared with other simulators
+        self.tables = {} # store tables in dictionary e.g. {'table1': table1}
+        self.robots = {} # store robots in dictionary e.g. {'robot1': robot1}
+        self.robot_on_table = {}   # store robots in tables e.g. {robot1: table1, robot2: table2}
+        # sink receiving REPORT outputs and failure messages, printing them by default
+        self.sink = sink if sink is not None else sinks.PrintSink()
+        # journal.Journal recording the actions which change robots, None for not recording
+        self.journal = None
+        # trajectory.Recorder recording where robots go, None for not recording
+        self.trajectories = None
 
     def __str__(self):
         return "%s" % self.name
@@ -25,19 +33,20 @@ class ToyRobotSimulator(object):
     # deploying the simulator and create robots and tables
     def deploy(self, table_params=[{}], robot_names=[]):
         if table_params and robot_names:
+            attributes = Table.attributes
             for t in table_params:
-                if set(Table.attributes) <= set(t):
-                    self.tables[t['name']] = Table(t['name'],t['dx'],t['dy'],t['rule'])
+                if all(attribute in t for attribute in attributes):
+                    self.tables[t['name']] = Table(t['name'],t['dx'],t['dy'],t['rule'],t.get('obstacles'))
                 else:
-                    print('Table parameters "%s" not valid!' % t)
+                    self.sink.emit(sinks.INVALID_TABLE, None, 'Table parameters "%s" not valid!', t)
 
-            for name in robot_names:
-                self.robots[str(name)] = Robot(str(name))
+            names = [str(name) for name in robot_names]
+            self.robots.update(zip(names, map(Robot, names)))
 
             return True
 
         else:
-            print("No valid data for creating tables and robots!")
+            self.sink.emit(sinks.NO_DATA, None, "No valid data for creating tables and robots!")
             return False
 
     # placing robots to tables
@@ -49,60 +58,190 @@ class ToyRobotSimulator(object):
             raise TypeError("The table must be Table instance")
 
         if f not in Robot.facing_directions.keys():
-            print("Cannot set robot facing to %s, please choose one from %s" % (f, Robot.facing_directions))
+            self.sink.emit(sinks.INVALID_FACING, robot, "Cannot set robot facing to %s, please choose one from %s",
+                           f, Robot.facing_directions)
             return False
 
         if self.robots and self.tables:
             coord = table.get_coordinate(x,y)
+            if coord is not None and not self.occupy(robot, table, coord):
+                self.sink.emit(sinks.OCCUPIED, robot, "Cannot place %s on %s at Coordinate(%s,%s), occupied by %s",
+                               robot.name, table.name, x, y, table.who_is_at(x, y))
+                return False
             if coord is not None:
                 robot.set_coordinate_and_f(coord,f)
                 self.robot_on_table[robot] = table
+                if self.journal is not None:
+                    self.journal.append(robot, table, 'PLACE', x, y, f)
+                if self.trajectories is not None:
+                    self.trajectories.place(robot, table)
                 return True
             else:
-                print("Cannot place %s on %s at Coordinate(%s,%s)" % (robot.name, table.name, x,y))
+                self.sink.emit(sinks.PLACE_FAILED, robot, "Cannot place %s on %s at Coordinate(%s,%s)",
+                               robot.name, table.name, x, y)
                 return False
         else:
-            print("No tables or robots created yet! Please use method deploy() to create some")
+            self.sink.emit(sinks.NOT_DEPLOYED, robot,
+                           "No tables or robots created yet! Please use method deploy() to create some")
+            return False
+
+    # claim coordinate on table for robot when table tracks occupancy and release its previous cell, then count the
+    # visit, return False if another robot is there
+    def occupy(self, robot, table, coordinate):
+        if table.occupancy is not None and not table.occupancy.add(robot, coordinate.x, coordinate.y):
             return False
+        last_table = self.robot_on_table.get(robot)
+        if last_table is not None and last_table.occupancy is not None and robot.is_placed() \
+                and (last_table is not table or robot.coordinate != coordinate):
+            last_table.occupancy.remove(robot, robot.coordinate.x, robot.coordinate.y)
+        if table.visits is not None:
+            table.visit(coordinate.x, coordinate.y)
+        return True
+
+    # move robot one step forward on its table without any output, return False when the move is blocked
+    def move(self, robot):
+        table = self.robot_on_table[robot]
+        new_coordinate = table.next_coordinate(robot.coordinate.x, robot.coordinate.y, robot.f)
+        if new_coordinate is not None:
+            if table.occupancy is not None and not table.occupancy.move(robot, robot.coordinate.x, robot.coordinate.y,
+                                                                        new_coordinate.x, new_coordinate.y):
+                return False
+            robot.move_to(new_coordinate)
+            if table.visits is not None:
+                table.visit(new_coordinate.x, new_coordinate.y)
+            return True
+        return False
+
+    # move robot up to count steps forward, or until blocked when count is None, without any output, return the
+    # number of steps moved. Without occupancy the whole run is resolved with one free run lookup
+    def move_many(self, robot, count=None):
+        table = self.robot_on_table[robot]
+        if table.occupancy is not None or table.visits is not None:
+            moved = 0
+            while (count is None or moved < count) and self.move(robot):
+                moved += 1
+            return moved
+        x, y = robot.coordinate.x, robot.coordinate.y
+        moved = table.free_run(x, y, robot.f, count)
+        if moved:
+            sx, sy = table.step(robot.f)
+            robot.last_position = FrozenCoordinate(x + (moved - 1) * sx, y + (moved - 1) * sy)
+            robot.coordinate = FrozenCoordinate(x + moved * sx, y + moved * sy)
+        return moved
 
     # take actions to robot
     def perform(self, robot, action):
         if action and isinstance(action, str) and robot and isinstance(robot, Robot):
             if not robot.is_placed():
-                print("Please place the robot on table before perform other actions")
+                self.sink.emit(sinks.NOT_PLACED, robot, "Please place the robot on table before perform other actions")
                 return False
             if action in self.actions:
                 if action == 'MOVE':
-                    table = self.robot_on_table[robot]
-                    # get move steps including direction
-                    move_step = table.STEP_CAL_RULE["TO_%s" % robot.f]
-                    new_coordinate = None
-                    if robot.f in table.x_axis:
-                        new_coordinate = table.get_coordinate(robot.coordinate.x + move_step,
-                                                           robot.coordinate.y)
-                    elif robot.f in table.y_axis:
-                        new_coordinate = table.get_coordinate(robot.coordinate.x,
-                                                           robot.coordinate.y + move_step)
-
-                    if new_coordinate is not None:
-                        robot.move_to(new_coordinate)
+                    if self.move(robot):
+                        if self.journal is not None:
+                            self.journal.record(robot, action)
+                        if self.trajectories is not None:
+                            self.trajectories.record(robot, action)
                         return True
                     else:
-                        print("Cannot move further!")
+                        self.sink.emit(sinks.BLOCKED, robot, "Cannot move further!")
                         return False
 
-                elif action == 'LEFT':
-                    return robot.turn_left()
-                elif action == 'RIGHT':
-                    return robot.turn_right()
+                elif action == 'LEFT' or action == 'RIGHT':
+                    turned = robot.turn_left() if action == 'LEFT' else robot.turn_right()
+                    if turned and self.journal is not None:
+                        self.journal.record(robot, action)
+                    if turned and self.trajectories is not None:
+                        self.trajectories.record(robot, action)
+                    return turned
                 elif action == 'REPORT':
-                    print("Output: %s" % (robot.get_report()))
+                    self.sink.emit(sinks.REPORT, robot, "Output: %s", robot.get_report())
                     return True
 
 
-        print("Failed to perform action: %s, please choose action from %s" % (action, self.actions))
+        self.sink.emit(sinks.INVALID_ACTION, robot, "Failed to perform action: %s, please choose action from %s",
+                       action, self.actions)
         return False
 
+    def perform_many(self, batch):
+        """
+        Perform a batch of actions, either two columns (robots, actions) where robots are Robot instances or names,
+        or a mapping {robot: [action, ...]}. Return array('b') of 1 for each action performed and 0 for each one
+        failed, in batch order, mapping actions in mapping order. Results and sink events are the same as calling
+        perform() for every action in order, but robots and actions are validated once, and the work is grouped by
+        table so table lookups are done once per table.
+        """
+        if isinstance(batch, dict):
+            robots, actions = [], []
+            for robot, commands in batch.items():
+                robots.extend([robot] * len(commands))
+                actions.extend(commands)
+        else:
+            robots, actions = batch
+            if len(robots) != len(actions):
+                raise ValueError('Robot and action columns must have the same length')
+        results = array('b', bytes(len(actions)))
+        events = []
+
+        # resolve each distinct key once, then group the indexes of each robot actions by table, a robot given both
+        # by name and by instance having one group
+        resolved = {}
+        indexes = {}
+        for i, key in enumerate(robots):
+            robot = resolved.get(key, resolved)
+            if robot is resolved:
+                robot = resolved[key] = self.robots.get(key) if isinstance(key, str) else key
+            indexes.setdefault(robot if isinstance(robot, Robot) else key, []).append(i)
+        by_table = {}
+        for robot, positions in indexes.items():
+            if not isinstance(robot, Robot):
+                for i in positions:
+                    events.append((i, sinks.INVALID_ACTION, None, "Failed to perform action: %s, please choose "
+                                   "action from %s", (actions[i], self.actions)))
+            elif not robot.is_placed():
+                for i in positions:
+                    events.append((i, sinks.NOT_PLACED, robot,
+                                   "Please place the robot on table before perform other actions", ()))
+            else:
+                by_table.setdefault(self.robot_on_table[robot], []).append((robot, positions))
+
+        journal, trajectories = self.journal, self.trajectories
+        for table, members in by_table.items():
+            if table.occupancy is not None:
+                # robots on tables tracking occupancy block each other, so keep the batch order between them
+                work = sorted((i, robot) for robot, positions in members for i in positions)
+            else:
+                work = [(i, robot) for robot, positions in members for i in positions]
+            for i, robot in work:
+                action = actions[i]
+                if action == 'MOVE':
+                    done = self.move(robot)
+                    if not done:
+                        events.append((i, sinks.BLOCKED, robot, "Cannot move further!", ()))
+                elif action == 'LEFT':
+                    done = robot.turn_left()
+                elif action == 'RIGHT':
+                    done = robot.turn_right()
+                elif action == 'REPORT':
+                    events.append((i, sinks.REPORT, robot, "Output: %s", (robot.get_report(),)))
+                    results[i] = 1
+                    continue
+                else:
+                    events.append((i, sinks.INVALID_ACTION, robot, "Failed to perform action: %s, please choose "
+                                   "action from %s", (action, self.actions)))
+                    continue
+                if done:
+                    results[i] = 1
+                    if journal is not None:
+                        journal.record(robot, action)
+                    if trajectories is not None:
+                        trajectories.record(robot, action)
+
+        events.sort(key=lambda event: event[0])
+        for i, kind, robot, fmt, args in events:
+            self.sink.emit(kind, robot, fmt, *args)
+        return results
+
     # start simulation
     def start(self):
         """
@@ -144,14 +283,6 @@ class ToyRobotSimulator(object):
                         action_values = action_str.split()
                         if action_values and len(action_values) > 0:
                             if action_values[0] == 'PLACE':
-                                # use random x,y,f for demonstration example
-                                '''
-                                self.place(robot,
-                                           table,
-                                           randint(0,table.dx-1),
-                                           randint(0,table.dy-1),
-                                           ["SOUTH", "WEST", "NORTH", "EAST"][randint(0,3)])
-                                '''
                                 if len(action_values) > 1:
                                     values = action_values[1].split(',')
                                     if len(values) >= 3:
@@ -172,23 +303,22 @@ class ToyRobotSimulator(object):
                                 self.perform(robot,action_values[0])
 
 
-if __name__ == "__main__":
-
-    # create tables using parameters
-    table_params = [{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
-                        {'name': 'table2', 'dx': 10, 'dy': 10, 'rule': None},
-                        {'name': 'table3', 'dx': 50, 'dy': 50,
-                         'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}},
-                        {'name': 'table4', 'dx': 100, 'dy': 100,
-                         'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': -1, 'TO_EAST': 1}},
-                        ]
-
-    # create robots using parameters
-    robot_params = ['robot1', 'robot2', 'robot3', 'robot4', ]
+# tables and robots of the demonstration run from the terminal
+DEMO_TABLES = [{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+               {'name': 'table2', 'dx': 10, 'dy': 10, 'rule': None},
+               {'name': 'table3', 'dx': 50, 'dy': 50,
+                'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}},
+               {'name': 'table4', 'dx': 100, 'dy': 100,
+                'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': -1, 'TO_EAST': 1}},
+               ]
+DEMO_ROBOTS = ['robot1', 'robot2', 'robot3', 'robot4', ]
 
 
+def main():
     trs = ToyRobotSimulator("trs")
-    trs.deploy(table_params,robot_params)
+    trs.deploy(DEMO_TABLES, DEMO_ROBOTS)
     trs.start()
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Result sinks receive the REPORT outputs and failure messages of ToyRobotSimulator instead of print(), so high
+volume runs can discard them, collect them as events or write REPORT lines in bulk.
+"""
+import sys
+
+
+# event kinds emitted by the simulator
+REPORT = 'REPORT'
+BLOCKED = 'BLOCKED'                 # MOVE would make the robot fall from the table
+NOT_PLACED = 'NOT_PLACED'           # action performed before the robot is placed
+INVALID_ACTION = 'INVALID_ACTION'
+INVALID_FACING = 'INVALID_FACING'
+PLACE_FAILED = 'PLACE_FAILED'       # coordinate outside of the table
+OCCUPIED = 'OCCUPIED'               # coordinate taken by another robot
+NOT_DEPLOYED = 'NOT_DEPLOYED'
+INVALID_TABLE = 'INVALID_TABLE'
+NO_DATA = 'NO_DATA'
+
+
+class Event(object):
+    """
+    Event emitted by the simulator, message is formatted lazily from fmt and args
+    """
+
+    __slots__ = ('kind', 'robot', 'fmt', 'args')
+
+    def __init__(self, kind, robot, fmt, args):
+        self.kind = kind
+        self.robot = robot
+        self.fmt = fmt
+        self.args = args
+
+    def __repr__(self):
+        return "Event(%s,%s)" % (self.kind, self.robot)
+
+    @property
+    def message(self):
+        return self.fmt % self.args if self.args else self.fmt
+
+
+class PrintSink(object):
+    """
+    Print sink prints every event to standard output, as the simulator always did
+    """
+
+    def emit(self, kind, robot, fmt, *args):
+        print(fmt % args if args else fmt)
+
+    def flush(self):
+        pass
+
+
+class NullSink(object):
+    """
+    Null sink discards every event
+    """
+
+    def emit(self, kind, robot, fmt, *args):
+        pass
+
+    def flush(self):
+        pass
+
+
+class EventSink(object):
+    """
+    Event sink collects events of the kinds given, all kinds by default, in the events list
+    """
+
+    def __init__(self, kinds=None):
+        self.kinds = set(kinds) if kinds is not None else None
+        self.events = []
+
+    def emit(self, kind, robot, fmt, *args):
+        if self.kinds is None or kind in self.kinds:
+            self.events.append(Event(kind, robot, fmt, args))
+
+    def flush(self):
+        pass
+
+    # remove and return the collected events
+    def drain(self):
+        events, self.events = self.events, []
+        return events
+
+
+class BufferedReportWriter(object):
+    """
+    Buffered report writer keeps REPORT lines in memory and writes them to stream in bulk every buffer_size lines
+    and on flush(). Other events are discarded unless errors is True.
+    """
+
+    def __init__(self, stream=None, buffer_size=4096, errors=False):
+        self.stream = stream if stream is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.errors = errors
+        self.lines = []
+
+    def emit(self, kind, robot, fmt, *args):
+        if kind == REPORT or self.errors:
+            self.lines.append(fmt % args if args else fmt)
+            if len(self.lines) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.lines.append('')
+            self.stream.write('\n'.join(self.lines))
+            self.lines = []
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
@@ -0,0 +1,267 @@
+"""
+Snapshot saves the whole simulator world, tables with their STEP_CAL_RULE, obstacles, occupancy mode and visit
+counts, and robots with their positions, facing directions, degrees and last positions, to a compact binary file,
+and loads it back through mmap.
+
+The file holds a header, a JSON block describing tables and facing directions, the robot names and one column per
+robot field, so a snapshot of a million robots restores into a Fleet or RobotStore with a few bulk copies.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from models import FrozenCoordinate, Robot, Table
+
+MAGIC = b'TRSS'
+VERSION = 2
+
+# versions still loaded, with the typecodes of the columns they wrote differently. Version 1 kept degrees as ints,
+# which cannot hold the 22.5 degrees of a 16 point compass
+OLD_TYPECODES = {1: {'degree': 'i'}}
+
+# magic, version, robot count, metadata length, names length
+HEADER = struct.Struct('<4sHQQQ')
+
+# robot columns in file order: name, array typecode and fill value of robots not placed
+COLUMNS = [('x', 'q', 0), ('y', 'q', 0), ('last_x', 'q', 0), ('last_y', 'q', 0),
+           ('degree', 'd', 0), ('f', 'b', -1), ('table', 'i', -1)]
+
+NAME_SEPARATOR = b'\0'
+
+
+def _padding(offset):
+    return (8 - offset % 8) % 8
+
+
+# integral degrees are restored as int, like the ones of Robot.facing_directions
+def _degree(degree):
+    return int(degree) if degree == int(degree) else degree
+
+
+# get the visit counts of table as {'tile_size': n, 'cells': [[x, y, count], ...]}, None when they are not tracked
+def _visits(table):
+    if table.visits is None:
+        return None
+    return {'tile_size': table.visits.tile_size, 'cells': sorted([x, y, n] for x, y, n in table.visits.items())}
+
+
+def _write(path, tables, directions, names, columns, sequence=0):
+    meta = json.dumps({
+        'tables': [{'name': t.name, 'dx': t.dx, 'dy': t.dy, 'rule': t.STEP_CAL_RULE,
+                    'obstacles': sorted(t.obstacles) if t.obstacles else None,
+                    'occupancy': t.occupancy.mode if t.occupancy is not None else None,
+                    'visits': _visits(t)} for t in tables],
+        'directions': directions,
+        'facing_directions': dict((f, Robot.facing_directions[f]) for f in directions),
+        'sequence': sequence,
+    }).encode('utf-8')
+    name_blob = NAME_SEPARATOR.join(name.encode('utf-8') for name in names)
+    with open(path, 'wb') as stream:
+        stream.write(HEADER.pack(MAGIC, VERSION, len(names), len(meta), len(name_blob)))
+        stream.write(meta)
+        stream.write(name_blob)
+        offset = HEADER.size + len(meta) + len(name_blob)
+        for (name, typecode, fill), column in zip(COLUMNS, columns):
+            stream.write(b'\0' * _padding(offset))
+            offset += _padding(offset)
+            # numpy columns of save_fleet() are little endian already
+            if sys.byteorder != 'little' and isinstance(column, array):
+                column = array(typecode, column)
+                column.byteswap()
+            data = column.tobytes()
+            stream.write(data)
+            offset += len(data)
+
+
+def save(simulator, path, sequence=0):
+    """
+    Save tables and robots of simulator to path, sequence is the journal sequence number the snapshot is taken at
+    """
+    tables = list(simulator.tables.values())
+    for table in simulator.robot_on_table.values():
+        if table not in tables:
+            tables.append(table)
+    table_index = dict((id(t), i) for i, t in enumerate(tables))
+    directions = list(Robot.facing_directions.keys())
+    direction_index = dict((f, i) for i, f in enumerate(directions))
+
+    robots = list(simulator.robots.values())
+    columns = [array(typecode) for name, typecode, fill in COLUMNS]
+    x, y, last_x, last_y, degree, f, table = columns
+    for robot in robots:
+        on_table = simulator.robot_on_table.get(robot)
+        if robot.is_placed() and on_table is not None:
+            x.append(robot.coordinate.x)
+            y.append(robot.coordinate.y)
+            last_x.append(robot.last_position.x)
+            last_y.append(robot.last_position.y)
+            degree.append(robot.degree)
+            f.append(direction_index[robot.f])
+            table.append(table_index[id(on_table)])
+        else:
+            for column, (name, typecode, fill) in zip(columns, COLUMNS):
+                column.append(fill)
+    _write(path, tables, directions, [robot.name for robot in robots], columns, sequence)
+
+
+def save_fleet(fleet, path, sequence=0):
+    """
+    Save tables and robots of a fleet.Fleet to path
+    """
+    import numpy as np
+    placed = fleet.is_placed()
+    columns = [np.ascontiguousarray(column.astype(np.dtype(typecode).newbyteorder('<'))) for column, typecode in [
+        (fleet.x, 'q'), (fleet.y, 'q'), (fleet.lx, 'q'), (fleet.ly, 'q'),
+        (np.where(placed, fleet.degree, 0), 'd'), (np.where(placed, fleet.f, -1), 'b'),
+        (np.where(placed, fleet.table, -1), 'i')]]
+    _write(path, fleet.tables, fleet.directions, fleet.names, columns, sequence)
+
+
+class Snapshot(object):
+    """
+    Snapshot loaded from a file: the table parameters, facing directions, robot names, robot columns as arrays and
+    the journal sequence number it was taken at
+    """
+
+    def __init__(self, tables, directions, facing_directions, names, columns, sequence=0):
+        self.sequence = sequence
+        self.tables = tables
+        self.directions = directions
+        self.facing_directions = facing_directions
+        self.names = names
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "Snapshot(%s,%s)" % (len(self.tables), len(self.names))
+
+    # create the tables of snapshot, with their occupancy tracking enabled and empty and their visit counts
+    def create_tables(self):
+        from tiles import TileMap
+        tables = []
+        for t in self.tables:
+            table = Table(t['name'], t['dx'], t['dy'], t['rule'], t.get('obstacles'))
+            if t.get('occupancy'):
+                table.enable_occupancy(t['occupancy'])
+            visits = t.get('visits')
+            if visits is not None:
+                table.visits = TileMap(visits['tile_size'], 0)
+                for x, y, count in visits['cells']:
+                    table.visits.set(x, y, count)
+            tables.append(table)
+        return tables
+
+    # check the degrees of the snapshot facing directions are the ones of Robot.facing_directions, as the robot
+    # degrees and facing directions are restored as they were saved
+    def check_directions(self):
+        for f, degree in self.facing_directions.items():
+            if Robot.facing_directions.get(f) != degree:
+                raise ValueError('Snapshot facing direction %s at %s degrees does not match %s degrees of '
+                                 'Robot.facing_directions' % (f, degree, Robot.facing_directions.get(f)))
+
+    def restore(self, simulator):
+        """
+        Create the tables and robots of snapshot object by object in simulator, return simulator. Robots are put in
+        the occupancy of their tables. Raise ValueError when the facing directions of the snapshot are not the ones
+        of Robot.facing_directions.
+        """
+        self.check_directions()
+        tables = self.create_tables()
+        for table in tables:
+            simulator.tables[table.name] = table
+        x, y, last_x, last_y, degree, f, table = [self.columns[name] for name, typecode, fill in COLUMNS]
+        for i, name in enumerate(self.names):
+            robot = Robot(name)
+            if f[i] >= 0:
+                robot.coordinate = FrozenCoordinate(x[i], y[i])
+                robot.last_position = FrozenCoordinate(last_x[i], last_y[i])
+                robot.f = self.directions[f[i]]
+                robot.degree = _degree(degree[i])
+                on_table = simulator.robot_on_table[robot] = tables[table[i]]
+                if on_table.occupancy is not None:
+                    on_table.occupancy.add(robot, x[i], y[i])
+            simulator.robots[name] = robot
+        return simulator
+
+    def to_fleet(self):
+        """
+        Create a fleet.Fleet holding the tables and robots of snapshot with bulk array copies
+        """
+        import numpy as np
+        from fleet import Fleet
+        self.check_directions()
+        fleet = Fleet(self.create_tables())
+        fleet.add_robots(self.names)
+        for name, attr in [('x', 'x'), ('y', 'y'), ('last_x', 'lx'), ('last_y', 'ly'), ('degree', 'degree'),
+                           ('table', 'table')]:
+            getattr(fleet, attr)[:] = np.frombuffer(self.columns[name], dtype=self.columns[name].typecode)
+        f = np.frombuffer(self.columns['f'], dtype=np.int8).astype(np.int32)
+        # map facing direction indexes of snapshot to the ones of fleet
+        mapping = np.array([fleet.direction_index.get(d, -1) for d in self.directions] + [-1], dtype=np.int32)
+        fleet.f[:] = mapping[f]
+        fleet.located[:] = f >= 0
+        return fleet
+
+    def to_store(self):
+        """
+        Create a compact.RobotStore holding the tables and robots of snapshot with bulk array copies
+        """
+        from compact import FIELDS, RobotStore
+        self.check_directions()
+        degrees = self.columns['degree']
+        for degree in degrees:
+            if degree != int(degree):
+                raise ValueError('Robot stores need integer degrees, not %s' % degree)
+        store = RobotStore(self.create_tables(), 'q')
+        store.names = list(self.names)
+        store.name_index = dict((name, i) for i, name in enumerate(self.names))
+        mapping = [store.direction_index.get(d, -1) for d in self.directions]
+        f = array('q', [mapping[i] if i >= 0 else -1 for i in self.columns['f']])
+        store.data = array('q', bytes(8 * FIELDS * len(self.names)))
+        for offset, column in enumerate([self.columns['x'], self.columns['y'], self.columns['last_x'],
+                                         self.columns['last_y'], array('q', [int(degree) for degree in degrees]), f,
+                                         array('q', self.columns['table'])]):
+            store.data[offset::FIELDS] = array('q', column)
+        return store
+
+
+def load(path):
+    """
+    Load the snapshot saved at path through mmap
+    """
+    with open(path, 'rb') as stream:
+        data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(data)
+        try:
+            magic, version, count, meta_length, names_length = HEADER.unpack_from(view, 0)
+            if magic != MAGIC:
+                raise ValueError('%s is not a simulator snapshot' % path)
+            if version != VERSION and version not in OLD_TYPECODES:
+                raise ValueError('Snapshot version %s is not supported' % version)
+            typecodes = OLD_TYPECODES.get(version, {})
+            offset = HEADER.size
+            meta = json.loads(bytes(view[offset:offset + meta_length]).decode('utf-8'))
+            offset += meta_length
+            name_blob = bytes(view[offset:offset + names_length]).decode('utf-8')
+            names = name_blob.split(NAME_SEPARATOR.decode('utf-8')) if count else []
+            offset += names_length
+
+            columns = {}
+            for name, typecode, fill in COLUMNS:
+                offset += _padding(offset)
+                column = array(typecodes.get(name, typecode))
+                size = column.itemsize * count
+                column.frombytes(view[offset:offset + size])
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                columns[name] = column
+                offset += size
+        finally:
+            view.release()
+            data.close()
+    return Snapshot(meta['tables'], meta['directions'], meta['facing_directions'], names, columns,
+                    meta.get('sequence', 0))
@@ -0,0 +1,368 @@
+"""
+Opt-in instrumentation of the simulator hot paths: per action counters, command latency histograms, blocked moves
+per table and move cache hit rates, exposed as a dictionary and in Prometheus text format, which can be dumped to a
+file periodically.
+
+Instrumentation wraps the perform(), place(), move_many() and perform_many() methods of one simulator instance, and
+apply() and run_compiled() of command engines, so a simulator without it runs the plain class methods and pays
+nothing. Actions of batches and compiled programs are counted one by one, the latency of a batch is measured as a
+whole under BATCH and compiled programs are not timed. In sampling mode commands are only counted, and a background
+thread samples which command is running to attribute time to each command type.
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from models import Robot
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+BUCKETS = [0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+           0.005, 0.01]
+
+# seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.001
+
+# latency and profiler key of perform_many() batches
+BATCH = 'BATCH'
+
+
+# escape a Prometheus label value, backslashes, double quotes and newlines would end it early
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram(object):
+    """
+    Latency histogram with cumulative Prometheus style buckets
+    """
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    # get a copy of the histogram, to read it while commands keep observing the original
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    # get [(upper bound, cumulative count)], '+Inf' for the last bucket
+    def buckets(self):
+        total = 0
+        result = []
+        for bound, count in zip(BUCKETS + ['+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class _Local(threading.local):
+    # set while an instrumented method runs, so the instrumented methods it calls are not counted twice
+    busy = False
+
+
+class Instrumentation(object):
+    """
+    Instrumentation of simulator, collecting statistics between enable() and disable(). With sampling True,
+    latencies are not measured, a profiler thread counts instead which command type is running every
+    sample_interval seconds.
+    """
+
+    def __init__(self, simulator, sampling=False, sample_interval=SAMPLE_INTERVAL):
+        self.simulator = simulator
+        self.sampling = sampling
+        self.sample_interval = sample_interval
+        self.engines = []
+        self.enabled = False
+        self.reset()
+        self._current = None
+        self._local = _Local()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return "Instrumentation(%s,%s)" % (self.simulator, 'on' if self.enabled else 'off')
+
+    # clear the statistics, in place as the instrumented methods hold them
+    def reset(self):
+        if not hasattr(self, 'calls'):
+            self.calls = {}         # action -> number of calls
+            self.failures = {}      # action -> number of failed calls
+            self.latency = {}       # action -> Histogram
+            self.blocked = {}       # table name -> number of blocked moves
+            self.samples = {}       # action -> number of profiler samples taken while it ran
+        for values in (self.calls, self.failures, self.latency, self.blocked, self.samples):
+            values.clear()
+        self.idle_samples = 0
+
+    def enable(self, *engines):
+        """
+        Start instrumenting the simulator, and the command engines given, which drive it without perform()
+        """
+        if self.enabled:
+            return self
+        self.enabled = True
+        simulator = self.simulator
+        simulator.perform = self._wrap(type(simulator).perform.__get__(simulator), self._perform_action)
+        simulator.place = self._wrap(type(simulator).place.__get__(simulator), self._place_action)
+        simulator.move_many = self._wrap(type(simulator).move_many.__get__(simulator), self._move_many_action)
+        simulator.perform_many = self._wrap_batch(type(simulator).perform_many.__get__(simulator))
+        for engine in engines:
+            engine.apply = self._wrap(type(engine).apply.__get__(engine), self._apply_action)
+            engine.run_compiled = self._wrap_compiled(type(engine).run_compiled.__get__(engine))
+            self.engines.append(engine)
+        if self.sampling:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, name='stats-sampler')
+            self._sampler.daemon = True
+            self._sampler.start()
+        return self
+
+    def disable(self):
+        """
+        Stop instrumenting, restoring the plain methods, statistics are kept until reset()
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        for target in [self.simulator] + self.engines:
+            for name in ('perform', 'place', 'move_many', 'perform_many', 'apply', 'run_compiled'):
+                target.__dict__.pop(name, None)
+        self.engines = []
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+
+    # argument parsers returning (action, robot, table) of a call
+    def _perform_action(self, robot, action):
+        return action if isinstance(action, str) else None, robot, None
+
+    def _place_action(self, robot, table, x, y, f):
+        return 'PLACE', robot, table
+
+    def _apply_action(self, robot, table, action, args):
+        return action, robot, table
+
+    def _move_many_action(self, robot, count=None):
+        return 'MOVE', robot, None
+
+    # count one action, table is the table a failed MOVE was blocked on, None for other failures
+    def _count(self, action, done, table=None):
+        self.calls[action] = self.calls.get(action, 0) + 1
+        if not done:
+            self.failures[action] = self.failures.get(action, 0) + 1
+            if action == 'MOVE' and table is not None:
+                self.blocked[table.name] = self.blocked.get(table.name, 0) + 1
+
+    # get the table robot is placed on, None for robots not placed
+    def _table_of(self, robot, table=None):
+        if isinstance(robot, Robot) and robot.is_placed():
+            return table or self.simulator.robot_on_table.get(robot)
+        return None
+
+    # call method, measuring its latency under action or marking it as running for the profiler
+    def _run(self, action, method, args):
+        local = self._local
+        local.busy = True
+        try:
+            if self.sampling:
+                self._current = action
+                try:
+                    return method(*args)
+                finally:
+                    self._current = None
+            start = time.perf_counter()
+            result = method(*args)
+            seconds = time.perf_counter() - start
+            histogram = self.latency.get(action)
+            if histogram is None:
+                histogram = self.latency[action] = Histogram()
+            histogram.observe(seconds)
+            return result
+        finally:
+            local.busy = False
+
+    def _wrap(self, method, parse):
+        local = self._local
+
+        def instrumented(*args):
+            if local.busy:
+                return method(*args)
+            action, robot, table = parse(*args)
+            result = self._run(action, method, args)
+            self._count(action, result, self._table_of(robot, table) if not result and action == 'MOVE' else None)
+            return result
+        return instrumented
+
+    def _wrap_batch(self, method):
+        local = self._local
+        simulator = self.simulator
+
+        def instrumented(batch):
+            if local.busy:
+                return method(batch)
+            results = self._run(BATCH, method, (batch,))
+            if isinstance(batch, dict):
+                pairs = [(robot, action) for robot, commands in batch.items() for action in commands]
+            else:
+                pairs = zip(*batch)
+            for (robot, action), done in zip(pairs, results):
+                if action == 'MOVE' and not done:
+                    table = self._table_of(simulator.robots.get(robot) if isinstance(robot, str) else robot)
+                else:
+                    table = None
+                self._count(action if isinstance(action, str) else None, done, table)
+            return results
+        return instrumented
+
+    def _wrap_compiled(self, method):
+        robot_on_table = self.simulator.robot_on_table
+
+        # robot is None while not placed, robots placed by the program may not be written back yet, so their
+        # table is looked up in the simulator
+        def counted(action, robot, done):
+            self._count(action, done, robot_on_table.get(robot) if robot is not None and not done else None)
+
+        def instrumented(program, robot=None, table=None, observe=None):
+            if observe is None:
+                return method(program, robot, table, counted)
+
+            def both(action, robot, done):
+                counted(action, robot, done)
+                observe(action, robot, done)
+            return method(program, robot, table, both)
+        return instrumented
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            action = self._current
+            if action is None:
+                self.idle_samples += 1
+            else:
+                self.samples[action] = self.samples.get(action, 0) + 1
+
+    def cache_stats(self):
+        """
+        Get {table name: (hits, misses, hit rate)} of the move caches of simulator tables
+        """
+        result = {}
+        for name, table in sorted(dict(self.simulator.tables).items()):
+            cache = table.move_cache
+            if cache is not None:
+                result[name] = (cache.hits, cache.misses, cache.hit_rate())
+        return result
+
+    # copy the statistics, which commands keep updating from other threads while dumping them. Copying a dict
+    # takes the GIL once, where iterating it would fail as soon as a command adds an action
+    def _copy(self):
+        latency = dict((action, histogram.copy()) for action, histogram in dict(self.latency).items())
+        return dict(self.calls), dict(self.failures), latency, dict(self.blocked), dict(self.samples)
+
+    def stats(self):
+        """
+        Get the collected statistics as a dictionary
+        """
+        calls, failures, histograms, blocked, samples = self._copy()
+        latency = {}
+        for action, histogram in histograms.items():
+            latency[action] = {'count': histogram.count, 'sum': histogram.sum,
+                               'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                               'buckets': histogram.buckets()}
+        return {
+            'calls': calls,
+            'failures': failures,
+            'latency': latency,
+            'blocked_moves': blocked,
+            'move_cache': self.cache_stats(),
+            'profile': dict((action, count * self.sample_interval) for action, count in samples.items()),
+        }
+
+    def prometheus(self):
+        """
+        Get the statistics in Prometheus text exposition format
+        """
+        calls, failures, latency, blocked, samples = self._copy()
+        lines = ['# TYPE trs_commands_total counter']
+        for action, count in sorted(calls.items(), key=str):
+            lines.append('trs_commands_total{action="%s"} %s' % (escape(action), count))
+        lines.append('# TYPE trs_command_failures_total counter')
+        for action, count in sorted(failures.items(), key=str):
+            lines.append('trs_command_failures_total{action="%s"} %s' % (escape(action), count))
+        lines.append('# TYPE trs_command_latency_seconds histogram')
+        for action, histogram in sorted(latency.items(), key=str):
+            action = escape(action)
+            for bound, count in histogram.buckets():
+                lines.append('trs_command_latency_seconds_bucket{action="%s",le="%s"} %s' % (action, bound, count))
+            lines.append('trs_command_latency_seconds_sum{action="%s"} %r' % (action, histogram.sum))
+            lines.append('trs_command_latency_seconds_count{action="%s"} %s' % (action, histogram.count))
+        lines.append('# TYPE trs_blocked_moves_total counter')
+        for name, count in sorted(blocked.items()):
+            lines.append('trs_blocked_moves_total{table="%s"} %s' % (escape(name), count))
+        # each metric family is one group, its TYPE line followed by all of its samples
+        cache_stats = self.cache_stats()
+        lines.append('# TYPE trs_move_cache_hits_total counter')
+        for name, (hits, misses, rate) in cache_stats.items():
+            lines.append('trs_move_cache_hits_total{table="%s"} %s' % (escape(name), hits))
+        lines.append('# TYPE trs_move_cache_misses_total counter')
+        for name, (hits, misses, rate) in cache_stats.items():
+            lines.append('trs_move_cache_misses_total{table="%s"} %s' % (escape(name), misses))
+        if self.sampling:
+            lines.append('# TYPE trs_profile_seconds_total counter')
+            for action, count in sorted(samples.items(), key=str):
+                lines.append('trs_profile_seconds_total{action="%s"} %r'
+                             % (escape(action), count * self.sample_interval))
+        return '\n'.join(lines) + '\n'
+
+    # write the Prometheus text to path, replacing the file atomically so readers never see a partial dump
+    def dump(self, path):
+        temporary = '%s.tmp' % path
+        with open(temporary, 'w') as stream:
+            stream.write(self.prometheus())
+        os.replace(temporary, path)
+
+
+class PeriodicDump(object):
+    """
+    Background thread dumping the statistics of instrumentation to path every interval seconds, and once more on
+    stop(). A failed dump is reported on stderr and the next one is tried all the same.
+    """
+
+    def __init__(self, instrumentation, path, interval=15.0):
+        self.instrumentation = instrumentation
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stats-dump')
+        self._thread.daemon = True
+
+    def __repr__(self):
+        return "PeriodicDump(%s,%s)" % (self.path, self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.instrumentation.dump(self.path)
+            except Exception as e:
+                sys.stderr.write('Cannot dump statistics to %s: %s: %s\n' % (self.path, type(e).__name__, e))
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.instrumentation.dump(self.path)
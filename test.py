@@ -1,6 +1,26 @@
+import os
 import unittest
-from models import Coordinate, Robot, Table
+from models import Coordinate, FrozenCoordinate, Robot, Table
 from simulator import ToyRobotSimulator
+from compact import InternedCoordinate, RobotStore
+from bytecode import OP_LEFT, OP_MOVE, OP_REPORT, OP_RIGHT, get_headings, get_transitions
+from engine import CommandEngine, parse_line, read_lines
+from fleet import Fleet
+from movecache import MoveCache
+from tiles import TileMap, TiledOccupancy
+from server import SimulatorServer
+import compass
+import cycles
+import embed
+import journal
+import planner
+import provision
+import snapshot
+import trajectory
+import workload
+from sinks import BufferedReportWriter, EventSink, NullSink
+from shard import Session, ShardedExecutor, partition
+from stats import Instrumentation, PeriodicDump
 from random import randint
 
 
@@ -25,6 +45,36 @@ class TestCoordinate(unittest.TestCase):
         self.assertEqual('Coordinate(0,4)', repr(self.coordinate2))
         self.assertEqual('Coordinate(3,2)', repr(self.coordinate3))
 
+    def testHash(self):
+        # a Coordinate can change, only frozen ones are hashable
+        self.assertRaises(TypeError, hash, self.coordinate1)
+        frozen = [FrozenCoordinate(3, 2), FrozenCoordinate(0, 4), FrozenCoordinate(3, 2)]
+        self.assertEqual(hash(frozen[0]), hash(frozen[2]))
+        self.assertEqual(2, len(set(frozen)))
+        self.assertTrue(frozen[0] == self.coordinate1 and frozen[0] != self.coordinate2)
+        self.assertRaises(AttributeError, setattr, frozen[0], 'x', 1)
+
+    def testRobotCoordinates(self):
+        trs = ToyRobotSimulator('trs1', NullSink())
+        trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1'])
+        robot1, table1 = trs.robots['robot1'], trs.tables['table1']
+        trs.place(robot1, table1, 0, 0, 'NORTH')
+        self.assertTrue(type(robot1.coordinate) is FrozenCoordinate)
+        trs.perform(robot1, 'MOVE')
+        self.assertTrue(type(robot1.coordinate) is FrozenCoordinate)
+        trs.move_many(robot1, 2)
+        self.assertEqual((FrozenCoordinate, FrozenCoordinate), (type(robot1.coordinate), type(robot1.last_position)))
+        table1.move_cache = None
+        self.assertTrue(type(table1.next_coordinate(0, 0, 'NORTH')) is FrozenCoordinate)
+
+    def testInterned(self):
+        coordinate = InternedCoordinate(3, 2)
+        self.assertTrue(coordinate is InternedCoordinate(3, 2))
+        self.assertEqual(self.coordinate1, coordinate)
+        self.assertEqual(hash(FrozenCoordinate(3, 2)), hash(coordinate))
+        self.assertRaises(AttributeError, setattr, coordinate, 'x', 1)
+        self.assertRaises(TypeError, InternedCoordinate, 1.5, 2)
+
 
 class TestRobot(unittest.TestCase):
 
@@ -157,6 +207,81 @@ class TestRobot(unittest.TestCase):
         self.assertEqual(None, self.robot1.get_f(200))
 
 
+class TestCompass(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, Robot, 'facing_directions', Robot.facing_directions)
+        self.addCleanup(setattr, Robot, 'turn_degree', Robot.turn_degree)
+        Robot.facing_directions = compass.points(8)
+        Robot.turn_degree = 45
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+                         {'name': 'table2', 'dx': 5, 'dy': 5,
+                          'rule': {'TO_SOUTH': -1, 'TO_NORTH': 1, 'TO_WEST': -1, 'TO_EAST': 1,
+                                   'TO_NORTH-EAST': (2, 1)}}],
+                        ['robot1'])
+        self.table1, self.table2 = self.trs.tables['table1'], self.trs.tables['table2']
+        self.robot1 = self.trs.robots['robot1']
+
+    def test_points(self):
+        self.assertEqual({'SOUTH': 0, 'WEST': 90, 'NORTH': 180, 'EAST': 270}, compass.points(4))
+        self.assertEqual(225, compass.points(8)['NORTH-EAST'])
+        self.assertEqual(22.5, compass.points(16)['SOUTH-SOUTH-WEST'])
+        self.assertRaises(ValueError, compass.points, 6)
+
+    def test_turn(self):
+        self.trs.place(self.robot1, self.table1, 2, 2, 'NORTH')
+        self.assertTrue(self.robot1.turn_right())
+        self.assertEqual('NORTH-EAST', self.robot1.f)
+        self.assertTrue(self.robot1.turn_left(90))
+        self.assertEqual('NORTH-WEST', self.robot1.f)
+        self.assertEqual('SOUTH-EAST', self.robot1.get_f(315))
+        self.assertFalse(self.robot1.turn_left(10))
+        self.assertEqual((135, 'NORTH-WEST'), (self.robot1.degree, self.robot1.f))
+        Robot.facing_directions['WEST-BY-NORTH'] = 125
+        self.assertTrue(self.robot1.turn_left(10))
+        self.assertEqual((125, 'WEST-BY-NORTH'), (self.robot1.degree, self.robot1.f))
+        del Robot.facing_directions['WEST-BY-NORTH']
+        self.assertFalse(self.robot1.turn_right(360))
+        self.assertEqual((125, 'WEST-BY-NORTH'), (self.robot1.degree, self.robot1.f))
+
+    def test_turn_rejected(self):
+        Robot.turn_degree = 10
+        headings = get_headings()
+        self.assertEqual(8, len(headings.states))
+        self.assertEqual(list(range(8)), headings.left)
+        self.assertEqual(list(range(8)), headings.right)
+        self.trs.place(self.robot1, self.table1, 2, 2, 'NORTH')
+        self.assertFalse(self.trs.perform(self.robot1, 'LEFT'))
+        fleet = Fleet([self.table1])
+        fleet.add_robots(['fleet0', 'fleet1'])
+        fleet.place([0], 0, 2, 2, 'NORTH')
+        self.assertEqual([False, False], fleet.turn('LEFT').tolist())
+        self.assertEqual([True, False], fleet.turn('LEFT', degree=45).tolist())
+        self.assertEqual(['2,2,NORTH-WEST', None], fleet.reports())
+
+    def test_step(self):
+        self.assertEqual((-1, -1), self.table1.step('SOUTH-WEST'))
+        self.assertEqual((1, 1), self.table1.step('NORTHEAST'))
+        self.assertEqual((2, 1), self.table2.step('NORTH-EAST'))
+        self.assertEqual((-1, 2), self.table1.step('NORTH-NORTH-WEST'))
+        self.assertEqual(None, self.table1.step('UP'))
+        self.table1.STEP_CAL_RULE = {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}
+        self.assertEqual((1, 1), self.table1.step('SOUTH-WEST'))
+        self.assertEqual(2, self.table1.free_run(2, 2, 'SOUTH-WEST'))
+        self.assertEqual(1, self.table1.free_run(3, 1, 'SOUTH-WEST'))
+
+    def test_diagonal_moves(self):
+        script = ['robot1,table1', 'PLACE 0,0,NORTH', 'RIGHT', 'MOVE', 'MOVE', 'REPORT', 'RIGHT', 'RIGHT', 'MOVE',
+                  'MOVE', 'MOVE', 'REPORT', 'robot1,table2', 'PLACE 0,0,NORTH-EAST', 'MOVE', 'MOVE', 'MOVE', 'REPORT',
+                  'MOVE UNTIL BLOCKED', 'REPORT']
+        reports = ['2,2,NORTH-EAST', '4,0,SOUTH-EAST', '4,2,NORTH-EAST', '4,2,NORTH-EAST']
+        self.assertEqual(reports, list(CommandEngine(self.trs).run(script)))
+        self.assertEqual(reports, list(CommandEngine(self.trs).run_compiled(CommandEngine(self.trs).compile(script))))
+        self.assertEqual(['RIGHT', 'MOVE', 'MOVE', 'RIGHT', 'RIGHT', 'RIGHT'],
+                         self.table1.plan(0, 0, 'NORTH', 2, 2, 'SOUTH'))
+
+
 class TestTable(unittest.TestCase):
 
     def setUp(self):
@@ -171,6 +296,118 @@ class TestTable(unittest.TestCase):
         self.assertTrue(Coordinate(34, 45) == self.table3.get_coordinate(34, 45))
         self.assertTrue(Coordinate(78, 88) == self.table4.get_coordinate(78, 88))
 
+    def test_next_coordinate(self):
+        self.assertEqual(Coordinate(3, 4), self.table1.next_coordinate(3, 3, 'NORTH'))
+        self.assertTrue(self.table1.next_coordinate(3, 3, 'NORTH') is self.table1.next_coordinate(3, 3, 'NORTH'))
+        self.assertEqual(None, self.table1.next_coordinate(4, 3, 'EAST'))
+        self.assertEqual(None, self.table1.next_coordinate(4, 3, 'EAST'))
+        self.assertEqual(Coordinate(34, 44), self.table3.next_coordinate(34, 45, 'NORTH'))
+        cache = self.table1.move_cache
+        self.assertEqual((3, 2), (cache.hits, cache.misses))
+
+    def test_move_cache_invalidation(self):
+        self.assertEqual(Coordinate(3, 4), self.table1.next_coordinate(3, 3, 'NORTH'))
+        self.table1.STEP_CAL_RULE = {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}
+        self.assertEqual(Coordinate(3, 2), self.table1.next_coordinate(3, 3, 'NORTH'))
+        self.assertEqual(None, self.table1.next_coordinate(3, 0, 'NORTH'))
+        self.table1.dy = 10
+        self.assertEqual(None, self.table1.next_coordinate(3, 0, 'NORTH'))
+        self.table1.STEP_CAL_RULE['TO_NORTH'] = 1
+        self.assertEqual(Coordinate(3, 1), self.table1.next_coordinate(3, 0, 'NORTH'))
+        self.assertEqual((0, 1), self.table1.step('NORTH'))
+
+    def test_class_rule_change(self):
+        table = Table('table', 5, 5)
+        self.assertEqual(Coordinate(3, 4), table.next_coordinate(3, 3, 'NORTH'))
+        self.assertEqual((0, 1), table.step('NORTH'))
+        rule = Table.STEP_CAL_RULE
+        try:
+            Table.STEP_CAL_RULE = {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}
+            self.assertEqual(Coordinate(3, 2), table.next_coordinate(3, 3, 'NORTH'))
+            self.assertEqual((0, -1), table.step('NORTH'))
+            self.assertEqual(['MOVE'], table.plan(3, 3, 'NORTH', 3, 2, 'NORTH'))
+        finally:
+            Table.STEP_CAL_RULE = rule
+        self.assertEqual(Coordinate(3, 4), table.next_coordinate(3, 3, 'NORTH'))
+        self.assertEqual(Coordinate(4, 3), table.next_coordinate(3, 3, 'EAST'))
+        table.x_axis = list(table.x_axis)
+        table.x_axis.remove('EAST')
+        self.assertEqual(None, table.next_coordinate(3, 3, 'EAST'))
+        self.assertEqual(None, table.step('EAST'))
+
+    def test_move_cache_eviction(self):
+        cache = MoveCache(2)
+        self.table2.move_cache = cache
+        for y in range(5):
+            self.table2.next_coordinate(0, y, 'NORTH')
+        self.assertEqual(2, len(cache))
+        self.table2.next_coordinate(0, 4, 'NORTH')
+        self.table2.next_coordinate(0, 0, 'NORTH')
+        self.assertEqual((1, 6), (cache.hits, cache.misses))
+
+    def test_move_cache_memory(self):
+        # cached results are not interned, evicting them from the cache frees them
+        interned = len(InternedCoordinate._interned)
+        cache = MoveCache(2)
+        self.table2.move_cache = cache
+        first = self.table2.next_coordinate(0, 0, 'NORTH')
+        for y in range(1, 9):
+            self.table2.next_coordinate(0, y, 'NORTH')
+        self.assertEqual(interned, len(InternedCoordinate._interned))
+        self.assertFalse(first is self.table2.next_coordinate(0, 0, 'NORTH'))
+        self.assertRaises(AttributeError, setattr, self.table2.next_coordinate(0, 0, 'NORTH'), 'x', 1)
+
+
+class TestOccupancy(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1')
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1', 'robot2', 'robot3'])
+        self.robot1, self.robot2, self.robot3 = [self.trs.robots[name] for name in ['robot1', 'robot2', 'robot3']]
+
+    def check_occupancy(self, mode):
+        table = Table('table1', 5, 5)
+        table.enable_occupancy(mode)
+        self.assertTrue(self.trs.place(self.robot1, table, 1, 1, 'NORTH'))
+        self.assertFalse(self.trs.place(self.robot2, table, 1, 1, 'SOUTH'))
+        self.assertTrue(self.trs.place(self.robot2, table, 1, 3, 'SOUTH'))
+        self.assertTrue(self.robot1 is table.who_is_at(1, 1))
+        self.assertTrue(None is table.who_is_at(0, 0))
+
+        self.assertTrue(self.trs.perform(self.robot1, 'MOVE'))
+        self.assertFalse(self.trs.perform(self.robot2, 'MOVE'))
+        self.assertEqual('1,2,NORTH', self.robot1.get_report())
+        self.assertEqual([(1, 2, self.robot1), (1, 3, self.robot2)], table.robots_within(0, 0, 4, 4))
+        self.assertEqual([(1, 3, self.robot2)], table.robots_within(1, 3, 9, 9))
+
+        # placing again releases the previous cell
+        self.assertTrue(self.trs.place(self.robot1, table, 4, 4, 'EAST'))
+        self.assertTrue(None is table.who_is_at(1, 2))
+        self.assertTrue(self.trs.perform(self.robot2, 'MOVE'))
+        self.assertEqual(2, len(table.occupancy))
+
+    def test_grid(self):
+        self.check_occupancy('grid')
+
+    def test_sparse(self):
+        self.check_occupancy('sparse')
+
+    def test_auto(self):
+        from occupancy import GridOccupancy, SparseOccupancy
+        self.assertTrue(isinstance(Table('table1', 5, 5).enable_occupancy(), GridOccupancy))
+        self.assertTrue(isinstance(Table('table1', 100000, 100000).enable_occupancy(), SparseOccupancy))
+        self.assertRaises(ValueError, Table('table1', 5, 5).enable_occupancy, 'bitmap')
+
+    def test_engine(self):
+        table = self.trs.tables['table1']
+        table.enable_occupancy()
+        self.addCleanup(setattr, table, 'occupancy', None)
+        engine = CommandEngine(self.trs)
+        script = ['robot1,table1', 'PLACE 0,0,NORTH', 'END', 'robot2,table1', 'PLACE 0,0,NORTH', 'PLACE 0,2,SOUTH',
+                  'MOVE', 'MOVE', 'REPORT', 'END']
+        self.assertEqual(['0,1,SOUTH'], list(engine.run(script)))
+        self.assertRaises(ValueError, list, engine.run_compiled(engine.compile(script)))
+
 
 class TestToyRobotSimulator(unittest.TestCase):
 
@@ -235,5 +472,1207 @@ class TestToyRobotSimulator(unittest.TestCase):
         self.trs.start()
 
 
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = EventSink()
+        self.trs = ToyRobotSimulator('trs1', self.sink)
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1'])
+        self.robot = self.trs.robots['robot1']
+        self.table = self.trs.tables['table1']
+
+    def test_events(self):
+        self.assertFalse(self.trs.perform(self.robot, 'MOVE'))
+        self.assertFalse(self.trs.place(self.robot, self.table, 5, 0, 'NORTH'))
+        self.assertTrue(self.trs.place(self.robot, self.table, 0, 4, 'NORTH'))
+        self.assertFalse(self.trs.perform(self.robot, 'MOVE'))
+        self.assertTrue(self.trs.perform(self.robot, 'REPORT'))
+        self.assertFalse(self.trs.perform(self.robot, 'JUMP'))
+        events = self.sink.drain()
+        self.assertEqual(['NOT_PLACED', 'PLACE_FAILED', 'BLOCKED', 'REPORT', 'INVALID_ACTION'],
+                         [event.kind for event in events])
+        self.assertEqual('Output: 0,4,NORTH', events[3].message)
+        self.assertTrue(events[3].robot is self.robot)
+        self.assertEqual([], self.sink.events)
+
+    def test_buffered_report_writer(self):
+        import io
+        stream = io.StringIO()
+        self.trs.sink = BufferedReportWriter(stream, buffer_size=2)
+        self.trs.place(self.robot, self.table, 0, 0, 'EAST')
+        for action in ['REPORT', 'MOVE', 'REPORT', 'LEFT', 'REPORT', 'MOVE', 'MOVE', 'MOVE', 'MOVE', 'MOVE']:
+            self.trs.perform(self.robot, action)
+        self.assertEqual('Output: 0,0,EAST\nOutput: 1,0,EAST\n', stream.getvalue())
+        self.trs.sink.flush()
+        self.assertEqual('Output: 0,0,EAST\nOutput: 1,0,EAST\nOutput: 1,0,NORTH\n', stream.getvalue())
+
+    def test_null_sink(self):
+        self.trs.sink = NullSink()
+        self.assertFalse(self.trs.perform(self.robot, 'REPORT'))
+        self.assertEqual([], self.sink.events)
+
+
+class TestPerformMany(unittest.TestCase):
+
+    def simulator(self):
+        trs = ToyRobotSimulator('trs1', EventSink())
+        trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+                    {'name': 'table2', 'dx': 3, 'dy': 3, 'rule': None}],
+                   ['robot%s' % i for i in range(1, 8)])
+        trs.tables['table2'].enable_occupancy()
+        for i in range(1, 7):
+            table = trs.tables['table1' if i <= 3 else 'table2']
+            trs.place(trs.robots['robot%s' % i], table, i % 3, i % 3, 'NORTH')
+        trs.sink.drain()
+        return trs
+
+    def state(self, trs):
+        return [(robot.coordinate, robot.f) for name, robot in sorted(trs.robots.items())]
+
+    def events(self, trs):
+        return [(event.kind, event.robot, event.message) for event in trs.sink.drain()]
+
+    def test_names_and_instances(self):
+        trs = self.simulator()
+        robot1 = trs.robots['robot1']
+        self.assertEqual([1, 1, 1], list(trs.perform_many((['robot1', robot1, 'robot1'], ['MOVE', 'RIGHT', 'MOVE']))))
+        self.assertEqual('2,2,EAST', robot1.get_report())
+
+    def test_columns_match_perform(self):
+        names = ['robot%s' % i for i in range(1, 9)]
+        actions = ['MOVE', 'MOVE', 'LEFT', 'RIGHT', 'REPORT', 'JUMP']
+        robots = [names[randint(0, 7)] for i in range(500)]
+        commands = [actions[randint(0, 5)] for i in range(500)]
+
+        expected_trs = self.simulator()
+        expected = [expected_trs.perform(expected_trs.robots.get(name), action)
+                    for name, action in zip(robots, commands)]
+        trs = self.simulator()
+        results = trs.perform_many((robots, commands))
+        self.assertEqual(expected, [bool(result) for result in results])
+        self.assertEqual([(kind, robot and robot.name, message) for kind, robot, message in self.events(expected_trs)],
+                         [(kind, robot and robot.name, message) for kind, robot, message in self.events(trs)])
+        self.assertEqual(self.state(expected_trs), self.state(trs))
+
+    def test_mapping(self):
+        trs = self.simulator()
+        robot1 = trs.robots['robot1']
+        results = trs.perform_many({robot1: ['MOVE', 'RIGHT', 'MOVE', 'REPORT'], 'robot7': ['MOVE']})
+        self.assertEqual([1, 1, 1, 1, 0], list(results))
+        self.assertEqual([('REPORT', robot1, 'Output: 2,2,EAST'), ('NOT_PLACED', trs.robots['robot7'],
+                          'Please place the robot on table before perform other actions')], self.events(trs))
+        self.assertRaises(ValueError, trs.perform_many, (['robot1'], []))
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1'])
+        self.robot1, self.table1 = self.trs.robots['robot1'], self.trs.tables['table1']
+
+    def test_stats(self):
+        instrumentation = Instrumentation(self.trs).enable()
+        self.assertTrue('perform' in self.trs.__dict__)
+        self.trs.place(self.robot1, self.table1, 0, 3, 'NORTH')
+        for action in ['MOVE', 'MOVE', 'MOVE', 'REPORT', 'JUMP']:
+            self.trs.perform(self.robot1, action)
+        engine = CommandEngine(self.trs)
+        instrumentation.disable()
+        instrumentation.enable(engine)
+        list(engine.run(['robot1,table1', 'MOVE', 'LEFT']))
+        instrumentation.disable()
+        self.assertFalse('perform' in self.trs.__dict__ or 'apply' in engine.__dict__)
+        self.trs.perform(self.robot1, 'MOVE')
+
+        stats = instrumentation.stats()
+        self.assertEqual({'PLACE': 1, 'MOVE': 4, 'REPORT': 1, 'JUMP': 1, 'LEFT': 1}, stats['calls'])
+        self.assertEqual({'MOVE': 3, 'JUMP': 1}, stats['failures'])
+        self.assertEqual({'table1': 3}, stats['blocked_moves'])
+        self.assertEqual(4, stats['latency']['MOVE']['count'])
+        self.assertEqual(4, stats['latency']['MOVE']['buckets'][-1][1])
+        self.assertEqual((2, 3), stats['move_cache']['table1'][:2])
+        text = instrumentation.prometheus()
+        self.assertTrue('trs_commands_total{action="MOVE"} 4\n' in text)
+        self.assertTrue('trs_command_latency_seconds_bucket{action="MOVE",le="+Inf"} 4\n' in text)
+        self.assertTrue('trs_blocked_moves_total{table="table1"} 3\n' in text)
+        instrumentation.reset()
+        self.assertEqual({}, instrumentation.stats()['calls'])
+
+    def test_batches(self):
+        engine = CommandEngine(self.trs)
+        instrumentation = Instrumentation(self.trs).enable(engine)
+        self.trs.place(self.robot1, self.table1, 0, 0, 'NORTH')
+        self.assertEqual([1] * 4 + [0] * 6, list(self.trs.perform_many(([self.robot1] * 10, ['MOVE'] * 10))))
+        self.assertEqual(0, self.trs.move_many(self.robot1))
+        self.trs.perform_many({'robot1': ['RIGHT', 'REPORT']})
+        list(engine.run(['robot1,table1', 'MOVE 2', 'MOVE UNTIL BLOCKED', 'MOVE UNTIL BLOCKED']))
+        program = engine.compile(['robot1,table1', 'LEFT', 'LEFT', 'MOVE', 'MOVE 9', 'PLACE 4,4,NORTH', 'MOVE',
+                                  'REPORT'])
+        self.assertEqual(['4,4,NORTH'], list(engine.run_compiled(program)))
+        instrumentation.disable()
+        self.assertFalse(set(['perform_many', 'move_many']) & set(self.trs.__dict__))
+        self.assertFalse('run_compiled' in engine.__dict__)
+
+        stats = instrumentation.stats()
+        self.assertEqual({'PLACE': 2, 'MOVE': 17, 'RIGHT': 1, 'LEFT': 2, 'REPORT': 2}, stats['calls'])
+        self.assertEqual({'MOVE': 9}, stats['failures'])
+        self.assertEqual({'table1': 9}, stats['blocked_moves'])
+        self.assertEqual(2, stats['latency']['BATCH']['count'])
+
+    def test_prometheus_format(self):
+        table = self.trs.tables['say "hi"\\\n'] = Table('say "hi"\\\n', 5, 5)
+        instrumentation = Instrumentation(self.trs).enable()
+        self.trs.place(self.robot1, table, 0, 4, 'NORTH')
+        self.trs.perform(self.robot1, 'MOVE')
+        self.trs.place(self.robot1, self.table1, 0, 0, 'NORTH')
+        self.trs.perform(self.robot1, 'MOVE')
+        self.trs.perform(self.robot1, 'MOVE')
+        text = instrumentation.prometheus()
+        self.assertTrue('trs_blocked_moves_total{table="say \\"hi\\"\\\\\\n"} 1\n' in text)
+        families = []
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                families.append(line.split()[2])
+            else:
+                name = line.split('{')[0]
+                self.assertTrue(name == families[-1] or name.rsplit('_', 1)[0] == families[-1], line)
+        self.assertEqual(len(families), len(set(families)))
+        self.assertTrue('trs_move_cache_misses_total' in families)
+
+    def test_dump_and_sampling(self):
+        import tempfile
+        import time
+        path = os.path.join(tempfile.mkdtemp(), 'trs.prom')
+        self.addCleanup(__import__('shutil').rmtree, os.path.dirname(path))
+        instrumentation = Instrumentation(self.trs, sampling=True, sample_interval=0.0005).enable()
+        dump = PeriodicDump(instrumentation, path, interval=0.01).start()
+        self.trs.place(self.robot1, self.table1, 0, 0, 'NORTH')
+        end = time.time() + 0.1
+        while time.time() < end:
+            self.trs.perform(self.robot1, 'RIGHT')
+        instrumentation.disable()
+        dump.stop()
+        self.assertEqual({}, instrumentation.stats()['latency'])
+        self.assertTrue(set(instrumentation.samples) <= set(['PLACE', 'RIGHT']))
+        self.assertTrue(sum(instrumentation.samples.values()) + instrumentation.idle_samples > 0)
+        with open(path) as stream:
+            text = stream.read()
+        self.assertTrue('trs_commands_total{action="RIGHT"}' in text)
+        self.assertTrue('# TYPE trs_profile_seconds_total counter\n' in text)
+
+    def test_dump_keeps_going(self):
+        import io
+        import tempfile
+        import time
+        from contextlib import redirect_stderr
+        path = os.path.join(tempfile.mkdtemp(), 'trs.prom')
+        self.addCleanup(__import__('shutil').rmtree, os.path.dirname(path))
+        instrumentation = Instrumentation(self.trs).enable()
+        dumps = []
+
+        def dump(path):
+            dumps.append(path)
+            if len(dumps) == 1:
+                raise ValueError('broken')
+            Instrumentation.dump(instrumentation, path)
+        instrumentation.dump = dump
+        errors = io.StringIO()
+        with redirect_stderr(errors):
+            dump = PeriodicDump(instrumentation, path, interval=0.005).start()
+            self.trs.place(self.robot1, self.table1, 0, 0, 'NORTH')
+            end = time.time() + 1
+            while len(dumps) < 3 and time.time() < end:
+                self.trs.perform(self.robot1, 'RIGHT')
+            dump.stop()
+        self.assertTrue(len(dumps) >= 3)
+        self.assertTrue('ValueError: broken' in errors.getvalue())
+        self.assertTrue(os.path.exists(path))
+
+
+class TestCommandEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1')
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1', 'robot2'])
+        self.engine = CommandEngine(self.trs)
+
+    def test_parse_line(self):
+        self.assertEqual(('PLACE', (1, 2, 'NORTH')), parse_line('PLACE 1,2,NORTH'))
+        self.assertEqual(('MOVE', ()), parse_line('MOVE'))
+        self.assertEqual(('SELECT', ('robot1', 'table1')), parse_line('robot1,table1'))
+        self.assertEqual(None, parse_line(''))
+        self.assertEqual(None, parse_line('PLACE 1,2'))
+        self.assertEqual(None, parse_line('PLACE a,2,NORTH'))
+        self.assertEqual(None, parse_line('JUMP'))
+
+    def test_read_lines(self):
+        import io
+        text = 'PLACE 0,0,NORTH\nMOVE\nREPORT'
+        self.assertEqual(['PLACE 0,0,NORTH', 'MOVE', 'REPORT'], list(read_lines(io.StringIO(text), 4)))
+        self.assertEqual(['MOVE', 'REPORT'], list(read_lines(['MOVE', 'REPORT'])))
+
+    def test_run(self):
+        script = ['PLACE 0,0,NORTH', 'MOVE', 'REPORT', 'LEFT', 'MOVE', 'REPORT', 'RIGHT', 'RIGHT', 'MOVE', 'REPORT']
+        self.assertEqual(['0,1,NORTH', '0,1,WEST', '1,1,EAST'], list(self.engine.run(script, 'robot1', 'table1')))
+
+    def test_run_blocked_and_invalid(self):
+        script = ['MOVE', 'REPORT', 'PLACE 9,9,NORTH', 'PLACE 4,4,EAST', 'MOVE', 'JUMP', 'REPORT']
+        self.assertEqual(['4,4,EAST'], list(self.engine.run(script, 'robot1', 'table1')))
+
+    def test_run_select(self):
+        script = ['robot1,table1', 'PLACE 1,1,SOUTH', 'REPORT', 'END', 'REPORT',
+                  'robot2,table1', 'PLACE 2,2,WEST', 'MOVE', 'REPORT', 'END']
+        self.assertEqual(['1,1,SOUTH', '1,2,WEST'], list(self.engine.run(script)))
+
+
+class TestBytecode(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1')
+        self.table_params = [{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+                             {'name': 'table3', 'dx': 50, 'dy': 50,
+                              'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}}]
+        self.trs.deploy(self.table_params, ['robot1', 'robot2'])
+        self.engine = CommandEngine(self.trs)
+        self.directions = ["SOUTH", "WEST", "NORTH", "EAST"]
+
+    def random_script(self, table, length):
+        script = []
+        for i in range(length):
+            command = ['MOVE', 'MOVE', 'LEFT', 'RIGHT', 'REPORT', 'PLACE'][randint(0, 5)]
+            if command == 'PLACE':
+                command = 'PLACE %s,%s,%s' % (randint(-1, table.dx), randint(-1, table.dy),
+                                               self.directions[randint(0, 3)])
+            script.append(command)
+        return script
+
+    def test_transitions(self):
+        table = self.trs.tables['table3']
+        transitions = get_transitions(table)
+        headings = get_headings()
+        north = headings.state(180, 'NORTH')
+        self.assertEqual((0, -1, north), transitions.steps[north * 3 + OP_MOVE - OP_MOVE])
+        self.assertEqual(headings.state(90, 'WEST'), transitions.steps[north * 3 + OP_LEFT - OP_MOVE][2])
+        self.assertEqual(headings.state(270, 'EAST'), transitions.steps[north * 3 + OP_RIGHT - OP_MOVE][2])
+        self.assertTrue(transitions is get_transitions(table))
+
+    def test_run_compiled_matches_run(self):
+        for table in self.trs.tables.values():
+            script = self.random_script(table, 500)
+            robot1 = self.trs.robots['robot1']
+            before = (robot1.coordinate, robot1.last_position, robot1.f, robot1.degree,
+                      self.trs.robot_on_table.get(robot1))
+            expected = list(self.engine.run(script, 'robot1', table.name))
+            state = (robot1.coordinate, robot1.last_position, robot1.f, robot1.degree)
+
+            program = self.engine.compile(script)
+            robot1.coordinate, robot1.last_position, robot1.f, robot1.degree, on_table = before
+            self.trs.robot_on_table[robot1] = on_table
+            self.assertEqual(expected, list(self.engine.run_compiled(program, 'robot1', table.name)))
+            self.assertEqual(state, (robot1.coordinate, robot1.last_position, robot1.f, robot1.degree))
+
+    def test_run_compiled_select(self):
+        script = ['robot1,table1', 'PLACE 1,1,SOUTH', 'REPORT', 'END', 'REPORT',
+                  'robot2,table3', 'PLACE 2,2,WEST', 'MOVE', 'REPORT', 'END']
+        program = self.engine.compile(script)
+        self.assertEqual(['1,1,SOUTH', '3,2,WEST'], list(self.engine.run_compiled(program)))
+        self.assertEqual('3,2,WEST', self.trs.robots['robot2'].get_report())
+        self.assertEqual(Coordinate(2, 2), self.trs.robots['robot2'].last_position)
+
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1')
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1'])
+        self.tables = [Table('table1', 5, 5),
+                       Table('table3', 50, 50, {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1})]
+        self.fleet = Fleet(self.tables)
+        self.names = ['fleet%s' % i for i in range(200)]
+        self.ids = self.fleet.add_robots(self.names)
+        self.directions = ["SOUTH", "WEST", "NORTH", "EAST"]
+
+    def test_place(self):
+        placed = self.fleet.place([0, 1, 2], 0, [0, 5, 4], [0, 0, -1], ['NORTH', 'EAST', 'UP'])
+        self.assertEqual([True, False, False], placed.tolist())
+        self.assertEqual(['0,0,NORTH', None, None], self.fleet.reports([0, 1, 2]))
+
+    def test_step_matches_robots(self):
+        robots = [Robot(name) for name in self.names]
+        table_ids = [randint(0, 1) for i in self.ids]
+        xs = [randint(0, 4) for i in self.ids]
+        ys = [randint(0, 4) for i in self.ids]
+        fs = [self.directions[randint(0, 3)] for i in self.ids]
+        self.fleet.place(self.ids, table_ids, xs, ys, fs)
+        for robot, t, x, y, f in zip(robots, table_ids, xs, ys, fs):
+            self.trs.place(robot, self.tables[t], x, y, f)
+
+        for i in range(50):
+            ops = [[OP_MOVE, OP_MOVE, OP_LEFT, OP_RIGHT][randint(0, 3)] for robot in robots]
+            self.fleet.step(ops)
+            for robot, op in zip(robots, ops):
+                self.trs.perform(robot, {OP_MOVE: 'MOVE', OP_LEFT: 'LEFT', OP_RIGHT: 'RIGHT'}[op])
+        self.assertEqual([robot.get_report() for robot in robots], self.fleet.reports())
+
+    def test_obstacles(self):
+        self.tables[0].set_blocked(2, 2)
+        self.tables[1].set_blocked(1, 0)
+        self.assertEqual([False, True], self.fleet.place([0, 1], [0, 1], [2, 2], [2, 0], 'NORTH').tolist())
+        self.fleet.place([2, 3], 0, [2, 1], [1, 2], ['NORTH', 'EAST'])
+        self.assertEqual([False, False, False], self.fleet.move([1, 2, 3]).tolist())
+        self.assertEqual(['2,0,NORTH', '2,1,NORTH', '1,2,EAST'], self.fleet.reports([1, 2, 3]))
+        self.tables[0].set_blocked(2, 2, False)
+        self.assertEqual([True, True], self.fleet.move([2, 3]).tolist())
+
+        robots = [Robot(name) for name in self.names]
+        xs = [randint(0, 4) for i in self.ids]
+        ys = [randint(0, 4) for i in self.ids]
+        for i in range(10):
+            self.tables[i % 2].set_blocked(randint(0, 4), randint(0, 4))
+        placed = self.fleet.place(self.ids, 0, xs, ys, 'SOUTH')
+        self.assertEqual([not self.tables[0].is_blocked(x, y) for x, y in zip(xs, ys)], placed.tolist())
+        for robot, x, y, p in zip(robots, xs, ys, placed.tolist()):
+            if p:
+                self.trs.place(robot, self.tables[0], x, y, 'SOUTH')
+        for i in range(30):
+            ops = [[OP_MOVE, OP_MOVE, OP_LEFT, OP_RIGHT][randint(0, 3)] for robot in robots]
+            self.fleet.step(ops)
+            for robot, op, p in zip(robots, ops, placed.tolist()):
+                if p:
+                    self.trs.perform(robot, {OP_MOVE: 'MOVE', OP_LEFT: 'LEFT', OP_RIGHT: 'RIGHT'}[op])
+        self.assertEqual([robot.get_report() for robot, p in zip(robots, placed.tolist()) if p],
+                         self.fleet.reports(self.ids[placed]))
+
+    def test_robot_view(self):
+        self.fleet.place([0], 0, 4, 4, 'EAST')
+        robot = self.fleet.robot('fleet0')
+        self.assertEqual(Coordinate(4, 4), robot.coordinate)
+        self.assertTrue(robot.turn_left())
+        self.assertEqual('NORTH', robot.f)
+        self.assertEqual('4,4,NORTH', self.fleet.reports([0])[0])
+        self.fleet.register(self.trs)
+        self.assertFalse(self.trs.perform(self.trs.robots['fleet0'], 'MOVE'))
+        self.assertTrue(robot.set_coordinate_and_f(Coordinate(1, 1), 'SOUTH'))
+        self.assertEqual(['1,1,SOUTH'], self.fleet.step(OP_REPORT, [0]))
+
+
+class TestRobotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.table = Table('table1', 5, 5)
+        self.store = RobotStore([self.table])
+
+    def test_slots(self):
+        self.assertFalse(hasattr(Robot('robot1'), '__dict__'))
+        self.assertFalse(hasattr(Coordinate(0, 0), '__dict__'))
+
+    def test_pack(self):
+        robot = Robot('robot1')
+        robot.set_coordinate_and_f(Coordinate(1, 2), 'WEST')
+        robot.move_to(Coordinate(0, 2))
+        robot_id = self.store.pack(robot, self.table)
+        self.assertEqual(1, self.store.pack(Robot('robot2')))
+
+        packed = self.store.robot(robot_id)
+        self.assertEqual(robot.get_report(), packed.get_report())
+        self.assertEqual(Coordinate(1, 2), packed.last_position)
+        self.assertTrue(self.table is packed.table)
+        self.assertFalse(self.store.robot('robot2').is_placed())
+        self.assertEqual(None, self.store.robot('robot2').table)
+
+    def test_robot_view(self):
+        robot = self.store.robot(self.store.add('robot1'))
+        self.assertFalse(robot.is_placed())
+        self.assertTrue(robot.set_coordinate_and_f(Coordinate(3, 3), 'SOUTH'))
+        self.assertTrue(robot.turn_right())
+        self.assertTrue(robot.move_to(Coordinate(2, 3)))
+        self.assertEqual('2,3,WEST', robot.get_report())
+        self.assertTrue(robot.coordinate is InternedCoordinate(2, 3))
+
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'floor', 'dx': 10 ** 9, 'dy': 10 ** 9, 'rule': None}], ['robot1', 'robot2'])
+        self.floor = self.trs.tables['floor']
+        self.floor.enable_sparse(16)
+        self.robot1, self.robot2 = self.trs.robots['robot1'], self.trs.robots['robot2']
+
+    def test_tile_map(self):
+        cells = TileMap(16)
+        self.assertRaises(ValueError, TileMap, 10)
+        cells.set(5, 7, 3)
+        cells.add(10 ** 8, 17)
+        cells.add(10 ** 8, 17)
+        self.assertEqual((3, 2, 0), (cells.get(5, 7), cells.get(10 ** 8, 17), cells.get(6, 7)))
+        self.assertEqual((2, 2), (len(cells), len(cells.tiles)))
+        self.assertEqual([(5, 7, 3), (10 ** 8, 17, 2)], list(cells.within(0, 0, 10 ** 9, 10 ** 9)))
+        self.assertEqual([(5, 7, 3)], list(cells.within(0, 0, 20, 20)))
+        self.assertEqual(sorted([(5, 7, 3), (10 ** 8, 17, 2)]), sorted(cells.items()))
+        cells.discard(5, 7)
+        self.assertEqual((1, 1), (len(cells), len(cells.tiles)))
+
+    def test_tile_density(self):
+        cells = TileMap(16)
+        points = [(i % 16, 3 + i // 16) for i in range(17)]
+        for i, (x, y) in enumerate(points):
+            cells.set(x, y, i + 1)
+        # more than 1/16 of the cells set turns the tile dense
+        tile = cells.tiles[(0, 0)]
+        self.assertFalse(isinstance(tile, dict))
+        self.assertEqual((17, 17, 17), (len(cells), tile[cells.area], cells.get(0, 4)))
+        self.assertEqual([(15, 3, 16), (0, 4, 17)], list(cells.within(15, 3, 15, 5)) + list(cells.within(0, 4, 0, 4)))
+        # and half of it turns it sparse again
+        for x, y in points[:9]:
+            cells.discard(x, y)
+        self.assertEqual(dict((y * 16 + x, i + 1) for i, (x, y) in enumerate(points) if i >= 9), cells.tiles[(0, 0)])
+        self.assertEqual([(15, 3, 16), (0, 4, 17)], list(cells.within(0, 3, 15, 4))[-2:])
+        for x, y in points[9:]:
+            cells.discard(x, y)
+        self.assertEqual((0, {}), (len(cells), cells.tiles))
+        robots = TileMap(16, None)
+        for i in range(20):
+            robots.set(i, 0, 'robot%s' % i)
+        self.assertEqual(['robot1', 'robot15', 'robot18'], [robots.get(1, 0), robots.get(15, 0), robots.get(18, 0)])
+
+    def test_sparse_table(self):
+        far = 10 ** 9 - 1
+        self.assertTrue(self.trs.place(self.robot1, self.floor, far, far, 'SOUTH'))
+        self.assertFalse(self.trs.place(self.robot2, self.floor, far, far, 'NORTH'))
+        self.floor.set_blocked(far, far - 2)
+        self.assertFalse(self.trs.place(self.robot2, self.floor, far, far - 2, 'NORTH'))
+        self.assertTrue(self.trs.perform(self.robot1, 'MOVE'))
+        self.assertFalse(self.trs.perform(self.robot1, 'MOVE'))
+        self.assertTrue(self.trs.place(self.robot2, self.floor, far, far, 'SOUTH'))
+        self.assertFalse(self.trs.perform(self.robot2, 'MOVE'))
+        self.assertEqual('%s,%s,SOUTH' % (far, far - 1), self.robot1.get_report())
+        self.assertEqual((2, 1), (self.floor.visit_count(far, far), self.floor.visit_count(far, far - 1)))
+        self.assertTrue(self.floor.is_blocked(far, far - 2))
+        self.assertEqual([(far, far - 1, self.robot1), (far, far, self.robot2)],
+                         self.floor.robots_within(far - 5, far - 5, far, far))
+        self.assertEqual(2, len(self.floor.occupancy))
+        self.assertEqual(1, len(self.floor.visits.tiles))
+        self.assertTrue(isinstance(Table('table1', 5, 5).enable_occupancy('tiled'), TiledOccupancy))
+
+
+class TestObstacles(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 10, 'dy': 10, 'rule': None, 'obstacles': [(2, 5), (7, 5), (2, 8)]},
+                         {'name': 'table2', 'dx': 10, 'dy': 10,
+                          'rule': {'TO_SOUTH': -2, 'TO_NORTH': 2, 'TO_WEST': -1, 'TO_EAST': 1},
+                          'obstacles': [(2, 6)]}],
+                        ['robot1'])
+        self.table1, self.table2 = self.trs.tables['table1'], self.trs.tables['table2']
+        self.robot1 = self.trs.robots['robot1']
+        self.engine = CommandEngine(self.trs)
+
+    def test_blocked(self):
+        self.assertFalse(self.trs.place(self.robot1, self.table1, 2, 5, 'NORTH'))
+        self.assertTrue(self.trs.place(self.robot1, self.table1, 2, 4, 'NORTH'))
+        self.assertFalse(self.trs.perform(self.robot1, 'MOVE'))
+        self.table1.set_blocked(2, 5, False)
+        self.assertTrue(self.trs.perform(self.robot1, 'MOVE'))
+        self.table1.set_blocked(2, 6)
+        self.assertFalse(self.trs.perform(self.robot1, 'MOVE'))
+        self.assertEqual('2,5,NORTH', self.robot1.get_report())
+
+    def test_free_run(self):
+        self.assertEqual(2, self.table1.free_run(2, 2, 'NORTH'))
+        self.assertEqual(1, self.table1.free_run(2, 2, 'NORTH', 1))
+        self.assertEqual(4, self.table1.free_run(2, 5, 'EAST'))
+        self.assertEqual(1, self.table1.free_run(9, 5, 'WEST'))
+        self.assertEqual(9, self.table1.free_run(0, 0, 'EAST'))
+        self.assertEqual(5, self.table1.free_run(2, 5, 'SOUTH'))
+        self.assertEqual(1, self.table2.free_run(2, 2, 'NORTH'))
+        self.assertEqual(3, self.table2.free_run(3, 2, 'NORTH'))
+
+    def test_move_many_matches_moves(self):
+        for table in [self.table1, self.table2]:
+            for count in ['UNTIL BLOCKED', 0, 1, 2, 3, 20]:
+                for f in ['NORTH', 'SOUTH', 'EAST', 'WEST']:
+                    x, y = randint(0, 9), randint(0, 9)
+                    if table.is_blocked(x, y):
+                        continue
+                    place = ['robot1,%s' % table.name, 'PLACE %s,%s,%s' % (x, y, f)]
+                    moves = ['MOVE'] * (20 if count == 'UNTIL BLOCKED' else count)
+                    expected = list(self.engine.run(place + moves + ['REPORT']))
+                    last = self.robot1.last_position
+                    self.assertEqual(expected, list(self.engine.run(place + ['MOVE %s' % count, 'REPORT'])))
+                    self.assertEqual(last, self.robot1.last_position)
+
+    def test_compiled_run(self):
+        table = Table('table3', 10, 10)
+        self.trs.tables['table3'] = table
+        script = ['robot1,table3', 'PLACE 2,2,NORTH', 'MOVE 3', 'REPORT', 'RIGHT', 'MOVE UNTIL BLOCKED', 'REPORT']
+        expected = list(self.engine.run(script))
+        self.assertEqual(['2,5,NORTH', '9,5,EAST'], expected)
+        self.assertEqual(expected, list(self.engine.run_compiled(self.engine.compile(script))))
+        program = self.engine.compile(['robot1,table1', 'PLACE 0,0,NORTH', 'MOVE 3'])
+        self.assertRaises(ValueError, list, self.engine.run_compiled(program))
+        self.assertEqual(None, parse_line('MOVE -1'))
+
+
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 6, 'dy': 6, 'rule': None},
+                         {'name': 'table2', 'dx': 6, 'dy': 6, 'rule': None, 'obstacles': [(1, 1), (1, 2), (2, 1)]},
+                         {'name': 'table3', 'dx': 6, 'dy': 6,
+                          'rule': {'TO_SOUTH': -2, 'TO_NORTH': 2, 'TO_WEST': -1, 'TO_EAST': 1}}],
+                        ['robot1'])
+        self.robot1 = self.trs.robots['robot1']
+
+    def replay(self, table, x, y, f, commands):
+        self.trs.place(self.robot1, table, x, y, f)
+        for action in commands:
+            self.assertTrue(self.trs.perform(self.robot1, action))
+        return self.robot1.get_report()
+
+    def test_plan_reaches_goal(self):
+        for name in ['table1', 'table2', 'table3']:
+            table = self.trs.tables[name]
+            for i in range(20):
+                x, y, gx, gy = randint(0, 5), randint(0, 5), randint(0, 5), randint(0, 5)
+                f, gf = ['NORTH', 'SOUTH', 'EAST', 'WEST'][randint(0, 3)], ['NORTH', 'WEST'][randint(0, 1)]
+                commands = table.plan(x, y, f, gx, gy, gf)
+                if table.is_blocked(x, y) or table.is_blocked(gx, gy) or (name == 'table3' and (gy - y) % 2):
+                    self.assertEqual(None, commands)
+                else:
+                    self.assertEqual('%s,%s,%s' % (gx, gy, gf), self.replay(table, x, y, f, commands))
+        self.assertEqual(['MOVE', 'MOVE', 'RIGHT', 'MOVE'], self.trs.tables['table1'].plan(0, 0, 'NORTH', 1, 2, 'EAST'))
+        self.assertEqual([], self.trs.tables['table1'].plan(3, 3, 'WEST', 3, 3, 'WEST'))
+
+    def test_strategies_agree(self):
+        for name in ['table1', 'table2', 'table3']:
+            table = self.trs.tables[name]
+            plans = planner.Planner(table)
+            for i in range(20):
+                start = plans.state(randint(0, 5), randint(0, 5), 'EAST')
+                goal = plans.state(randint(0, 5), randint(0, 5), 'SOUTH')
+                if start is None or goal is None:
+                    continue
+                searched, followed = plans._search(start, goal), plans._follow(start, goal)
+                self.assertEqual(searched is None, followed is None)
+                if searched is not None:
+                    self.assertEqual(len(followed), len(searched))
+                if plans.simple:
+                    self.assertEqual(len(followed), len(plans._direct(start, goal)))
+
+    def test_unreachable(self):
+        table2 = self.trs.tables['table2']
+        self.assertEqual(None, table2.plan(0, 0, 'NORTH', 1, 1, 'NORTH'))
+        table2.set_blocked(0, 1)
+        table2.set_blocked(1, 0)
+        self.assertEqual(None, table2.plan(0, 0, 'NORTH', 5, 5, 'NORTH'))
+        self.assertEqual(None, table2.plan(0, 0, 'UP', 0, 0, 'NORTH'))
+        self.assertEqual(None, table2.plan(0, 0, 'NORTH', 6, 0, 'NORTH'))
+
+    def test_search_agrees_with_fields(self):
+        table = Table('maze', 40, 30)
+        for x in range(5, 40):
+            table.set_blocked(x, 10)
+        for y in range(12, 30):
+            table.set_blocked(20, y)
+        for i in range(120):
+            table.set_blocked(randint(0, 39), randint(0, 29))
+        plans = planner.Planner(table)
+        for i in range(40):
+            start = plans.state(randint(0, 39), randint(0, 29), ['NORTH', 'EAST'][randint(0, 1)])
+            goal = plans.state(randint(0, 39), randint(0, 29), ['SOUTH', 'WEST'][randint(0, 1)])
+            if start is None or goal is None:
+                continue
+            followed = plans._follow(start, goal)
+            self.assertEqual(followed is not None, plans.reachable(start, goal))
+            if followed is not None:
+                searched = plans._search(start, goal)
+                self.assertEqual(len(followed), len(searched))
+                state = start
+                for action in searched:
+                    state = dict(plans._successors(*state))[action]
+                self.assertEqual(goal, state)
+
+    def test_large_tables(self):
+        wall = Table('wall', 1000, 1000)
+        for y in range(999):
+            wall.set_blocked(500, y)
+        commands = wall.plan(100, 500, 'NORTH', 900, 500, 'NORTH')
+        self.assertEqual(499 + 800 + 499 + 4, len(commands))
+        self.assertEqual(None, wall.plan(100, 500, 'NORTH', 900, 500, 'NORTH', limit=1))
+        for x in range(400, 999):
+            wall.set_blocked(x, 999)
+        self.assertFalse(planner.get_planner(wall).reachable((100, 500, 0), (900, 500, 0)))
+        self.assertEqual(None, wall.plan(100, 500, 'NORTH', 900, 500, 'NORTH'))
+        steps = Table('steps', 1000, 1000, {'TO_SOUTH': -2, 'TO_NORTH': 2, 'TO_WEST': -2, 'TO_EAST': 2})
+        self.assertEqual(None, steps.plan(0, 0, 'NORTH', 900, 901, 'NORTH'))
+        self.assertEqual(900, len([c for c in steps.plan(0, 0, 'NORTH', 900, 900, 'NORTH') if c == 'MOVE']))
+
+    def test_invalidation(self):
+        table1 = self.trs.tables['table1']
+        self.assertEqual(3, len(table1.plan(0, 0, 'NORTH', 0, 3, 'NORTH')))
+        cached = planner.get_planner(table1)
+        self.assertTrue(planner.get_planner(table1) is cached)
+        table1.set_blocked(0, 2)
+        self.assertFalse(planner.get_planner(table1) is cached)
+        commands = table1.plan(0, 0, 'NORTH', 0, 3, 'NORTH')
+        self.assertEqual(9, len(commands))
+        self.assertEqual('0,3,NORTH', self.replay(table1, 0, 0, 'NORTH', commands))
+
+
+class TestProvision(unittest.TestCase):
+
+    def setUp(self):
+        self.tables_csv = ['name,dx,dy,to_south,to_north,to_west,to_east', 'table1,5,5,,,,',
+                           'table2,50,50,1,-1,1,-1']
+        self.robots_csv = ['name,table,x,y,f', 'robot1,table1,1,2,NORTH', 'robot2,,,,', 'robot3,table2,49,0,WEST',
+                           '', 'robot4,table1,4,4,SOUTH']
+
+    def test_load_store(self):
+        store = provision.load_store(self.tables_csv, self.robots_csv, chunk_rows=2)
+        self.assertEqual(['robot1', 'robot2', 'robot3', 'robot4'], store.names)
+        self.assertEqual(['table1', 'table2'], [table.name for table in store.tables])
+        self.assertEqual(-1, store.tables[1].STEP_CAL_RULE['TO_NORTH'])
+        self.assertEqual('1,2,NORTH', store.robot('robot1').get_report())
+        self.assertEqual((90, Coordinate(49, 0)), (store.robot(2).degree, store.robot(2).last_position))
+        self.assertFalse(store.robot('robot2').is_placed())
+        self.assertTrue(store.table_of(3) is store.tables[0])
+
+    def test_load(self):
+        trs = ToyRobotSimulator('trs1', NullSink())
+        self.assertEqual(4, provision.load(trs, self.tables_csv, self.robots_csv, chunk_rows=3))
+        robot3 = trs.robots['robot3']
+        self.assertEqual('49,0,WEST', robot3.get_report())
+        self.assertTrue(trs.robot_on_table[robot3] is trs.tables['table2'])
+        self.assertFalse(trs.perform(robot3, 'MOVE'))
+        self.assertTrue(trs.perform(trs.robots['robot1'], 'MOVE'))
+        self.assertEqual('1,3,NORTH', trs.robots['robot1'].get_report())
+        self.assertEqual({}, ToyRobotSimulator('trs2').robots)
+
+    def test_invalid(self):
+        for row, message in [('robot1,table3,0,0,NORTH', 'unknown table'), ('robot5,table1,5,0,NORTH', 'outside'),
+                             ('robot5,table1,0,0,UP', 'unknown direction'), ('robot5,table1,a,0,UP', 'int'),
+                             (',table1,0,0,NORTH', 'no name'), ('robot1,table1,0,0,NORTH', 'used twice')]:
+            with self.assertRaises(ValueError) as raised:
+                provision.load_store(self.tables_csv, self.robots_csv + [row], chunk_rows=2)
+            self.assertTrue(message in str(raised.exception), str(raised.exception))
+        self.assertRaises(ValueError, provision.read_tables, ['name,dx,dy', 'table1,5,five'])
+
+
+class TestWorkload(unittest.TestCase):
+
+    def test_deterministic(self):
+        first = workload.Workload(robots=5, tables=2, commands=100, seed=7, burst=4)
+        lines = list(first.lines(chunk_commands=10))
+        self.assertEqual(lines, list(workload.Workload(robots=5, tables=2, commands=100, seed=7, burst=4).lines()))
+        self.assertNotEqual(lines, list(workload.Workload(robots=5, tables=2, commands=100, seed=8, burst=4).lines()))
+        commands = [line for line in lines if parse_line(line)[0] != 'SELECT']
+        self.assertEqual(100 + len(set(line for line in lines if ',' in line and ' ' not in line)), len(commands))
+        for line in lines:
+            action, args = parse_line(line)
+            if action == 'SELECT':
+                self.assertEqual((int(args[0][5:]) - 1) % 2 + 1, int(args[1][5:]))
+
+    def test_write_and_run(self):
+        import tempfile
+        path = os.path.join(tempfile.mkdtemp(), 'workload.txt')
+        self.addCleanup(__import__('shutil').rmtree, os.path.dirname(path))
+        load = workload.Workload(robots=4, tables=2, commands=500, mix={'MOVE': 3, 'RIGHT': 1, 'REPORT': 1,
+                                                                         'PLACE': 1}, seed=3)
+        self.assertEqual(len(list(load.lines())), load.write(path))
+        trs1, trs2 = ToyRobotSimulator('trs1', NullSink()), ToyRobotSimulator('trs2', NullSink())
+        reports = load.run(trs1)
+        load.deploy(trs2)
+        self.assertEqual(reports, len(list(CommandEngine(trs2).run(path))))
+        self.assertEqual([robot.get_report() for name, robot in sorted(trs1.robots.items())],
+                         [robot.get_report() for name, robot in sorted(trs2.robots.items())])
+        self.assertTrue(trs1.robot_on_table[trs1.robots['robot3']] is trs1.tables['table1'])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, workload.Workload, mix={'JUMP': 1})
+        self.assertRaises(ValueError, workload.Workload, mix={'MOVE': 0})
+        self.assertRaises(ValueError, workload.Workload, robots=0)
+
+
+class TestShardedExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.table_params = [{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+                             {'name': 'table2', 'dx': 10, 'dy': 10, 'rule': None},
+                             {'name': 'table3', 'dx': 50, 'dy': 50,
+                              'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}}]
+        self.robot_names = ['robot1', 'robot2', 'robot3', 'robot4']
+        self.sessions = [('robot1', 'table1', ['PLACE 0,0,NORTH', 'MOVE', 'REPORT']),
+                         ('robot2', 'table2', ['PLACE 9,9,EAST', 'MOVE', 'LEFT', 'REPORT']),
+                         ('robot3', 'table3', ['PLACE 1,1,WEST', 'MOVE', 'MOVE', 'REPORT']),
+                         ('robot1', 'table1', ['MOVE', 'RIGHT', 'MOVE', 'REPORT']),
+                         ('robot4', 'table2', ['PLACE 0,0,SOUTH', 'MOVE', 'REPORT', 'RIGHT', 'REPORT'])]
+        self.expected = [['0,1,NORTH'], ['9,9,NORTH'], ['3,1,WEST'], ['1,2,EAST'], ['0,0,SOUTH', '0,0,WEST']]
+
+    def test_partition(self):
+        sessions = [Session(*session) for session in self.sessions]
+        shards = partition(sessions, 2)
+        self.assertEqual(2, len(shards))
+        self.assertEqual([0, 1, 2, 3, 4], sorted(sum(shards, [])))
+        # robot2 moving to table1 joins table1 and table2 into one shard
+        sessions.append(Session('robot2', 'table1', ['REPORT']))
+        self.assertTrue([0, 1, 3, 4, 5] in partition(sessions, 3))
+
+    def test_run(self):
+        self.assertEqual(self.expected, ShardedExecutor(self.table_params, self.robot_names, 1).run(self.sessions))
+        self.assertEqual(self.expected, ShardedExecutor(self.table_params, self.robot_names, 3).run(self.sessions))
+
+
+class TestSimulatorServer(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1')
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1', 'robot2'])
+
+    def test_sessions(self):
+        import asyncio
+
+        async def client(port, lines):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(''.join(line + '\n' for line in lines).encode('utf-8'))
+            replies = [(await reader.readline()).decode('utf-8').strip() for line in lines]
+            writer.close()
+            return replies
+
+        async def run():
+            server = SimulatorServer(self.trs)
+            await server.start('127.0.0.1', 0)
+            port = server.server.sockets[0].getsockname()[1]
+            try:
+                return await asyncio.gather(
+                    client(port, ['robot1,table1', 'MOVE', 'PLACE 0,0,NORTH', 'MOVE', 'REPORT', 'END', 'REPORT']),
+                    client(port, ['robot2,table9', 'robot2,table1', 'PLACE 4,4,EAST', 'MOVE', 'LEFT', 'REPORT',
+                                  'JUMP']))
+            finally:
+                server.close()
+
+        replies = asyncio.run(run())
+        self.assertEqual(['OK', 'FAILED', 'OK', 'OK', 'Output: 0,1,NORTH', 'OK', 'FAILED'], replies[0])
+        self.assertEqual(['FAILED', 'OK', 'OK', 'FAILED', 'OK', 'Output: 4,4,NORTH', 'FAILED'], replies[1])
+
+    def test_robot_lock(self):
+        import asyncio
+
+        async def send(writer, reader, lines):
+            writer.write(''.join(line + '\n' for line in lines).encode('utf-8'))
+            return [(await reader.readline()).decode('utf-8').strip() for line in lines]
+
+        async def run():
+            server = SimulatorServer(self.trs)
+            await server.start('127.0.0.1', 0)
+            port = server.server.sockets[0].getsockname()[1]
+            try:
+                reader1, writer1 = await asyncio.open_connection('127.0.0.1', port)
+                reader2, writer2 = await asyncio.open_connection('127.0.0.1', port)
+                replies = [await send(writer1, reader1, ['robot1,table1', 'PLACE 0,0,NORTH'])]
+                # the second session waits for robot1 until the first one ends
+                waiting = asyncio.ensure_future(send(writer2, reader2, ['robot2,table1', 'robot1,table1', 'REPORT']))
+                await asyncio.sleep(0.1)
+                replies.append(waiting.done())
+                replies.append(await send(writer1, reader1, ['MOVE', 'REPORT', 'END']))
+                replies.append(await waiting)
+                # disconnecting releases the robot too
+                writer1.close()
+                reader3, writer3 = await asyncio.open_connection('127.0.0.1', port)
+                waiting = asyncio.ensure_future(send(writer3, reader3, ['robot1,table1', 'MOVE']))
+                await asyncio.sleep(0.1)
+                replies.append(waiting.done())
+                writer2.close()
+                replies.append(await waiting)
+                writer3.close()
+                return replies
+            finally:
+                server.close()
+
+        replies = asyncio.run(run())
+        self.assertEqual([['OK', 'OK'], False, ['OK', 'Output: 0,1,NORTH', 'OK'], ['OK', 'OK', 'Output: 0,1,NORTH'],
+                          False, ['OK', 'OK']], replies)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_compare(self):
+        from benchmarks.hot_paths import compare
+        baseline = {'results': {'place': 100.0, 'robot.turn': 100.0, 'robot.get_f': 100.0}}
+        results = {'results': {'place': 125.0, 'robot.turn': 105.0, 'perform[MOVE]': 1000.0}}
+        self.assertEqual([('place', 100.0, 125.0, 0.25)], compare(results, baseline, 0.1))
+
+    def test_run_all(self):
+        from benchmarks.hot_paths import run_all
+        results = run_all(name_filter='get_coordinate[5x5]', min_time=0.001)
+        self.assertEqual(['get_coordinate[5x5]'], list(results['results']))
+        self.assertTrue(results['results']['get_coordinate[5x5]'] > 0)
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+                         {'name': 'table3', 'dx': 50, 'dy': 50,
+                          'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}}],
+                        ['robot1', 'robot2', 'robot3'])
+        self.trs.place(self.trs.robots['robot1'], self.trs.tables['table1'], 1, 1, 'NORTH')
+        self.trs.perform(self.trs.robots['robot1'], 'MOVE')
+        self.trs.perform(self.trs.robots['robot1'], 'LEFT')
+        self.trs.place(self.trs.robots['robot2'], self.trs.tables['table3'], 20, 30, 'EAST')
+        self.trs.perform(self.trs.robots['robot2'], 'MOVE')
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def state(self, simulator):
+        return dict((name, (robot.coordinate, robot.last_position, robot.f, robot.degree,
+                            simulator.robot_on_table[robot].name if robot.is_placed() else None))
+                    for name, robot in simulator.robots.items())
+
+    def test_restore(self):
+        snapshot.save(self.trs, self.path)
+        restored = ToyRobotSimulator('trs2')
+        snapshot.load(self.path).restore(restored)
+        self.assertEqual(self.state(self.trs), self.state(restored))
+        self.assertEqual(self.trs.tables['table3'].STEP_CAL_RULE, restored.tables['table3'].STEP_CAL_RULE)
+        self.assertEqual('19,30,EAST', restored.robots['robot2'].get_report())
+
+    def test_to_store(self):
+        snapshot.save(self.trs, self.path)
+        store = snapshot.load(self.path).to_store()
+        self.assertEqual('1,2,WEST', store.robot('robot1').get_report())
+        self.assertEqual(Coordinate(1, 1), store.robot('robot1').last_position)
+        self.assertEqual('table3', store.robot('robot2').table.name)
+        self.assertFalse(store.robot('robot3').is_placed())
+
+    def test_fleet(self):
+        snapshot.save(self.trs, self.path)
+        fleet = snapshot.load(self.path).to_fleet()
+        self.assertEqual(['1,2,WEST', '19,30,EAST', None], fleet.reports())
+        snapshot.save_fleet(fleet, self.path)
+        self.assertEqual(['1,2,WEST', '19,30,EAST', None], snapshot.load(self.path).to_fleet().reports())
+
+    def test_fractional_degrees(self):
+        self.addCleanup(setattr, Robot, 'facing_directions', Robot.facing_directions)
+        self.addCleanup(setattr, Robot, 'turn_degree', Robot.turn_degree)
+        Robot.facing_directions = compass.points(16)
+        Robot.turn_degree = 22.5
+        self.trs.perform(self.trs.robots['robot2'], 'RIGHT')
+        self.assertEqual(292.5, self.trs.robots['robot2'].degree)
+        snapshot.save(self.trs, self.path)
+        restored = ToyRobotSimulator('trs2')
+        snapshot.load(self.path).restore(restored)
+        self.assertEqual(self.state(self.trs), self.state(restored))
+        self.assertEqual('19,30,EAST-SOUTH-EAST', restored.robots['robot2'].get_report())
+        fleet = snapshot.load(self.path).to_fleet()
+        self.assertEqual(292.5, fleet.robot('robot2').degree)
+        self.assertEqual([True, True, False], fleet.turn('RIGHT').tolist())
+        self.assertEqual(['1,2,WEST-NORTH-WEST', '19,30,SOUTH-EAST', None], fleet.reports())
+        snapshot.save_fleet(fleet, self.path)
+        self.assertEqual(['1,2,WEST-NORTH-WEST', '19,30,SOUTH-EAST', None],
+                         snapshot.load(self.path).to_fleet().reports())
+        self.assertRaises(ValueError, snapshot.load(self.path).to_store)
+
+    def test_facing_directions_mismatch(self):
+        snapshot.save(self.trs, self.path)
+        self.addCleanup(setattr, Robot, 'facing_directions', Robot.facing_directions)
+        Robot.facing_directions = compass.Directions({"NORTH": 0, "EAST": 90, "SOUTH": 180, "WEST": 270})
+        loaded = snapshot.load(self.path)
+        self.assertRaises(ValueError, loaded.restore, ToyRobotSimulator('trs2'))
+        self.assertRaises(ValueError, loaded.to_fleet)
+        Robot.facing_directions = compass.points(8)
+        self.assertEqual('1,2,WEST', loaded.restore(ToyRobotSimulator('trs2')).robots['robot1'].get_report())
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as stream:
+            stream.write(b'\0' * 64)
+        self.assertRaises(ValueError, snapshot.load, self.path)
+
+
+class TestTrajectory(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(__import__('shutil').rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'trajectories')
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 10, 'dy': 10, 'rule': None}], ['robot1', 'robot2'])
+        self.trs.trajectories = trajectory.Recorder(self.path, keyframe_interval=2)
+        self.engine = CommandEngine(self.trs)
+        self.script = ['robot1,table1', 'PLACE 0,0,NORTH', 'MOVE', 'MOVE 3', 'RIGHT', 'MOVE', 'MOVE', 'REPORT', 'LEFT',
+                       'MOVE UNTIL BLOCKED', 'MOVE', 'LEFT', 'MOVE']
+
+    def expected(self):
+        # states after every command, replayed one command at a time
+        trs = ToyRobotSimulator('trs2', NullSink())
+        trs.deploy([{'name': 'table1', 'dx': 10, 'dy': 10, 'rule': None}], ['robot1'])
+        robot1, table1 = trs.robots['robot1'], trs.tables['table1']
+        states = []
+        for line in self.script[1:]:
+            action, args = parse_line(line)
+            for i in range(args[0] if args[0] is not None else 10) if action == 'MOVE' and args else [0]:
+                if action == 'PLACE':
+                    done = trs.place(robot1, table1, *args)
+                else:
+                    done = action != 'REPORT' and trs.perform(robot1, action.split()[0])
+                if done:
+                    states.append(('table1', robot1.coordinate.x, robot1.coordinate.y, robot1.f))
+        return states
+
+    def test_record(self):
+        list(self.engine.run(self.script))
+        history = self.trs.trajectories.trajectory('robot1')
+        expected = self.expected()
+        self.assertEqual(len(expected), len(history))
+        self.assertEqual(expected, list(history.states()))
+        self.assertEqual(expected[5:], list(history.states(5)))
+        self.assertEqual(expected, [history.state(t) for t in range(len(history))])
+        self.assertEqual(('table1', 1, 9, 'WEST'), history.state(-1))
+        self.assertRaises(IndexError, history.state, len(history))
+        self.assertEqual([('PLACE', 1), ('MOVE', 4), ('RIGHT', 1), ('MOVE', 2), ('LEFT', 1), ('MOVE', 5), ('LEFT', 1),
+                          ('MOVE', 1)], list(history.actions()))
+        self.assertEqual(0, len(self.trs.trajectories.trajectory('robot2')))
+
+    def test_simulator_hooks(self):
+        robot1, table1 = self.trs.robots['robot1'], self.trs.tables['table1']
+        self.trs.place(robot1, table1, 1, 1, 'EAST')
+        self.trs.perform(robot1, 'MOVE')
+        self.trs.perform(robot1, 'LEFT')
+        self.trs.perform_many(([robot1, robot1, robot1], ['MOVE', 'REPORT', 'MOVE']))
+        history = self.trs.trajectories.trajectory(robot1)
+        self.assertEqual([('table1', 1, 1, 'EAST'), ('table1', 2, 1, 'EAST'), ('table1', 2, 1, 'NORTH'),
+                          ('table1', 2, 2, 'NORTH'), ('table1', 2, 3, 'NORTH')], list(history.states()))
+        self.assertRaises(ValueError, cycles.repeat, self.trs, robot1, ['MOVE'], 3)
+
+    def test_stream(self):
+        lines = iter(self.script)
+        list(self.engine.run([next(lines) for i in range(6)]))
+        self.trs.trajectories.stream()
+        list(self.engine.run(['robot1,table1'] + list(lines)))
+        list(self.engine.run(['robot2,table1', 'PLACE 5,5,SOUTH', 'MOVE']))
+        self.trs.trajectories.stream()
+        self.assertEqual(0, self.trs.trajectories.stream())
+        loaded = trajectory.load(self.path)
+        self.assertEqual(self.expected(), list(loaded.trajectory('robot1').states()))
+        self.assertEqual([('table1', 5, 5, 'SOUTH'), ('table1', 5, 4, 'SOUTH')],
+                         list(loaded.trajectory('robot2').states()))
+
+    def test_stream_drop(self):
+        self.trs.trajectories.keep = False
+        list(self.engine.run(self.script[:6]))
+        self.trs.trajectories.stream()
+        history = self.trs.trajectories.trajectory('robot1')
+        self.assertEqual(0, len(history.records))
+        self.assertRaises(IndexError, history.state, 0)
+        list(self.engine.run(['robot1,table1'] + self.script[6:]))
+        self.assertEqual(self.expected()[-1], history.state(-1))
+        self.trs.trajectories.stream()
+        self.assertEqual(self.expected(), list(trajectory.load(self.path).trajectory('robot1').states()))
+
+
+class TestEmbed(unittest.TestCase):
+
+    def setUp(self):
+        self.script = ['robot1,table1', 'PLACE 0,0,NORTH', 'MOVE', 'REPORT']
+
+    def test_lazy_imports(self):
+        import subprocess
+        import sys
+        # nothing is loaded by importing embed, and optional subsystems are not loaded by running a script
+        code = ('import sys, embed; before = set(sys.modules); embed.run(%r); '
+                'print(sorted(m for m in ["models", "simulator", "engine", "bytecode", "occupancy", "tiles"] '
+                'if m in before), sorted(m for m in ["bytecode", "occupancy", "tiles", "planner"] '
+                'if m in sys.modules))' % self.script)
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual('[] []', output.decode('utf-8').strip())
+
+    def test_run(self):
+        self.assertEqual(['0,1,NORTH'], embed.run(self.script))
+        trs = embed.create([{'name': 'table1', 'dx': 3, 'dy': 3, 'rule': None}], ['robot1', 'robot2'])
+        self.assertEqual(['0,1,NORTH', '0,2,NORTH'], embed.run(self.script + ['MOVE', 'MOVE', 'REPORT'], trs))
+        self.assertEqual(['0,2,EAST'], embed.run(['RIGHT', 'REPORT'], trs, 'robot1', 'table1'))
+        self.assertEqual([], embed.run(['REPORT'], trs, 'robot2', 'table1'))
+
+    def test_worker_pool(self):
+        with embed.WorkerPool(2) as pool:
+            self.assertEqual(['0,1,NORTH'], pool.run(self.script))
+            self.assertEqual(['0,1,NORTH'], pool.run('\n'.join(self.script)))
+            self.assertEqual([['0,1,NORTH'], [], ['0,1,NORTH']], pool.map([self.script, ['REPORT'], self.script]))
+        with embed.WorkerPool(1, fresh=False) as pool:
+            pool.run(self.script)
+            self.assertEqual(['0,2,NORTH'], pool.run(['robot1,table1', 'MOVE', 'REPORT']))
+            self.assertRaises(RuntimeError, pool.run, [None])
+            self.assertEqual(['0,3,NORTH'], pool.run(['robot1,table1', 'MOVE', 'REPORT']))
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(__import__('shutil').rmtree, self.dir)
+        self.journal_path = os.path.join(self.dir, 'journal')
+        self.snapshot_path = os.path.join(self.dir, 'snapshot')
+        self.trs = self.simulator()
+        self.trs.journal = journal.Journal(self.journal_path, batch_size=4)
+        self.engine = CommandEngine(self.trs)
+
+    def simulator(self):
+        trs = ToyRobotSimulator('trs1', NullSink())
+        trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None}], ['robot1', 'robot2'])
+        return trs
+
+    def reports(self, simulator):
+        return [simulator.robots[name].get_report() if simulator.robots[name].is_placed() else None
+                for name in ['robot1', 'robot2']]
+
+    def test_records(self):
+        robot1, table1 = self.trs.robots['robot1'], self.trs.tables['table1']
+        self.trs.place(robot1, table1, 0, 0, 'NORTH')
+        self.trs.perform(robot1, 'MOVE')
+        self.trs.perform(robot1, 'REPORT')
+        self.trs.perform(robot1, 'LEFT')
+        self.trs.perform(robot1, 'MOVE')
+        list(self.engine.run(['robot2,table1', 'PLACE 4,4,EAST', 'MOVE', 'RIGHT'], ))
+        self.trs.journal.close()
+        self.assertEqual([(1, 'PLACE', 'robot1', 'table1', (0, 0, 'NORTH')), (2, 'MOVE', 'robot1', None, ()),
+                          (3, 'LEFT', 'robot1', None, ()), (4, 'PLACE', 'robot2', 'table1', (4, 4, 'EAST')),
+                          (5, 'RIGHT', 'robot2', None, ())],
+                         list(journal.records(self.journal_path)))
+        self.assertEqual(5, journal.Journal(self.journal_path).seq)
+
+    def test_recover(self):
+        list(self.engine.run(['robot1,table1', 'PLACE 1,1,NORTH', 'MOVE', 'RIGHT', 'MOVE']))
+        self.assertEqual(4, journal.checkpoint(self.trs, self.trs.journal, self.snapshot_path))
+        # the checkpoint holds the records so far, the journal keeps its sequence number only
+        self.assertEqual([], list(journal.records(self.journal_path)))
+        reopened = journal.Journal(self.journal_path)
+        reopened.close()
+        self.assertEqual(4, reopened.seq)
+        list(self.engine.run(['robot2,table1', 'PLACE 3,3,SOUTH', 'MOVE', 'robot1,table1', 'MOVE']))
+        self.trs.journal.commit()
+        # a record cut short by a crash is ignored
+        with open(self.journal_path, 'ab') as stream:
+            stream.write(b'\1\2\3')
+
+        recovered = self.simulator()
+        self.assertEqual(7, journal.recover(recovered, self.snapshot_path, self.journal_path))
+        self.assertEqual(self.reports(self.trs), self.reports(recovered))
+        self.assertEqual(['3,2,EAST', '3,2,SOUTH'], self.reports(recovered))
+
+        self.trs.journal.close()
+        appended = journal.Journal(self.journal_path)
+        appended.append(self.trs.robots['robot1'], self.trs.tables['table1'], 'LEFT')
+        appended.close()
+        self.assertEqual([(8, 'LEFT', 'robot1', 'table1', ())], list(journal.records(self.journal_path, 7)))
+
+    def test_move_runs(self):
+        list(self.engine.run(['robot1,table1', 'PLACE 2,0,NORTH', 'MOVE', 'MOVE 2', 'robot2,table1', 'PLACE 4,0,NORTH',
+                              'MOVE', 'robot1,table1', 'MOVE UNTIL BLOCKED', 'MOVE', 'LEFT', 'MOVE']))
+        self.trs.perform(self.trs.robots['robot1'], 'MOVE')
+        self.trs.journal.commit()
+        self.assertEqual([(1, 'PLACE', 'robot1', 'table1', (2, 0, 'NORTH')), (2, 'MOVE', 'robot1', None, (3,)),
+                          (3, 'PLACE', 'robot2', 'table1', (4, 0, 'NORTH')), (4, 'MOVE', 'robot2', None, ()),
+                          (5, 'MOVE', 'robot1', None, ()), (6, 'LEFT', 'robot1', None, ()),
+                          (7, 'MOVE', 'robot1', None, (2,))],
+                         list(journal.records(self.journal_path)))
+        recovered = self.simulator()
+        self.assertEqual(7, journal.recover(recovered, None, self.journal_path))
+        self.assertEqual(['0,4,WEST', '4,1,NORTH'], self.reports(recovered))
+        self.assertEqual(self.reports(self.trs), self.reports(recovered))
+
+    def test_recover_occupancy(self):
+        self.trs.tables['table1'].enable_sparse()
+        list(self.engine.run(['robot1,table1', 'PLACE 1,1,NORTH', 'MOVE']))
+        journal.checkpoint(self.trs, self.trs.journal, self.snapshot_path)
+        list(self.engine.run(['robot2,table1', 'PLACE 1,4,SOUTH', 'MOVE', 'MOVE']))
+        self.trs.journal.commit()
+
+        recovered = self.simulator()
+        journal.recover(recovered, self.snapshot_path, self.journal_path)
+        table1 = recovered.tables['table1']
+        self.assertEqual('sparse', table1.occupancy.mode)
+        self.assertEqual(['1,2,NORTH', '1,3,SOUTH'], self.reports(recovered))
+        self.assertTrue(table1.who_is_at(1, 2) is recovered.robots['robot1'])
+        self.assertEqual(sorted(self.trs.tables['table1'].visits.items()), sorted(table1.visits.items()))
+        self.assertEqual([1, 1, 1, 1], [table1.visit_count(1, y) for y in range(1, 5)])
+        # robots still collide after recovery
+        self.assertFalse(recovered.perform(recovered.robots['robot1'], 'MOVE'))
+        self.assertFalse(recovered.place(recovered.robots['robot2'], table1, 1, 2, 'EAST'))
+
+    def test_checkpoint_keep(self):
+        list(self.engine.run(['robot1,table1', 'PLACE 1,1,NORTH', 'MOVE', 'RIGHT', 'MOVE']))
+        self.assertEqual(4, journal.checkpoint(self.trs, self.trs.journal, self.snapshot_path, truncate=False))
+        list(self.engine.run(['robot2,table1', 'PLACE 3,3,SOUTH', 'MOVE', 'robot1,table1', 'MOVE']))
+        self.trs.journal.commit()
+        self.assertEqual([5, 6, 7], [record[0] for record in journal.records(self.journal_path, 4)])
+        self.assertEqual([6, 7], [record[0] for record in journal.records(self.journal_path, 5)])
+
+        recovered = self.simulator()
+        self.assertEqual(7, journal.recover(recovered, None, self.journal_path))
+        self.assertEqual(self.reports(self.trs), self.reports(recovered))
+        recovered = self.simulator()
+        self.assertEqual(7, journal.recover(recovered, self.snapshot_path, self.journal_path))
+        self.assertEqual(self.reports(self.trs), self.reports(recovered))
+
+    def test_compiled_not_supported(self):
+        program = self.engine.compile(['robot1,table1', 'PLACE 1,1,NORTH'])
+        self.assertRaises(ValueError, list, self.engine.run_compiled(program))
+
+
+class TestCycles(unittest.TestCase):
+
+    def setUp(self):
+        self.trs = ToyRobotSimulator('trs1', NullSink())
+        self.trs.deploy([{'name': 'table1', 'dx': 5, 'dy': 5, 'rule': None},
+                         {'name': 'table3', 'dx': 7, 'dy': 3,
+                          'rule': {'TO_SOUTH': 1, 'TO_NORTH': -1, 'TO_WEST': 1, 'TO_EAST': -1}}],
+                        ['robot1', 'robot2'])
+        self.engine = CommandEngine(self.trs)
+        self.blocks = [['MOVE', 'MOVE', 'LEFT'], ['RIGHT', 'MOVE', 'MOVE', 'MOVE', 'LEFT', 'MOVE'], ['LEFT'],
+                       ['MOVE']]
+
+    def state(self, robot):
+        return robot.coordinate, robot.last_position, robot.f, robot.degree
+
+    def replay(self, table, block, n, x, y):
+        list(self.engine.run(['robot1,%s' % table.name, 'PLACE %s,%s,NORTH' % (x, y)] + block * n))
+        return self.state(self.trs.robots['robot1'])
+
+    def test_repeat_matches_replay(self):
+        robot2 = self.trs.robots['robot2']
+        for table in self.trs.tables.values():
+            for block in self.blocks:
+                transform = cycles.BlockTransform(table, block)
+                for n in [0, 1, 2, 3, 7, 50, 101]:
+                    x, y = randint(0, table.dx - 1), randint(0, table.dy - 1)
+                    expected = self.replay(table, block, n, x, y)
+                    for t in [None, transform]:
+                        self.trs.place(robot2, table, x, y, 'NORTH')
+                        self.assertTrue(cycles.repeat(self.trs, robot2, block, n, t))
+                        self.assertEqual(expected, self.state(robot2))
+
+    def test_then(self):
+        table = self.trs.tables['table1']
+        square = cycles.BlockTransform(table, ['MOVE', 'RIGHT'])
+        combined = square.then(cycles.BlockTransform(table, ['MOVE', 'MOVE', 'LEFT']))
+        expected = self.replay(table, ['MOVE', 'RIGHT', 'MOVE', 'MOVE', 'LEFT'], 10001, 2, 2)
+        robot2 = self.trs.robots['robot2']
+        self.trs.place(robot2, table, 2, 2, 'NORTH')
+        cycles.repeat(self.trs, robot2, None, 10001, combined)
+        self.assertEqual(expected, self.state(robot2))
+
+    def test_not_placed(self):
+        self.assertFalse(cycles.repeat(self.trs, self.trs.robots['robot1'], ['MOVE'], 10))
+        self.assertRaises(ValueError, cycles.compile_block, ['MOVE', 'REPORT'])
+
+
 if __name__ == "__main__":
     unittest.main()
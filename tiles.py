@@ -0,0 +1,192 @@
+"""
+Tiled storage of per cell data for huge tables, like 10^6 x 10^6 warehouse floors. Cells are grouped in square
+tiles which are allocated the first time one of their cells is set and released when all of them are back to the
+default value. A tile keeps its cells in a dict while few of them are set, and switches to a dense array once
+enough are set for the array to be smaller, so memory is proportional to the cells actually touched whether they
+are scattered or clustered, not to the table size.
+"""
+from array import array
+
+# default tile width and height, a power of two
+TILE_SIZE = 64
+
+# a tile becomes dense when more than 1 / DENSE_FRACTION of its cells are set, a dict entry costing about ten times
+# the 8 bytes of a dense cell, and sparse again at half of that
+DENSE_FRACTION = 16
+
+
+class TileMap(object):
+    """
+    Tile map holding a value per cell, default for cells never set. Tile (tx, ty) holds the cells with
+    x >> shift == tx and y >> shift == ty, cell i being ((y & mask) << shift) | (x & mask). Sparse tiles are a dict
+    {i: value}, dense ones a sequence of tile_size * tile_size values followed by the number of cells which are not
+    default, an array('q') for int defaults and a list otherwise.
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, default=0):
+        if tile_size <= 0 or tile_size & (tile_size - 1):
+            raise ValueError('Tile size must be a power of two')
+        self.tile_size = tile_size
+        self.shift = tile_size.bit_length() - 1
+        self.mask = tile_size - 1
+        self.area = tile_size * tile_size
+        self.default = default
+        self.dense_limit = max(self.area // DENSE_FRACTION, 1)
+        self.tiles = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "TileMap(%s,%s)" % (len(self.tiles), self.count)
+
+    def get(self, x, y):
+        tile = self.tiles.get((x >> self.shift, y >> self.shift))
+        if tile is None:
+            return self.default
+        i = ((y & self.mask) << self.shift) | (x & self.mask)
+        if type(tile) is dict:
+            return tile.get(i, self.default)
+        return tile[i]
+
+    # get a dense tile holding the cells of a sparse one
+    def _dense(self, cells):
+        default = self.default
+        if type(default) is int:
+            tile = array('q', [default]) * (self.area + 1)
+        else:
+            tile = [default] * (self.area + 1)
+        for i, value in cells.items():
+            tile[i] = value
+        tile[self.area] = len(cells)
+        return tile
+
+    def set(self, x, y, value):
+        key = (x >> self.shift, y >> self.shift)
+        default = self.default
+        tile = self.tiles.get(key)
+        if tile is None:
+            if value == default:
+                return
+            tile = self.tiles[key] = {}
+        i = ((y & self.mask) << self.shift) | (x & self.mask)
+        if type(tile) is dict:
+            if value == default:
+                if tile.pop(i, default) != default:
+                    self.count -= 1
+                    if not tile:
+                        del self.tiles[key]
+            else:
+                if i not in tile:
+                    self.count += 1
+                tile[i] = value
+                if len(tile) > self.dense_limit:
+                    self.tiles[key] = self._dense(tile)
+            return
+        was_default = tile[i] == default
+        tile[i] = value
+        if was_default != (value == default):
+            change = 1 if was_default else -1
+            tile[self.area] += change
+            self.count += change
+            if tile[self.area] <= self.dense_limit // 2:
+                self.tiles[key] = dict((j, tile[j]) for j in range(self.area) if tile[j] != default)
+                if not tile[self.area]:
+                    del self.tiles[key]
+
+    # add n to the value at x,y, return the new value
+    def add(self, x, y, n=1):
+        value = self.get(x, y) + n
+        self.set(x, y, value)
+        return value
+
+    def discard(self, x, y):
+        self.set(x, y, self.default)
+
+    # get the (i, value) of the cells of tile which are not default, by index
+    def _cells(self, tile):
+        if type(tile) is dict:
+            return sorted(tile.items())
+        default = self.default
+        return [(i, tile[i]) for i in range(self.area) if tile[i] != default]
+
+    # yield (x, y, value) of the cells which are not default, ordered by tile
+    def items(self):
+        shift, mask = self.shift, self.mask
+        for (tx, ty), tile in self.tiles.items():
+            for i, value in self._cells(tile):
+                yield (tx << shift) | (i & mask), (ty << shift) | (i >> shift), value
+
+    # yield (x, y, value) of the cells which are not default within x0..x1, y0..y1 inclusive, ordered by y then x
+    def within(self, x0, y0, x1, y1):
+        if x1 < x0 or y1 < y0:
+            return
+        shift, mask, default = self.shift, self.mask, self.default
+        tx0, ty0, tx1, ty1 = x0 >> shift, y0 >> shift, x1 >> shift, y1 >> shift
+        # visit the tiles overlapping the rectangle, or filter the allocated ones when there are fewer
+        if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) <= len(self.tiles):
+            keys = [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1) if (tx, ty) in self.tiles]
+        else:
+            keys = [key for key in self.tiles if tx0 <= key[0] <= tx1 and ty0 <= key[1] <= ty1]
+        cells = []
+        for tx, ty in keys:
+            tile = self.tiles[(tx, ty)]
+            if type(tile) is dict:
+                for i, value in tile.items():
+                    cx, cy = (tx << shift) | (i & mask), (ty << shift) | (i >> shift)
+                    if x0 <= cx <= x1 and y0 <= cy <= y1:
+                        cells.append((cy, cx, value))
+                continue
+            for cy in range(max(y0, ty << shift), min(y1, (ty << shift) | mask) + 1):
+                row = (cy & mask) << shift
+                for cx in range(max(x0, tx << shift), min(x1, (tx << shift) | mask) + 1):
+                    value = tile[row | (cx & mask)]
+                    if value != default:
+                        cells.append((cy, cx, value))
+        cells.sort(key=lambda cell: (cell[0], cell[1]))
+        for y, x, value in cells:
+            yield x, y, value
+
+
+class TiledOccupancy(object):
+    """
+    Occupancy index over a TileMap of robots, with the same interface as GridOccupancy and SparseOccupancy. It
+    pays off where robots are packed in clusters, whose tiles turn dense at 8 bytes per cell, scattered robots are
+    better kept in a SparseOccupancy
+    """
+
+    mode = 'tiled'
+
+    def __init__(self, tile_size=TILE_SIZE):
+        self.cells = TileMap(tile_size, None)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __repr__(self):
+        return "TiledOccupancy(%s)" % len(self.cells)
+
+    def get(self, x, y):
+        return self.cells.get(x, y)
+
+    def add(self, robot, x, y):
+        occupant = self.cells.get(x, y)
+        if occupant is None:
+            self.cells.set(x, y, robot)
+            return True
+        return occupant is robot
+
+    def remove(self, robot, x, y):
+        if self.cells.get(x, y) is robot:
+            self.cells.discard(x, y)
+
+    def move(self, robot, x0, y0, x1, y1):
+        if self.add(robot, x1, y1):
+            if (x0, y0) != (x1, y1):
+                self.remove(robot, x0, y0)
+            return True
+        return False
+
+    def within(self, x0, y0, x1, y1):
+        return self.cells.within(x0, y0, x1, y1)
@@ -0,0 +1,324 @@
+"""
+Optional trajectory recording of where robots went, in a compact delta-encoded form. Each robot history is an
+array of int32 records: PLACE with the table, facing direction and coordinate, MOVE runs with the number of steps
+and the step vector, merged while the robot keeps moving the same way, and LEFT/RIGHT with the new facing
+direction. Positions are only reconstructed on demand, keyframes of the full state every few records give random
+access to the position at any step, and the history can be streamed out to a file for offline analysis.
+"""
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+PLACE, MOVE, LEFT, RIGHT = 0, 1, 2, 3
+OPCODES = {'PLACE': PLACE, 'MOVE': MOVE, 'LEFT': LEFT, 'RIGHT': RIGHT}
+ACTIONS = dict((op, action) for action, op in OPCODES.items())
+
+# number of int32 of each record including the opcode: PLACE table, f, x, y; MOVE count, dx, dy; LEFT and RIGHT f
+WIDTHS = (5, 4, 2, 2)
+
+# number of records between two keyframes
+KEYFRAME_INTERVAL = 64
+
+# a trajectory file is a sequence of blocks, each block has a header of tag, robot id or number of names, and
+# payload length, followed by the payload
+BLOCK = struct.Struct('<4sII')
+NAMES = b'NAME'     # payload of (id, length) NAME_ENTRY structs each followed by the name bytes
+TRACK = b'TRAK'     # payload of records of one robot, continuing its previous TRAK blocks
+NAME_ENTRY = struct.Struct('<II')
+
+
+class Trajectory(object):
+    """
+    History of one robot. Step t is the t-th recorded command, state(t) the (table, x, y, f) after it. Table and
+    facing direction are ids in names, the list of names shared by the trajectories of a Recorder.
+    """
+
+    def __init__(self, names, keyframe_interval=KEYFRAME_INTERVAL):
+        self.names = names
+        self.keyframe_interval = keyframe_interval
+        self.records = array('i')
+        # keyframe k is the step and record offset of the record starting it, and the state before that record
+        self.key_steps = array('q')
+        self.key_offsets = array('q')
+        self.key_states = []
+        # first step still in records, earlier ones were dropped after streaming them out
+        self.first = 0
+        self.steps = 0
+        self.table = self.f = -1
+        self.x = self.y = 0
+        self._run = -1      # offset of the last MOVE record, which can still be extended
+        self._since = 0     # records since the last keyframe
+
+    def __repr__(self):
+        return "Trajectory(%s)" % self.steps
+
+    def __len__(self):
+        return self.steps
+
+    def _start(self, op):
+        # start a new record, taking a keyframe first when due
+        if not self._since or self._since >= self.keyframe_interval:
+            self.key_steps.append(self.steps)
+            self.key_offsets.append(len(self.records))
+            self.key_states.append((self.table, self.x, self.y, self.f))
+            self._since = 0
+        self._since += 1
+        self._run = len(self.records) if op == MOVE else -1
+        self.records.append(op)
+
+    def place(self, table, f, x, y):
+        self._start(PLACE)
+        self.records.extend((table, f, x, y))
+        self.table, self.f, self.x, self.y = table, f, x, y
+        self.steps += 1
+
+    def move(self, dx, dy, count=1):
+        records = self.records
+        run = self._run
+        if run >= 0 and records[run + 2] == dx and records[run + 3] == dy:
+            records[run + 1] += count
+        else:
+            self._start(MOVE)
+            records.extend((count, dx, dy))
+        self.x += dx * count
+        self.y += dy * count
+        self.steps += count
+
+    def turn(self, op, f):
+        self._start(op)
+        self.records.append(f)
+        self.f = f
+        self.steps += 1
+
+    # append records, e.g. read from a file, updating the state and keyframes as recording them would
+    def extend(self, records):
+        i = 0
+        while i < len(records):
+            op = records[i]
+            if op == PLACE:
+                self.place(*records[i + 1:i + 5])
+            elif op == MOVE:
+                self.move(records[i + 2], records[i + 3], records[i + 1])
+            else:
+                self.turn(op, records[i + 1])
+            i += WIDTHS[op]
+
+    # forget the records kept so far, the next record starts a keyframe of the current state
+    def drop(self):
+        self.records = array('i')
+        self.key_steps, self.key_offsets, self.key_states = array('q'), array('q'), []
+        self.first = self.steps
+        self._run = -1
+        self._since = 0
+
+    def _name(self, i):
+        return self.names[i] if i >= 0 else None
+
+    def _walk(self, k):
+        # yield (step, op, count, record offset, state before) of every record from keyframe k
+        records = self.records
+        step, offset = self.key_steps[k], self.key_offsets[k]
+        table, x, y, f = self.key_states[k]
+        while offset < len(records):
+            op = records[offset]
+            count = records[offset + 1] if op == MOVE else 1
+            yield step, op, count, offset, (table, x, y, f)
+            if op == PLACE:
+                table, f, x, y = records[offset + 1:offset + 5]
+            elif op == MOVE:
+                x += records[offset + 2] * count
+                y += records[offset + 3] * count
+            else:
+                f = records[offset + 1]
+            step += count
+            offset += WIDTHS[op]
+
+    def state(self, t):
+        """
+        Get the (table name, x, y, f) of the robot after step t, found from the keyframe before it, negative t
+        counts from the end. Raise IndexError if t was not recorded or was dropped after streaming it out.
+        """
+        if t < 0:
+            t += self.steps
+        if not self.first <= t < self.steps:
+            raise IndexError('Step %s is not in the recorded trajectory' % t)
+        for step, op, count, offset, (table, x, y, f) in self._walk(bisect_right(self.key_steps, t) - 1):
+            if step + count > t:
+                records = self.records
+                if op == PLACE:
+                    table, f, x, y = records[offset + 1:offset + 5]
+                elif op == MOVE:
+                    x += records[offset + 2] * (t - step + 1)
+                    y += records[offset + 3] * (t - step + 1)
+                else:
+                    f = records[offset + 1]
+                return self._name(table), x, y, self._name(f)
+
+    def states(self, start=0):
+        """
+        Yield the (table name, x, y, f) after every step from start on, reconstructed lazily
+        """
+        start = max(start, self.first)
+        if start >= self.steps:
+            return
+        records = self.records
+        for step, op, count, offset, (table, x, y, f) in self._walk(bisect_right(self.key_steps, start) - 1):
+            dx = dy = 0
+            if op == PLACE:
+                table, f, x, y = records[offset + 1:offset + 5]
+            elif op == MOVE:
+                dx, dy = records[offset + 2], records[offset + 3]
+            else:
+                f = records[offset + 1]
+            table_name, f_name = self._name(table), self._name(f)
+            for i in range(max(start - step, 0), count):
+                if op == MOVE:
+                    yield table_name, x + dx * (i + 1), y + dy * (i + 1), f_name
+                else:
+                    yield table_name, x, y, f_name
+
+    def actions(self):
+        """
+        Yield the (action, count) of the records kept, count is the length of MOVE runs and 1 otherwise
+        """
+        for step, op, count, offset, state in self._walk(0) if self.key_steps else ():
+            yield ACTIONS[op], count
+
+
+class Recorder(object):
+    """
+    Recorder of the trajectories of every robot of a simulator, set it as simulator.trajectories to record the
+    successful PLACE, MOVE, LEFT and RIGHT commands. With path given, stream() appends the records made since its
+    last call to path, and with keep False drops them from memory afterwards.
+    """
+
+    def __init__(self, path=None, keep=True, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.keep = keep
+        self.keyframe_interval = keyframe_interval
+        self.trajectories = {}     # robot name -> Trajectory
+        self.names = []            # table and facing direction names by id
+        self.ids = {}
+        self.robot_ids = {}
+        self.new_names = []
+        self.saved = {}            # robot name -> number of records of its trajectory already streamed out
+
+    def __repr__(self):
+        return "Recorder(%s)" % len(self.trajectories)
+
+    def _id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.new_names.append((i, name))
+        return i
+
+    def trajectory(self, robot):
+        """
+        Get the Trajectory of a robot or robot name, created empty on first use
+        """
+        name = robot if isinstance(robot, str) else robot.name
+        trajectory = self.trajectories.get(name)
+        if trajectory is None:
+            trajectory = self.trajectories[name] = Trajectory(self.names, self.keyframe_interval)
+        return trajectory
+
+    def place(self, robot, table):
+        """
+        Record robot just placed on table
+        """
+        self.trajectory(robot).place(self._id(table.name), self._id(robot.f), robot.coordinate.x, robot.coordinate.y)
+
+    def record(self, robot, action, count=1):
+        """
+        Record a successful MOVE, LEFT or RIGHT of robot, count MOVE steps in a row, taken from its last position
+        """
+        if action == 'MOVE':
+            if count:
+                coordinate, last = robot.coordinate, robot.last_position
+                self.trajectory(robot).move(coordinate.x - last.x, coordinate.y - last.y, count)
+        else:
+            self.trajectory(robot).turn(OPCODES[action], self._id(robot.f))
+
+    def stream(self):
+        """
+        Append the names and records made since the last call to path, return the number of records bytes written
+        """
+        pending = [(name, trajectory) for name, trajectory in self.trajectories.items()
+                   if len(trajectory.records) > self.saved.get(name, 0)]
+        for name, trajectory in pending:
+            if name not in self.robot_ids:
+                self.robot_ids[name] = self._id(name)
+        data = bytearray()
+        if self.new_names:
+            payload = bytearray()
+            for i, name in self.new_names:
+                encoded = name.encode('utf-8')
+                payload += NAME_ENTRY.pack(i, len(encoded))
+                payload += encoded
+            data += BLOCK.pack(NAMES, len(self.new_names), len(payload))
+            data += payload
+            self.new_names = []
+        written = 0
+        for name, trajectory in pending:
+            records = trajectory.records[self.saved.get(name, 0):]
+            if sys.byteorder != 'little':
+                records.byteswap()
+            payload = records.tobytes()
+            data += BLOCK.pack(TRACK, self.robot_ids[name], len(payload))
+            data += payload
+            written += len(payload)
+            # records written out cannot be extended any more
+            trajectory._run = -1
+            if self.keep:
+                self.saved[name] = len(trajectory.records)
+            else:
+                trajectory.drop()
+        with open(self.path, 'ab') as stream:
+            stream.write(data)
+        return written
+
+
+def load(path, keyframe_interval=KEYFRAME_INTERVAL):
+    """
+    Load the trajectories streamed out to path, return a Recorder holding them
+    """
+    recorder = Recorder(keyframe_interval=keyframe_interval)
+    names = {}
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    position = 0
+    while position + BLOCK.size <= len(data):
+        tag, number, length = BLOCK.unpack_from(data, position)
+        position += BLOCK.size
+        payload = data[position:position + length]
+        position += length
+        if len(payload) < length:
+            break
+        if tag == NAMES:
+            offset = 0
+            for i in range(number):
+                name_id, size = NAME_ENTRY.unpack_from(payload, offset)
+                offset += NAME_ENTRY.size
+                names[name_id] = payload[offset:offset + size].decode('utf-8')
+                offset += size
+        elif tag == TRACK:
+            records = array('i')
+            records.frombytes(payload)
+            if sys.byteorder != 'little':
+                records.byteswap()
+            # map the table and direction ids of the file to the ids of the recorder
+            i = 0
+            while i < len(records):
+                op = records[i]
+                if op == PLACE:
+                    records[i + 1] = recorder._id(names[records[i + 1]])
+                    records[i + 2] = recorder._id(names[records[i + 2]])
+                elif op != MOVE:
+                    records[i + 1] = recorder._id(names[records[i + 1]])
+                i += WIDTHS[op]
+            recorder.trajectory(names[number]).extend(records)
+    recorder.new_names = []
+    return recorder
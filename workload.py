@@ -0,0 +1,126 @@
+"""
+Deterministic random workloads for benchmarks and soak tests. A Workload generates the command stream of N robots
+across M tables from a seed, in the line protocol of CommandEngine: robots are selected in turn at random for a
+burst of commands drawn from a weighted mix. The same seed always gives the same stream, which is generated chunk
+by chunk, so it can be streamed to a file or straight into a simulator without holding it in memory.
+"""
+import random
+
+from engine import CommandEngine
+from models import Robot
+
+# default weights of the commands of a workload
+MIX = {'MOVE': 6, 'LEFT': 2, 'RIGHT': 2, 'REPORT': 1}
+
+# commands a mix can have, PLACE puts the robot at a random position of its table again
+COMMANDS = ['MOVE', 'LEFT', 'RIGHT', 'REPORT', 'PLACE']
+
+# number of commands generated in one go
+CHUNK_COMMANDS = 1 << 14
+
+
+class Workload(object):
+    """
+    Workload of commands in total for robots robots on tables tables of dx x dy, the i-th robot counting from 0
+    being on the (i % tables)-th table.
+    Each robot is placed at random the first time it is selected, then gets bursts of burst commands drawn from
+    mix, a mapping of command to weight.
+    """
+
+    def __init__(self, robots=10, tables=1, commands=10000, mix=None, seed=0, dx=100, dy=100, burst=16):
+        mix = MIX if mix is None else mix
+        unknown = [command for command in mix if command not in COMMANDS]
+        if unknown or not any(weight > 0 for weight in mix.values()):
+            raise ValueError('Workload mix must give positive weights to commands of %s, not %s' % (COMMANDS, mix))
+        if robots < 1 or tables < 1 or burst < 1:
+            raise ValueError('Workload needs at least one robot, one table and bursts of one command')
+        self.robots = robots
+        self.tables = tables
+        self.commands = commands
+        self.mix = dict(mix)
+        self.seed = seed
+        self.dx = dx
+        self.dy = dy
+        self.burst = burst
+
+    def __repr__(self):
+        return "Workload(%s,%s,%s,%s)" % (self.robots, self.tables, self.commands, self.seed)
+
+    def table_params(self):
+        return [{'name': 'table%s' % (i + 1), 'dx': self.dx, 'dy': self.dy, 'rule': None}
+                for i in range(self.tables)]
+
+    def robot_names(self):
+        return ['robot%s' % (i + 1) for i in range(self.robots)]
+
+    # create the tables and robots of the workload in simulator
+    def deploy(self, simulator):
+        return simulator.deploy(self.table_params(), self.robot_names())
+
+    def chunks(self, chunk_commands=CHUNK_COMMANDS):
+        """
+        Yield the lines of the workload in lists of about chunk_commands commands, selection lines excluded. The
+        lines do not depend on chunk_commands, commands are drawn from their own random generator, and chunks are
+        rounded to whole bursts.
+        """
+        rnd = random.Random(self.seed)
+        draw = random.Random(rnd.getrandbits(64))
+        commands, weights = zip(*sorted(self.mix.items()))
+        directions = sorted(Robot.facing_directions)
+        dx, dy, burst = self.dx, self.dy, self.burst
+        placed = set()
+
+        def place():
+            f = directions[rnd.randrange(len(directions))]
+            return 'PLACE %s,%s,%s' % (rnd.randrange(dx), rnd.randrange(dy), f)
+
+        chunk_commands = max(chunk_commands // burst, 1) * burst
+        left = self.commands
+        while left > 0:
+            lines = []
+            todo = min(left, chunk_commands)
+            left -= todo
+            drawn = draw.choices(commands, weights, k=todo)
+            for start in range(0, todo, burst):
+                robot = rnd.randrange(self.robots)
+                lines.append('robot%s,table%s' % (robot + 1, robot % self.tables + 1))
+                if robot not in placed:
+                    placed.add(robot)
+                    lines.append(place())
+                part = drawn[start:start + burst]
+                if 'PLACE' in part:
+                    part = [place() if command == 'PLACE' else command for command in part]
+                lines.extend(part)
+            yield lines
+
+    def lines(self, chunk_commands=CHUNK_COMMANDS):
+        """
+        Yield the lines of the workload one by one
+        """
+        for lines in self.chunks(chunk_commands):
+            for line in lines:
+                yield line
+
+    def write(self, path, chunk_commands=CHUNK_COMMANDS):
+        """
+        Write the workload to a script file at path, one chunk at a time, return the number of lines written
+        """
+        count = 0
+        with open(path, 'w') as stream:
+            for lines in self.chunks(chunk_commands):
+                stream.write('\n'.join(lines))
+                stream.write('\n')
+                count += len(lines)
+        return count
+
+    def run(self, simulator, deploy=True):
+        """
+        Replay the workload through a CommandEngine of simulator, deploying its tables and robots first unless
+        deploy is False, return the number of REPORT results
+        """
+        if deploy:
+            self.deploy(simulator)
+        count = 0
+        for report in CommandEngine(simulator).run(self.lines()):
+            count += 1
+        return count